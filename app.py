@@ -1,16 +1,40 @@
 import os
+import asyncio
+import hmac
 import base64
 import uuid
 import logging
-from datetime import datetime
-from typing import Optional
-from fastapi import FastAPI, HTTPException, Request, status
-from fastapi.responses import JSONResponse
+from datetime import date, datetime
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Union
+from fastapi import FastAPI, HTTPException, Query, Request, status
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, field_validator
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
-from proposta import processar_proposta_webhook, formatar_moeda
+from entrada import (
+    EntradaProposta, EntradaUnidade, interpretar_valor, normalizar_codigo, normalizar_endereco, normalizar_nome,
+)
+from proposta import formatar_moeda, aquecer_renderizacao
+from distribuidoras import (
+    REAJUSTE_DESVIO_MAXIMO, REAJUSTE_MEDIO_LIMITES, listar_distribuidoras, normalizar_simulacao, obter_registro,
+    iniciar_monitoramento, parar_monitoramento,
+)
+from unidades import MAX_UNIDADES, encerrar_executor
+from exportacao import selecionar_arquivos, montar_plano, gerar_bytes, interpretar_range, nome_exportacao
+from historico import encerrar as encerrar_historico, consultar_resumos
+from layout import PERFIS_SAIDA
+from previa import FORMATOS_PREVIA
+from escalonador import Sobrecarga, classe_requisicao, escalonador, identificar_inquilino
+import fila_renderizacao
+import pre_render
+import rastreamento
+import memoria_compartilhada
+from simulacao import (
+    ANOS_PADRAO, CAMINHOS_PADRAO, MAX_ANOS, MAX_CAMINHOS, formatar_simulacao, simular_economia,
+)
+import midia
 
 # Configurar logging
 logging.basicConfig(
@@ -23,62 +47,340 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Token exigido pela exportação de propostas (sem token a rota fica desativada)
+EXPORTACAO_TOKEN = os.getenv('EXPORTACAO_TOKEN')
+# Token das análises agregadas (padrão: o mesmo da exportação)
+ANALISES_TOKEN = os.getenv('ANALISES_TOKEN') or EXPORTACAO_TOKEN
+
+def verificar_token(request: Request, token: Optional[str], mensagem: str):
+    """Exige 'Authorization: Bearer <token>'; sem token configurado a rota fica desativada"""
+    autorizacao = request.headers.get('authorization', '')
+    # Em bytes: compare_digest recusa str com caracteres fora do ASCII
+    if not token or not hmac.compare_digest(autorizacao.encode('utf-8', 'surrogateescape'),
+                                            f"Bearer {token}".encode('utf-8')):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=mensagem)
+
+async def aquecer_worker(app: FastAPI):
+    """Renderiza uma proposta sintética e marca o worker como pronto"""
+    try:
+        duracao = await asyncio.to_thread(aquecer_renderizacao)
+        app.state.pronto = True
+        logger.info(f"Worker pronto (aquecimento em {duracao:.2f}s)")
+    except Exception as e:
+        logger.error(f"Falha no aquecimento do worker: {str(e)}", exc_info=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # O aquecimento roda em segundo plano para que a rota de liveness (/)
+    # responda enquanto /ready ainda retorna 503
+    app.state.pronto = False
+    tarefa_aquecimento = asyncio.create_task(aquecer_worker(app))
+    # Tabela de tarifas recarregada sem reiniciar o processo
+    iniciar_monitoramento()
+    yield
+    tarefa_aquecimento.cancel()
+    parar_monitoramento()
+    encerrar_executor()
+    # Grava os registros do histórico ainda na fila
+    encerrar_historico()
+
 # Configurar rate limiting
 limiter = Limiter(key_func=get_remote_address)
-app = FastAPI(title="Proposta FastAPI", version="1.0.0")
+app = FastAPI(title="Proposta FastAPI", version="1.0.0", lifespan=lifespan)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+@app.middleware("http")
+async def rastrear_requisicao(request: Request, call_next):
+    """Span raiz de cada requisição, continuando o `traceparent` recebido (rastreamento.py)"""
+    if not rastreamento.ATIVO:
+        return await call_next(request)
+    with rastreamento.span(f"{request.method} {request.url.path}", contexto=request.headers.get("traceparent"),
+                           tipo=rastreamento.SERVIDOR, raiz=True, **{"http.method": request.method,
+                                                          "http.target": request.url.path}) as atual:
+        resposta = await call_next(request)
+        rota = request.scope.get("route")
+        if rota is not None:
+            atual.nome = f"{request.method} {rota.path}"
+        atual.definir(**{"http.status_code": resposta.status_code})
+        if resposta.status_code >= 500:
+            atual.falhar(f"HTTP {resposta.status_code}")
+        resposta.headers["traceparent"] = atual.traceparent
+        resposta.headers["X-Trace-Id"] = atual.trace_id
+    return resposta
+
+def validar_nome(v):
+    """Valida e normaliza o nome completo (entrada.normalizar_nome)"""
+    return normalizar_nome(v)
+
+def validar_endereco(v):
+    """Valida e normaliza o endereço (entrada.normalizar_endereco)"""
+    return normalizar_endereco(v)
+
+def validar_valor_fatura(v):
+    """Interpreta o valor da fatura ('R$ 1.234,56', '1234.56', ...) como float"""
+    return interpretar_valor(v)
+
+def validar_distribuidora(v):
+    """Valida o código da distribuidora contra o registro"""
+    v = normalizar_codigo(v)
+    if v is None:
+        return v
+    if v not in listar_distribuidoras():
+        raise ValueError(f"Distribuidora desconhecida. Disponíveis: {', '.join(listar_distribuidoras())}")
+    return v
+
+def validar_perfil(v):
+    """Valida o perfil de saída do PDF (screen, print ou archive)"""
+    if v is None:
+        return v
+    v = v.strip().lower()
+    if v not in PERFIS_SAIDA:
+        raise ValueError(f"Perfil de saída desconhecido. Disponíveis: {', '.join(PERFIS_SAIDA)}")
+    return v
+
+def validar_previa(v):
+    """Valida o formato da prévia em imagem (png ou webp)"""
+    if v is None:
+        return v
+    v = v.strip().lower()
+    if v not in FORMATOS_PREVIA:
+        raise ValueError(f"Formato de prévia desconhecido. Disponíveis: {', '.join(FORMATOS_PREVIA)}")
+    return v
+
+# Opções da simulação de bandeiras (None usa a configuração da distribuidora)
+class SimulacaoOpcoes(BaseModel):
+    caminhos: int = CAMINHOS_PADRAO
+    anos: int = ANOS_PADRAO
+    semente: Optional[int] = None
+    bandeiras: Optional[Dict[str, float]] = None
+    reajuste_medio: Optional[float] = None
+    reajuste_desvio: Optional[float] = None
+    
+    @field_validator('caminhos')
+    @classmethod
+    def validate_caminhos(cls, v):
+        if not 1 <= v <= MAX_CAMINHOS:
+            raise ValueError(f'Quantidade de caminhos deve estar entre 1 e {MAX_CAMINHOS}')
+        return v
+    
+    @field_validator('anos')
+    @classmethod
+    def validate_anos(cls, v):
+        if not 1 <= v <= MAX_ANOS:
+            raise ValueError(f'Horizonte deve estar entre 1 e {MAX_ANOS} anos')
+        return v
+    
+    @field_validator('semente')
+    @classmethod
+    def validate_semente(cls, v):
+        if v is not None and not 0 <= v < 2 ** 63:
+            raise ValueError('Semente deve estar entre 0 e 2^63 - 1')
+        return v
+    
+    @field_validator('bandeiras')
+    @classmethod
+    def validate_bandeiras(cls, v):
+        if v is not None:
+            normalizar_simulacao({'bandeiras': v})
+        return v
+    
+    @field_validator('reajuste_medio')
+    @classmethod
+    def validate_reajuste_medio(cls, v):
+        minimo, maximo = REAJUSTE_MEDIO_LIMITES
+        if v is not None and not minimo <= v <= maximo:
+            raise ValueError(f'Reajuste anual médio deve estar entre {minimo} e {maximo}')
+        return v
+    
+    @field_validator('reajuste_desvio')
+    @classmethod
+    def validate_reajuste_desvio(cls, v):
+        if v is not None and not 0 <= v <= REAJUSTE_DESVIO_MAXIMO:
+            raise ValueError(f'Desvio do reajuste anual deve estar entre 0 e {REAJUSTE_DESVIO_MAXIMO}')
+        return v
+
+class SimulacaoData(SimulacaoOpcoes):
+    valor_fatura: Union[str, float]
+    distribuidora: Optional[str] = None
+    
+    @field_validator('valor_fatura', mode='before')
+    @classmethod
+    def validate_valor_fatura(cls, v):
+        return validar_valor_fatura(v)
+    
+    @field_validator('distribuidora')
+    @classmethod
+    def validate_distribuidora(cls, v):
+        return validar_distribuidora(v)
+
 # Modelo Pydantic para validação dos dados do webhook
 class WebhookData(BaseModel):
     nome_completo: str
     endereco: str
-    valor_fatura: str
+    valor_fatura: Union[str, float]
+    distribuidora: Optional[str] = None
+    perfil: Optional[str] = None
+    previa: Optional[str] = None
+    simulacao: Optional[SimulacaoOpcoes] = None
     
     @field_validator('nome_completo')
     @classmethod
     def validate_nome_completo(cls, v):
-        if not v or len(v.strip()) < 3:
-            raise ValueError('Nome completo deve ter pelo menos 3 caracteres')
-        return v.strip()
+        return validar_nome(v)
+    
+    @field_validator('endereco')
+    @classmethod
+    def validate_endereco(cls, v):
+        return validar_endereco(v)
+    
+    @field_validator('valor_fatura', mode='before')
+    @classmethod
+    def validate_valor_fatura(cls, v):
+        return validar_valor_fatura(v)
+    
+    @field_validator('distribuidora')
+    @classmethod
+    def validate_distribuidora(cls, v):
+        return validar_distribuidora(v)
+    
+    @field_validator('perfil')
+    @classmethod
+    def validate_perfil(cls, v):
+        return validar_perfil(v)
+    
+    @field_validator('previa')
+    @classmethod
+    def validate_previa(cls, v):
+        return validar_previa(v)
+
+# Modelos para propostas de várias unidades consumidoras
+class UnidadeConsumidoraData(BaseModel):
+    endereco: str
+    valor_fatura: Union[str, float]
     
     @field_validator('endereco')
     @classmethod
     def validate_endereco(cls, v):
-        if not v or len(v.strip()) < 10:
-            raise ValueError('Endereço deve ter pelo menos 10 caracteres')
-        return v.strip()
+        return validar_endereco(v)
     
-    @field_validator('valor_fatura')
+    @field_validator('valor_fatura', mode='before')
     @classmethod
     def validate_valor_fatura(cls, v):
+        return validar_valor_fatura(v)
+
+class WebhookUnidadesData(BaseModel):
+    nome_completo: str
+    unidades: List[UnidadeConsumidoraData]
+    distribuidora: Optional[str] = None
+    perfil: Optional[str] = None
+    
+    @field_validator('nome_completo')
+    @classmethod
+    def validate_nome_completo(cls, v):
+        return validar_nome(v)
+    
+    @field_validator('unidades')
+    @classmethod
+    def validate_unidades(cls, v):
         if not v:
-            raise ValueError('Valor da fatura é obrigatório')
-        
-        # Remover caracteres não numéricos exceto vírgula e ponto
-        valor_limpo = ''.join(c for c in v if c.isdigit() or c in '.,')
-        
-        if not valor_limpo:
-            raise ValueError('Valor da fatura deve conter números')
-        
-        # Converter vírgula para ponto se necessário
-        if ',' in valor_limpo:
-            valor_limpo = valor_limpo.replace(',', '.')
-        
-        try:
-            valor_float = float(valor_limpo)
-            if valor_float <= 0:
-                raise ValueError('Valor da fatura deve ser maior que zero')
-            if valor_float > 99999.99:
-                raise ValueError('Valor da fatura muito alto')
-            return str(valor_float)
-        except ValueError:
-            raise ValueError('Valor da fatura deve ser um número válido')
+            raise ValueError('Informe ao menos uma unidade consumidora')
+        if len(v) > MAX_UNIDADES:
+            raise ValueError(f'Máximo de {MAX_UNIDADES} unidades consumidoras por proposta')
+        return v
+    
+    @field_validator('distribuidora')
+    @classmethod
+    def validate_distribuidora(cls, v):
+        return validar_distribuidora(v)
+    
+    @field_validator('perfil')
+    @classmethod
+    def validate_perfil(cls, v):
+        return validar_perfil(v)
 
 @app.get("/")
 async def root():
     return {"status": 200, "message": "Proposta FastAPI - Sistema de Webhook para Geração de Propostas", "version": "1.1.0", "proprietario": "Energia A", "contato admin": "viegas@energiaa.com.br"}
 
+@app.get("/ready")
+async def ready(request: Request):
+    """Readiness: retorna 200 somente depois que o aquecimento do worker terminou"""
+    if not request.app.state.pronto:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": 503, "message": "Aquecendo"}
+        )
+    return {"status": 200, "message": "Pronto"}
+
+@app.get("/distribuidoras")
+async def distribuidoras():
+    """Lista as distribuidoras aceitas no campo 'distribuidora' do webhook"""
+    registro = obter_registro()
+    return {
+        "status": 200,
+        "versao_tarifas": registro['versao'],
+        "distribuidoras": [
+            {"codigo": codigo, "nome": distribuidora['nome']}
+            for codigo, distribuidora in registro['distribuidoras'].items()
+        ]
+    }
+
+@app.post("/cotacao")
+@limiter.limit("30/minute")
+async def cotacao(request: Request, data: WebhookData):
+    """
+    Cotação: os valores da proposta sem gerar o PDF
+    
+    Recebe os mesmos dados do /webhook_proposta e retorna o desconto e a
+    economia. Com PRE_RENDER=1 agenda a pré-renderização especulativa da
+    proposta (classe pre_render), para que o webhook seguinte com os mesmos
+    dados apenas entregue o PDF; 'pre_render' informa se foi agendada.
+    """
+    from distribuidoras import obter_distribuidora
+    from proposta import calcular_parametros_automaticos, calcular_valores_financeiros
+    
+    client_ip = get_remote_address(request)
+    entrada = EntradaProposta(data.nome_completo, data.endereco, data.valor_fatura, data.distribuidora)
+    simulacao = data.simulacao.model_dump() if data.simulacao else None
+    
+    def cotar():
+        distribuidora = obter_distribuidora(entrada.distribuidora)
+        parametros = calcular_parametros_automaticos(
+            nome_completo=entrada.nome,
+            endereco_completo=entrada.endereco,
+            valor_fatura_cliente=entrada.valor_fatura,
+            distribuidora=distribuidora,
+        )
+        valores = calcular_valores_financeiros(parametros, distribuidora)
+        chave = pre_render.chave_especulacao(entrada, data.perfil, data.previa, simulacao, distribuidora)
+        return parametros, valores, chave
+    
+    try:
+        parametros, valores, chave = await asyncio.to_thread(cotar)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    situacao = await pre_render.agendar(
+        {'entrada': entrada._asdict(), 'perfil': data.perfil, 'previa': data.previa, 'simulacao': simulacao},
+        inquilino=identificar_inquilino(request.headers, client_ip),
+        chave=chave,
+    )
+    return {
+        "status": "sucesso",
+        "valor_desconto": formatar_moeda(valores['valor_desconto']),
+        "economia_ano": formatar_moeda(valores['economia_ano']),
+        "economia_5ano": formatar_moeda(valores['economia_5ano']),
+        "pre_render": situacao,
+        "dados_processados": {
+            "nome_completo": data.nome_completo,
+            "endereco": data.endereco,
+            "valor_fatura": str(data.valor_fatura),
+            "distribuidora": parametros['distribuidora'],
+            "versao_tarifas": parametros['versao_tarifas'],
+            "timestamp": datetime.now().isoformat()
+        }
+    }
+
 @app.post("/webhook_proposta")
 @limiter.limit("10/minute")  # Limite de 10 requisições por minuto por IP
 async def webhook_proposta(request: Request, data: WebhookData):
@@ -100,10 +402,20 @@ async def webhook_proposta(request: Request, data: WebhookData):
             logger.info(f"Diretório media criado: {media_dir}")
         
         # Processar dados através do proposta.py
-        resultado = processar_proposta_webhook(
-            nome_completo=data.nome_completo,
-            endereco=data.endereco,
-            valor_fatura=data.valor_fatura
+        # Entrada já normalizada pelo modelo: o motor não interpreta de novo
+        entrada = EntradaProposta(data.nome_completo, data.endereco, data.valor_fatura, data.distribuidora)
+        # Renderização interativa: passa na frente dos lotes, justa entre inquilinos
+        # (no próprio processo ou, com FILA_URL, nos nós de renderização)
+        resultado = await fila_renderizacao.executar(
+            'proposta',
+            {
+                'entrada': entrada._asdict(),
+                'perfil': data.perfil,
+                'previa': data.previa,
+                'simulacao': data.simulacao.model_dump() if data.simulacao else None,
+            },
+            classe=classe_requisicao(request.headers),
+            inquilino=identificar_inquilino(request.headers, client_ip),
         )
         
         if not resultado['sucesso']:
@@ -129,14 +441,21 @@ async def webhook_proposta(request: Request, data: WebhookData):
         nome_arquivo_media = os.path.basename(arquivo_path)
         
         # Ler arquivo e converter para base64
-        with open(arquivo_media_path, 'rb') as f:
-            arquivo_bytes = f.read()
+        with rastreamento.span('disco.leitura'):
+            with open(arquivo_media_path, 'rb') as f:
+                arquivo_bytes = f.read()
+        with rastreamento.span('resposta.base64', bytes=len(arquivo_bytes)):
             arquivo_base64 = base64.b64encode(arquivo_bytes).decode('utf-8')
         
-        # Construir URL completa do arquivo
+        # Construir URL completa do arquivo, com a versão do conteúdo (?v=)
         # Nota: Em produção, você deve configurar o domínio correto
         base_url = str(request.base_url).rstrip('/')
-        arquivo_url = f"{base_url}/media/{nome_arquivo_media}"
+        etag = midia.registrar_conteudo(arquivo_media_path, arquivo_bytes)
+        arquivo_url = midia.url_arquivo(base_url, arquivo_media_path, etag)
+        # Prévia em imagem gravada ao lado do PDF, servida pela sua própria URL
+        previa_url = None
+        if resultado['previa_path']:
+            previa_url = midia.url_arquivo(base_url, resultado['previa_path'])
         
         # Log de sucesso
         logger.info(f"Proposta gerada com sucesso: {nome_arquivo_media}")
@@ -148,19 +467,26 @@ async def webhook_proposta(request: Request, data: WebhookData):
             "arquivo_url": arquivo_url,
             "arquivo_nome": nome_arquivo_media,
             "arquivo_base64": arquivo_base64,
+            "previa_url": previa_url,
+            "simulacao": formatar_simulacao(resultado['simulacao']) if resultado['simulacao'] else None,
             "valor_desconto": formatar_moeda(resultado['valor_desconto']),
             "economia_ano":  formatar_moeda(resultado['economia_ano']),
             "economia_5ano": formatar_moeda(resultado['economia_5ano']),
             "dados_processados": {
                 "nome_completo": data.nome_completo,
                 "endereco": data.endereco,
-                "valor_fatura": data.valor_fatura,
+                "valor_fatura": str(data.valor_fatura),
+                "distribuidora": resultado['dados_processados']['distribuidora'],
+                "versao_tarifas": resultado['dados_processados']['versao_tarifas'],
                 "timestamp": datetime.now().isoformat()
             }
         }
         
-    except HTTPException:
+    except (HTTPException, Sobrecarga):
         raise
+    except TimeoutError as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
     except Exception as e:
         logger.error(f"Erro inesperado no webhook: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -168,6 +494,286 @@ async def webhook_proposta(request: Request, data: WebhookData):
             detail=f"Erro interno do servidor: {str(e)}"
         )
 
+@app.post("/simulacao_bandeiras")
+@limiter.limit("30/minute")
+async def simulacao_bandeiras(request: Request, data: SimulacaoData):
+    """
+    Simula a economia do cliente com bandeiras sorteadas mês a mês (Monte Carlo)
+    
+    Retorna a economia mensal média, do primeiro ano, do contrato e acumulada
+    por ano (média e percentis P5/P50/P95), sem gerar PDF. A mesma `semente`
+    reproduz o mesmo resultado. A simulação ocupa uma vaga do escalonador
+    (classe da requisição), como uma renderização.
+    """
+    from distribuidoras import obter_distribuidora
+    from proposta import calcular_parametros_automaticos, calcular_valores_financeiros
+    
+    def simular():
+        distribuidora = obter_distribuidora(data.distribuidora)
+        parametros = calcular_parametros_automaticos(valor_fatura_cliente=data.valor_fatura,
+                                                     distribuidora=distribuidora)
+        valores = calcular_valores_financeiros(parametros, distribuidora)
+        opcoes = data.model_dump(exclude={'valor_fatura', 'distribuidora'})
+        return parametros, simular_economia(valores, distribuidora, **opcoes)
+    
+    try:
+        parametros, resultado = await escalonador.executar(
+            simular,
+            classe=classe_requisicao(request.headers),
+            inquilino=identificar_inquilino(request.headers, get_remote_address(request)),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    return {
+        "status": "sucesso",
+        "valor_fatura": str(data.valor_fatura),
+        "distribuidora": parametros['distribuidora'],
+        "versao_tarifas": parametros['versao_tarifas'],
+        **formatar_simulacao(resultado),
+    }
+
+@app.post("/webhook_proposta_unidades")
+@limiter.limit("2/minute")  # Propostas com muitas unidades são mais pesadas
+async def webhook_proposta_unidades(request: Request, data: WebhookUnidadesData):
+    """
+    Endpoint webhook para clientes com várias unidades consumidoras
+    
+    Gera um PDF com uma página de resumo e uma página por unidade. O arquivo
+    pode ter centenas de páginas, por isso é retornado apenas pela URL.
+    """
+    try:
+        client_ip = get_remote_address(request)
+        logger.info(f"Webhook de unidades recebido de {client_ip} - Nome: {data.nome_completo} "
+                    f"- Unidades: {len(data.unidades)}")
+        
+        # A geração roda fora do event loop, na classe de lote do escalonador,
+        # com custo proporcional ao número de páginas
+        resultado = await fila_renderizacao.executar(
+            'unidades',
+            {
+                'nome_completo': data.nome_completo,
+                'unidades': [EntradaUnidade(unidade.endereco, unidade.valor_fatura)._asdict()
+                             for unidade in data.unidades],
+                'distribuidora': data.distribuidora,
+                'perfil': data.perfil,
+            },
+            classe=classe_requisicao(request.headers, 'lote'),
+            inquilino=identificar_inquilino(request.headers, client_ip),
+            custo=len(data.unidades) + 1,
+        )
+        
+        if not resultado['sucesso']:
+            logger.error(f"Erro no processamento: {resultado['erro']}")
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Erro no processamento: {resultado['erro']}"
+            )
+        
+        nome_arquivo_media = os.path.basename(resultado['arquivo_path'])
+        base_url = str(request.base_url).rstrip('/')
+        # O arquivo pode ser grande: o hash da versão é calculado fora do event loop
+        arquivo_url = await asyncio.to_thread(midia.url_arquivo, base_url, resultado['arquivo_path'])
+        logger.info(f"Proposta de unidades gerada com sucesso: {nome_arquivo_media}")
+        
+        return {
+            "status": "sucesso",
+            "message": "Proposta gerada com sucesso",
+            "arquivo_url": arquivo_url,
+            "arquivo_nome": nome_arquivo_media,
+            "unidades": resultado['unidades'],
+            "valor_desconto": formatar_moeda(resultado['valor_desconto']),
+            "economia_ano": formatar_moeda(resultado['economia_ano']),
+            "economia_5ano": formatar_moeda(resultado['economia_5ano']),
+            "dados_processados": {
+                "nome_completo": data.nome_completo,
+                "distribuidora": resultado['dados_processados']['distribuidora'],
+                "versao_tarifas": resultado['dados_processados']['versao_tarifas'],
+                "timestamp": datetime.now().isoformat()
+            }
+        }
+        
+    except (HTTPException, Sobrecarga):
+        raise
+    except TimeoutError as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+    except Exception as e:
+        logger.error(f"Erro inesperado no webhook de unidades: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro interno do servidor: {str(e)}"
+        )
+
+@app.api_route("/exportar", methods=["GET", "HEAD"])
+async def exportar(
+    request: Request,
+    inicio: Optional[date] = None,
+    fim: Optional[date] = None,
+    distribuidora: Optional[str] = None,
+    status_proposta: Optional[str] = Query(None, alias="status")
+):
+    """
+    Exporta as propostas do período em um ZIP gerado em streaming
+    
+    Requer o cabeçalho 'Authorization: Bearer <EXPORTACAO_TOKEN>'. Aceita
+    Range (um intervalo) e If-Range para retomar downloads interrompidos.
+    """
+    verificar_token(request, EXPORTACAO_TOKEN, "Exportação não autorizada")
+    # O código entra no nome do arquivo (Content-Disposition): só os cadastrados
+    try:
+        distribuidora = validar_distribuidora(distribuidora)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    
+    # Consultar o histórico e montar o plano não bloqueia o event loop
+    registros = await asyncio.to_thread(selecionar_arquivos, inicio, fim, distribuidora, status_proposta)
+    plano = montar_plano(registros)
+    tamanho = plano['tamanho']
+    cabecalhos = {
+        "Accept-Ranges": "bytes",
+        "ETag": plano['etag'],
+        "Content-Disposition": f'attachment; filename="{nome_exportacao(inicio, fim, distribuidora)}"',
+        "X-Quantidade-Propostas": str(plano['quantidade']),
+    }
+    
+    # If-Range: só retoma se o conteúdo for o mesmo do download anterior
+    intervalo = None
+    if_range = request.headers.get('if-range')
+    if if_range is None or if_range == plano['etag']:
+        try:
+            intervalo = interpretar_range(request.headers.get('range'), tamanho)
+        except ValueError:
+            return Response(status_code=416,  # Range Not Satisfiable
+                            headers={"Content-Range": f"bytes */{tamanho}", **cabecalhos})
+    
+    if intervalo is None:
+        inicio_bytes, fim_bytes, codigo = 0, tamanho - 1, status.HTTP_200_OK
+    else:
+        inicio_bytes, fim_bytes = intervalo
+        codigo = status.HTTP_206_PARTIAL_CONTENT
+        cabecalhos["Content-Range"] = f"bytes {inicio_bytes}-{fim_bytes}/{tamanho}"
+    cabecalhos["Content-Length"] = str(fim_bytes - inicio_bytes + 1)
+    
+    logger.info(f"Exportação: {plano['quantidade']} propostas, bytes {inicio_bytes}-{fim_bytes}/{tamanho}")
+    if request.method == "HEAD":
+        return Response(status_code=codigo, headers=cabecalhos, media_type="application/zip")
+    # Gerador síncrono: o Starlette o consome em uma thread, bloco a bloco
+    return StreamingResponse(gerar_bytes(plano, inicio_bytes, fim_bytes), status_code=codigo,
+                             headers=cabecalhos, media_type="application/zip")
+
+@app.get("/analises")
+async def analises(
+    request: Request,
+    agrupar: str = "dia",
+    inicio: Optional[date] = None,
+    fim: Optional[date] = None,
+    distribuidora: Optional[str] = None,
+    cidade: Optional[str] = None,
+    faixa: Optional[str] = None
+):
+    """
+    Totais e distribuição de valor_desconto, economia_ano e economia_5ano
+    
+    Agrupa por qualquer combinação de dia, cidade, faixa e distribuidora
+    (ex.: agrupar=dia,cidade; vazio retorna só o total). Consulta apenas os
+    resumos mantidos pelo histórico. Requer 'Authorization: Bearer <ANALISES_TOKEN>'.
+    """
+    verificar_token(request, ANALISES_TOKEN, "Análises não autorizadas")
+    dimensoes = [dimensao.strip() for dimensao in agrupar.split(',') if dimensao.strip()]
+    try:
+        resultado = await asyncio.to_thread(consultar_resumos, dimensoes, inicio, fim, distribuidora, cidade, faixa)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {"status": "sucesso", "agrupar": dimensoes, **resultado}
+
+@app.get("/metricas")
+async def metricas(request: Request, formato: str = "json"):
+    """
+    Métricas do escalonador de renderização
+    
+    Por classe de prioridade (interativa, lote, pre_render): limite de
+    simultâneas, trabalhos em execução e na fila, concluídos, promovidos por
+    envelhecimento e tempo de espera na fila (média, P50, P95 e máximo).
+    Com a fila compartilhada (FILA_URL), também os trabalhos pendentes,
+    reservados e mortos do broker, os contadores da pré-renderização
+    especulativa (agendadas, acertos, taxa de acerto) e os rastros mantidos
+    pela amostragem e a ocupação e os acertos da memória compartilhada entre
+    os workers (MEMORIA_COMPARTILHADA). Com formato=prometheus retorna o histograma de espera
+    no formato de texto do Prometheus. Requer 'Authorization: Bearer <ANALISES_TOKEN>'.
+    """
+    verificar_token(request, ANALISES_TOKEN, "Métricas não autorizadas")
+    if formato == "prometheus":
+        return Response(escalonador.metricas_prometheus(), media_type="text/plain; version=0.0.4")
+    broker = fila_renderizacao.obter_broker()
+    fila = await asyncio.to_thread(broker.metricas) if broker is not None else None
+    return {"status": "sucesso", **escalonador.metricas(), "fila": fila, "pre_render": pre_render.metricas(),
+            "rastreamento": rastreamento.metricas(),
+            "memoria_compartilhada": await asyncio.to_thread(memoria_compartilhada.metricas)}
+
+@app.get("/rastros")
+async def rastros(request: Request, limite: int = Query(50, ge=1, le=500), minimo_ms: float = 0.0):
+    """
+    Rastros mantidos pela amostragem na cauda (RASTREAMENTO=memoria)
+    
+    Do mais recente ao mais antigo, cada um com a duração, o motivo
+    (erro, lento ou amostra) e os spans de todas as etapas no formato
+    OTLP/JSON. Com minimo_ms retorna só os mais lentos que isso. Requer
+    'Authorization: Bearer <ANALISES_TOKEN>'.
+    """
+    verificar_token(request, ANALISES_TOKEN, "Rastros não autorizados")
+    return {"status": "sucesso", **rastreamento.metricas(),
+            "rastros": rastreamento.listar_rastros(limite, minimo_ms)}
+
+@app.api_route("/media/{nome_arquivo}", methods=["GET", "HEAD"])
+async def servir_media(
+    request: Request,
+    nome_arquivo: str,
+    v: Optional[str] = None,
+    exp: Optional[int] = None,
+    kid: Optional[str] = None,
+    sig: Optional[str] = None
+):
+    """
+    Serve os PDFs e prévias gerados em media/
+    
+    ETag forte do conteúdo, cache imutável quando a URL traz a versão atual
+    (?v=), 304 para If-None-Match/If-Modified-Since e intervalos Range. Com
+    MIDIA_X_ACCEL_REDIRECT o corpo é enviado pelo nginx. Com MIDIA_CHAVES_URL
+    só aceita URLs assinadas e dentro da validade.
+    """
+    validade = None
+    if midia.assinatura_ativa():
+        try:
+            validade = midia.verificar_assinatura(nome_arquivo, v, exp, kid, sig)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
+    
+    caminho = midia.resolver_arquivo(nome_arquivo)
+    if caminho is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Arquivo não encontrado")
+    
+    info = os.stat(caminho)
+    # Em cache desde a gravação ou o último acesso; senão o arquivo é lido fora do event loop
+    etag = await asyncio.to_thread(midia.etag_arquivo, caminho, info)
+    cabecalhos = midia.cabecalhos_arquivo(info, etag, v, validade)
+    if midia.nao_modificado(request.headers, etag, info.st_mtime):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cabecalhos)
+    
+    if midia.X_ACCEL_REDIRECT:
+        cabecalhos["X-Accel-Redirect"] = midia.caminho_x_accel(nome_arquivo)
+        return Response(headers=cabecalhos, media_type=midia.tipo_conteudo(caminho))
+    return FileResponse(caminho, headers=cabecalhos, media_type=midia.tipo_conteudo(caminho), stat_result=info)
+
+@app.exception_handler(Sobrecarga)
+async def sobrecarga_handler(request: Request, exc: Sobrecarga):
+    """Recusa cedo o que não seria renderizado a tempo (503 com Retry-After)"""
+    logger.warning(f"Requisição recusada por sobrecarga ({get_remote_address(request)}): {str(exc)}")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(exc.tentar_em)},
+        content={"status": 503, "message": str(exc), "tentar_em": exc.tentar_em}
+    )
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """Handler global para exceções não tratadas"""
@@ -181,14 +787,6 @@ async def global_exception_handler(request: Request, exc: Exception):
         }
     )
 
-# Endpoint para servir arquivos da pasta media (opcional, para desenvolvimento)
-from fastapi.staticfiles import StaticFiles
-
-# Verificar se a pasta media existe antes de montar
-media_path = os.path.join(os.path.dirname(__file__), 'media')
-if os.path.exists(media_path):
-    app.mount("/media", StaticFiles(directory=media_path), name="media")
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
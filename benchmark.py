@@ -0,0 +1,829 @@
+"""
+Suíte de benchmarks do gerador de propostas
+
+Uso:
+    python benchmark.py                 # executa todos os benchmarks
+    python benchmark.py importacao      # executa apenas os benchmarks indicados
+
+Cada benchmark imprime suas medições e retorna False quando um orçamento
+definido abaixo é excedido; nesse caso o script termina com código 1.
+"""
+
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+
+# Orçamento de tempo de importação do módulo proposta (python -X importtime)
+ORCAMENTO_IMPORTACAO_MS = 50.0
+# Atualizar a figura reutilizada do gráfico, em fração do tempo de montá-la pelo pyplot
+ORCAMENTO_GRAFICO_ATUALIZACAO_FRACAO = 0.25
+# Bibliotecas que não podem ser carregadas pela simples importação do módulo
+MODULOS_PESADOS = ('matplotlib', 'numpy', 'reportlab')
+# Orçamento da prévia em imagem por proposta (base do layout já montada; mediana)
+ORCAMENTO_PREVIA_MS = 150.0
+# Vazão mínima da normalização de entradas (valores interpretados por segundo; mediana)
+ORCAMENTO_ENTRADA_POR_SEGUNDO = 250_000
+# Vazão mínima da precificação em lote (leads por segundo, NumPy int64)
+ORCAMENTO_LOTE_POR_SEGUNDO = 1_000_000
+# Vazão mínima da formatação pt-BR de valores monetários (textos por segundo)
+ORCAMENTO_FORMATACAO_POR_SEGUNDO = 500_000
+# Orçamento da simulação de bandeiras de um cliente (100 mil caminhos, 5 anos)
+ORCAMENTO_SIMULACAO_MS = 150.0
+# Espera máxima de uma proposta interativa na fila com um lote grande em andamento,
+# em durações de renderização (no máximo o fim de uma renderização, mais folga)
+ORCAMENTO_ESPERA_INTERATIVA = 1.5
+# Latência P95 das requisições aceitas sob sobrecarga, em prazos de espera da fila
+# (sem recusa a latência cresce com a fila; com limite adaptativo fica perto do prazo)
+ORCAMENTO_LATENCIA_SOBRECARGA = 2.0
+# Vazão mínima da fila compartilhada SQLite (trabalhos enfileirados, reservados,
+# concluídos e com o resultado lido por segundo, com quatro workers)
+ORCAMENTO_FILA_POR_SEGUNDO = 500
+# Latência do webhook servido pela pré-renderização especulativa, em fração da
+# latência da renderização completa
+ORCAMENTO_PRE_RENDER_FRACAO = 0.3
+# Custo de um span com o rastreamento ativo (microssegundos, rastro descartado na cauda)
+ORCAMENTO_SPAN_US = 25.0
+# Leitura de um PDF de 2 MB gravado por outro processo na memória compartilhada
+# (ms, com as faltas de página da primeira leitura; renderizar custa ~400 ms)
+ORCAMENTO_MEMORIA_COMPARTILHADA_MS = 8.0
+# Revalidação (304) de um arquivo de media/ pela rota, com o ETag já em cache (ms)
+ORCAMENTO_MIDIA_304_MS = 10.0
+
+
+def medir_tempo_importacao(modulo):
+    """Executa `python -X importtime` e retorna o tempo cumulativo (ms) do módulo"""
+    resultado = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {modulo}'],
+        cwd=DIRETORIO, capture_output=True, text=True, check=True
+    )
+    padrao = re.compile(r'import time:\s+\d+\s+\|\s+(\d+)\s+\|\s+(\S+)\s*$')
+    for linha in resultado.stderr.splitlines():
+        encontrado = padrao.match(linha)
+        if encontrado and encontrado.group(2) == modulo:
+            return int(encontrado.group(1)) / 1000
+    raise RuntimeError(f"Módulo {modulo} não encontrado na saída de importtime")
+
+
+def benchmark_importacao():
+    """Verifica o orçamento de tempo de importação e a ausência de bibliotecas pesadas"""
+    # Melhor de 3 execuções para reduzir o ruído do sistema de arquivos
+    tempo_ms = min(medir_tempo_importacao('proposta') for _ in range(3))
+    print(f"Importação de proposta: {tempo_ms:.1f} ms (orçamento {ORCAMENTO_IMPORTACAO_MS:.0f} ms)")
+
+    codigo = (
+        "import sys, proposta; "
+        f"print(','.join(m for m in {MODULOS_PESADOS!r} if m in sys.modules))"
+    )
+    carregados = subprocess.run(
+        [sys.executable, '-c', codigo],
+        cwd=DIRETORIO, capture_output=True, text=True, check=True
+    ).stdout.strip()
+    if carregados:
+        print(f"Bibliotecas pesadas carregadas na importação: {carregados}")
+
+    return tempo_ms <= ORCAMENTO_IMPORTACAO_MS and not carregados
+
+
+def cronometrar(funcao, repeticoes):
+    """
+    Retorna a mediana do tempo (ms) de `repeticoes` chamadas de funcao(),
+    depois de uma chamada de aquecimento (menos sensível a ruído do host)
+    """
+    funcao()
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tempos)
+
+
+def _grafico_pyplot(sem_geracao, com_geracao, consumo_minimo, taxa_iluminacao, desconto):
+    """
+    Monta a figura como o gerar_grafico() original: figura nova pelo pyplot a
+    cada chamada, com barras, linhas, textos, legenda e tight_layout (referência)
+    """
+    import matplotlib.pyplot as plt
+    import numpy as np
+    from formatacao import formatar_moeda
+
+    with plt.style.context('ggplot'):
+        fig, ax = plt.subplots(figsize=(10, 8.5))
+        fig.patch.set_alpha(0.0)
+        ax.patch.set_alpha(0.0)
+        plt.subplots_adjust(left=0.2)
+        x = np.array([0.3, 0.7])
+        maximo = max(sem_geracao, com_geracao)
+        y_max = np.ceil(maximo / 100) * 100
+        for y in np.linspace(0, y_max, 7):
+            ax.hlines(y=y, xmin=0, xmax=1.0, colors='white', linewidth=1, zorder=1)
+            ax.text(-0.03, y, f"R$ {formatar_moeda(int(y))}", color='white', va='center', ha='right', fontsize=18)
+        alturas = ((taxa_iluminacao, consumo_minimo, sem_geracao - consumo_minimo - taxa_iluminacao),
+                   (taxa_iluminacao, consumo_minimo, com_geracao - consumo_minimo - taxa_iluminacao))
+        rotulos = (('Iluminação Pública', 'Consumo Mínimo', 'Consumo Compensável'),
+                   (None, None, 'Cons. Comp. c/ Deságio'))
+        cores = (('#fc8800', '#F4C430', '#d11d05'), ('#fc8800', '#F4C430', '#00b050'))
+        for posicao, segmentos, nomes, paleta in zip(x, alturas, rotulos, cores):
+            base = 0
+            for altura, nome, cor in zip(segmentos, nomes, paleta):
+                ax.bar(posicao, altura, 0.25, bottom=base, label=nome, color=cor, zorder=2)
+                ax.text(posicao, base + altura / 2, f"R$ {formatar_moeda(altura)}", ha='center', va='center',
+                        color='white', fontsize=18, fontweight='bold')
+                base += altura
+            ax.text(posicao, -y_max * 0.07, f"R$ {formatar_moeda(base)}", ha='center', va='top',
+                    color='white', fontsize=18)
+        ax.set_ylim(0, y_max)
+        ax.set_xticks(x)
+        ax.set_xticklabels(['SEM Geração Solar:', 'COM Geração Solar:'], fontsize=18, color='white')
+        ax.set_title('Economia de          na energia solar injetada\n e compensada, ao longo do Contrato.',
+                     color='white', pad=20, fontsize=24)
+        ax.text(0.375, 1.13, f"{int(desconto)}%", color='white', fontsize=28, ha='center', va='center',
+                fontweight='bold', transform=ax.transAxes)
+        for spine in ax.spines.values():
+            spine.set_visible(False)
+        ax.set_yticks([])
+        legenda = ax.legend(bbox_to_anchor=(0.5, -0.10), loc='upper center', ncol=2, fontsize=14, frameon=False)
+        for texto in legenda.get_texts():
+            texto.set_color('white')
+        plt.subplots_adjust(bottom=0.05)
+        plt.tight_layout()
+        plt.subplots_adjust(top=0.831, bottom=0.15)
+    return fig
+
+
+def benchmark_grafico(repeticoes=10):
+    """
+    Compara a montagem da figura pelo pyplot a cada chamada (como o
+    gerar_grafico() original) com a atualização da figura reutilizada
+    """
+    from io import BytesIO
+    import matplotlib.pyplot as plt
+    import grafico
+
+    valores = (550.75, 451.77, 113.81, 92.80, 20.0)
+
+    def pyplot_png():
+        figura = _grafico_pyplot(*valores)
+        figura.savefig(BytesIO(), format='png', transparent=True, bbox_inches='tight', dpi=grafico.DPI_GRAFICO,
+                       facecolor='none', edgecolor='none')
+        plt.close(figura)
+
+    grafico.preparar_grafico()
+    pyplot_ms = cronometrar(lambda: plt.close(_grafico_pyplot(*valores)), repeticoes)
+    with grafico.emprestar_grafico() as figura:
+        atualizacao_ms = cronometrar(lambda: grafico.atualizar_grafico(figura, *valores), repeticoes)
+    pyplot_png_ms = cronometrar(pyplot_png, repeticoes)
+    reutilizada_png_ms = cronometrar(lambda: grafico.renderizar_grafico(*valores), repeticoes)
+
+    print(f"Montagem da figura: pyplot {pyplot_ms:.1f} ms | reutilizada {atualizacao_ms:.2f} ms "
+          f"(orçamento {ORCAMENTO_GRAFICO_ATUALIZACAO_FRACAO:.0%} do pyplot)")
+    print(f"Gráfico completo (PNG a {grafico.DPI_GRAFICO} dpi, dominado pelo savefig): pyplot {pyplot_png_ms:.1f} ms | "
+          f"reutilizada {reutilizada_png_ms:.1f} ms")
+    return atualizacao_ms <= pyplot_ms * ORCAMENTO_GRAFICO_ATUALIZACAO_FRACAO
+
+
+def benchmark_distribuidoras(repeticoes=5):
+    """Mede a renderização completa do PDF para cada distribuidora do registro"""
+    import proposta
+    from distribuidoras import listar_distribuidoras
+
+    proposta.carregar_dependencias()
+    tempos = []
+    for codigo in listar_distribuidoras():
+        parametros = proposta.calcular_parametros_automaticos(distribuidora=codigo)
+        tempo_ms = cronometrar(lambda: proposta.renderizar_proposta_pdf(parametros), repeticoes)
+        tempos.append(tempo_ms)
+        print(f"Renderização ({codigo}): {tempo_ms:.1f} ms")
+
+    # Com os modelos pré-compilados, atender várias distribuidoras não deve
+    # custar mais por renderização do que atender uma só
+    return max(tempos) <= min(tempos) * 1.5
+
+
+def benchmark_unidades(quantidade=8):
+    """Mede a proposta de várias unidades (páginas preparadas no pool de processos)"""
+    import tempfile
+    import unidades
+
+    lista = [{'endereco': f'Rua Exemplo, {100 + i} - Centro', 'valor_fatura': f'{180 + i * 45.5:.2f}'}
+             for i in range(quantidade)]
+    try:
+        with tempfile.TemporaryDirectory() as diretorio:
+            destino = os.path.join(diretorio, 'unidades.pdf')
+            # A primeira execução inclui a criação e o aquecimento do pool
+            unidades.renderizar_proposta_unidades_pdf('Empresa Exemplo', lista[:1], destino)
+            inicio = time.perf_counter()
+            unidades.renderizar_proposta_unidades_pdf('Empresa Exemplo', lista, destino)
+            duracao = time.perf_counter() - inicio
+            tamanho_mb = os.path.getsize(destino) / 1024 / 1024
+    finally:
+        unidades.encerrar_executor()
+
+    paginas = quantidade + 1
+    print(f"Proposta de {quantidade} unidades ({unidades.PROCESSOS_UNIDADES} processos): "
+          f"{duracao:.1f} s | {duracao * 1000 / paginas:.0f} ms/página | {tamanho_mb:.1f} MB")
+    return True
+
+
+def benchmark_perfis(repeticoes=3):
+    """Compara tamanho e tempo do PDF em cada perfil de saída e verifica o subconjunto das fontes"""
+    import layout
+    import proposta
+
+    proposta.carregar_dependencias()
+    parametros = proposta.calcular_parametros_automaticos()
+    tamanhos = {}
+    fontes_completas = set()
+    for perfil in layout.PERFIS_SAIDA:
+        # A primeira renderização prepara a imagem de fundo no perfil
+        pdf = proposta.renderizar_proposta_pdf(parametros, perfil=perfil)
+        tempo_ms = cronometrar(lambda: proposta.renderizar_proposta_pdf(parametros, perfil=perfil), repeticoes)
+        fontes = layout.verificar_fontes(pdf)
+        fontes_completas.update(fontes['completas'])
+        tamanhos[perfil] = len(pdf)
+        print(f"Perfil {perfil}: {len(pdf) / 1024:.0f} KB | {tempo_ms:.1f} ms | "
+              f"fontes em subconjunto: {', '.join(fontes['subconjuntos']) or '-'}")
+
+    if fontes_completas:
+        print(f"Fontes incorporadas sem subconjunto: {', '.join(sorted(fontes_completas))}")
+    return not fontes_completas and tamanhos['screen'] < tamanhos['print'] <= tamanhos['archive']
+
+
+def benchmark_previa(repeticoes=5):
+    """Mede a prévia em imagem de cada formato contra o PDF da mesma montagem"""
+    import previa
+    import proposta
+
+    proposta.carregar_dependencias()
+    montagem = proposta.montar_proposta(proposta.calcular_parametros_automaticos())
+    pdf_ms = cronometrar(lambda: proposta.desenhar_proposta_pdf(montagem), repeticoes)
+    print(f"PDF: {pdf_ms:.1f} ms")
+
+    inicio = time.perf_counter()
+    previa.obter_base(montagem['layout'])
+    print(f"Base da prévia ({previa.LARGURA_PREVIA}px): {(time.perf_counter() - inicio) * 1000:.1f} ms (uma vez por layout)")
+    tempos = {}
+    for formato in previa.FORMATOS_PREVIA:
+        imagem = proposta.renderizar_proposta_previa(montagem, formato)
+        tempos[formato] = cronometrar(lambda: proposta.renderizar_proposta_previa(montagem, formato), repeticoes)
+        print(f"Prévia {formato}: {len(imagem) / 1024:.0f} KB | {tempos[formato]:.1f} ms "
+              f"(orçamento {ORCAMENTO_PREVIA_MS:.0f} ms)")
+    return all(tempo <= ORCAMENTO_PREVIA_MS for tempo in tempos.values())
+
+
+def benchmark_historico(quantidade=5000):
+    """Mede o enfileiramento, a gravação em lotes, a busca indexada e as análises do histórico"""
+    import tempfile
+    import historico
+
+    original = historico.ARQUIVO_HISTORICO
+    try:
+        with tempfile.TemporaryDirectory() as diretorio:
+            historico.ARQUIVO_HISTORICO = os.path.join(diretorio, 'historico.db')
+            inicio = time.perf_counter()
+            cidades = ('Campo Grande/MS', 'Dourados/MS', 'Três Lagoas/MS', 'Corumbá/MS')
+            for i in range(quantidade):
+                valor_fatura = 100.0 + i % 900
+                historico.registrar_proposta({
+                    'tipo': 'individual', 'status': historico.STATUS_GERADA,
+                    'criado_em': f'2026-{1 + i % 12:02d}-{1 + i % 28:02d}T12:00:00',
+                    'nome': f'Cliente {i % 500}', 'endereco': f'Rua Exemplo, {i} - {cidades[i % 4]}',
+                    'valor_fatura': valor_fatura, 'distribuidora': 'energisa_ms', 'versao_tarifas': '1',
+                    'arquivo': f'simulacao_Cliente_{i}.pdf', 'tamanho': 2_800_000,
+                    'valor_desconto': valor_fatura * 0.12, 'economia_ano': valor_fatura * 1.44,
+                    'economia_5ano': valor_fatura * 7.2,
+                })
+            enfileirar = time.perf_counter() - inicio
+            historico.descarregar()
+            gravar = time.perf_counter() - inicio
+            busca = cronometrar(lambda: historico.buscar_por_nome('Cliente 42'), 50)
+            analise = cronometrar(lambda: historico.consultar_resumos(['dia', 'cidade']), 20)
+            historico.encerrar()
+    finally:
+        historico.ARQUIVO_HISTORICO = original
+
+    print(f"Histórico ({quantidade} registros): enfileirar {enfileirar * 1e6 / quantidade:.1f} µs/registro | "
+          f"gravado em {gravar:.2f} s | busca por nome {busca:.2f} ms | análises por dia/cidade {analise:.2f} ms")
+    return True
+
+
+def benchmark_entrada(quantidade=2_000_000, unidades=200, rodadas=5):
+    """
+    Mede a vazão da normalização de entradas: valores avulsos (CLI, mediana
+    de `rodadas` rodadas após o aquecimento) e lotes de unidades
+    """
+    import itertools
+    import entrada
+
+    amostras = ('439.85', '100', 'R$ 1.234,56', '1234,5', '1.234', '1,234.56', 'R$1.000.000,00',
+                ' 87,90 ', '12.345,6', 'abc', '', '-10', '0,00')
+    valores = list(itertools.islice(itertools.cycle(amostras), quantidade // rodadas))
+    interpretar = entrada.interpretar_valor
+
+    def rodada():
+        validos = 0
+        inicio = time.perf_counter()
+        for valor in valores:
+            try:
+                interpretar(valor)
+                validos += 1
+            except ValueError:
+                pass
+        return len(valores) / (time.perf_counter() - inicio), validos
+
+    rodada()
+    medidas = [rodada() for _ in range(rodadas)]
+    vazao_valores = statistics.median(vazao for vazao, _ in medidas)
+    validos = sum(validos for _, validos in medidas)
+
+    lote = [{'endereco': f'Rua Exemplo, {i} - Campo Grande/MS', 'valor_fatura': amostras[i % 6]}
+            for i in range(unidades)]
+    lotes = max(1, quantidade // (unidades * 10))
+    inicio = time.perf_counter()
+    for _ in range(lotes):
+        entrada.normalizar_unidades(lote)
+    vazao_unidades = lotes * unidades / (time.perf_counter() - inicio)
+
+    print(f"Valores ({rodadas} rodadas de {len(valores)} textos, {validos} válidos): {vazao_valores:,.0f}/s "
+          f"(orçamento {ORCAMENTO_ENTRADA_POR_SEGUNDO:,}/s)")
+    print(f"Unidades ({lotes} lotes de {unidades}): {vazao_unidades:,.0f} unidades/s")
+    return vazao_valores >= ORCAMENTO_ENTRADA_POR_SEGUNDO
+
+
+def benchmark_centavos(quantidade=1_000_000, amostra=20_000):
+    """Precifica uma lista de leads em lote (int64) e confere, centavo a centavo, com o caminho escalar"""
+    import numpy as np
+    import centavos
+    import proposta
+    from distribuidoras import obter_distribuidora
+
+    distribuidora = obter_distribuidora()
+    gerador = np.random.default_rng(42)
+    faturas = gerador.integers(3_000, 2_000_000, quantidade) / 100
+
+    inicio = time.perf_counter()
+    lote = centavos.precificar_lote(faturas, distribuidora)
+    vazao_lote = quantidade / (time.perf_counter() - inicio)
+
+    divergencias = 0
+    inicio = time.perf_counter()
+    for i, valor in enumerate(faturas[:amostra].tolist()):
+        parametros = proposta.calcular_parametros_automaticos(valor_fatura_cliente=valor, distribuidora=distribuidora)
+        escalar = proposta.calcular_valores_financeiros(parametros, distribuidora)['centavos']
+        if parametros['consumo'] != lote['consumo'][i] or any(escalar[campo] != lote[campo][i] for campo in escalar):
+            divergencias += 1
+    vazao_escalar = amostra / (time.perf_counter() - inicio)
+
+    # Cada total impresso no PDF é a soma das linhas impressas acima dele
+    somas = {
+        'valor_total_fatura': lote['valor_fatura'] + lote['tax_ilu_pub'],
+        'total_a_pagar_CGS': lote['valor_fatura'] - lote['valor_fatura_sem_imposto'] + lote['tax_ilu_pub'],
+        'total_fatura_energia_a': lote['fatura_geradora'] + lote['total_a_pagar_CGS'],
+        'valor_desconto': lote['valor_total_fatura'] - lote['total_fatura_energia_a'],
+        'economia_ano': lote['valor_desconto'] * centavos.MESES_ANO,
+        'economia_5ano': lote['economia_ano'] * centavos.ANOS_PROJECAO,
+    }
+    totais_errados = {campo: int(np.count_nonzero(lote[campo] != soma)) for campo, soma in somas.items()}
+    totais_errados = {campo: quantidade for campo, quantidade in totais_errados.items() if quantidade}
+
+    print(f"Lote ({quantidade} leads): {vazao_lote:,.0f} leads/s (orçamento {ORCAMENTO_LOTE_POR_SEGUNDO:,}/s)")
+    print(f"Escalar ({amostra} leads): {vazao_escalar:,.0f} leads/s | divergências com o lote: {divergencias}")
+    print(f"Totais impressos diferentes da soma das linhas: {totais_errados or 'nenhum'}")
+    return divergencias == 0 and not totais_errados and vazao_lote >= ORCAMENTO_LOTE_POR_SEGUNDO
+
+
+def benchmark_formatacao(quantidade=1_000_000, threads=8):
+    """Formata uma coluna de centavos em lote e contextos inteiros em várias threads"""
+    from concurrent.futures import ThreadPoolExecutor
+    import numpy as np
+    import formatacao
+    import proposta
+
+    valores = np.random.default_rng(42).integers(-10_000_000, 10_000_000, quantidade)
+    inicio = time.perf_counter()
+    textos = formatacao.formatar_lote(valores)
+    vazao = quantidade / (time.perf_counter() - inicio)
+    corretos = all(texto == formatacao.formatar_moeda(valor / 100)
+                   for texto, valor in zip(textos[:10_000], valores[:10_000].tolist()))
+
+    # O contexto do layout é o mesmo em qualquer thread (nada depende do locale do processo)
+    parametros = proposta.calcular_parametros_automaticos()
+    financeiros = proposta.calcular_valores_financeiros(parametros)
+    referencia = proposta.montar_contexto_proposta(parametros, financeiros)
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        contextos = list(executor.map(lambda _: proposta.montar_contexto_proposta(parametros, financeiros),
+                                      range(threads * 1000)))
+    contexto_us = (time.perf_counter() - inicio) * 1e6 / len(contextos)
+    iguais = all(contexto == referencia for contexto in contextos)
+
+    print(f"Lote ({quantidade} valores): {vazao:,.0f}/s (orçamento {ORCAMENTO_FORMATACAO_POR_SEGUNDO:,}/s) | "
+          f"iguais ao escalar: {corretos}")
+    print(f"Contexto do layout ({threads} threads): {contexto_us:.1f} µs/proposta | todos iguais: {iguais}")
+    return corretos and iguais and vazao >= ORCAMENTO_FORMATACAO_POR_SEGUNDO
+
+
+def benchmark_simulacao(repeticoes=5):
+    """Mede a simulação de Monte Carlo das bandeiras de um cliente e confere o caso determinístico"""
+    import proposta
+    import simulacao
+    from distribuidoras import obter_distribuidora
+
+    distribuidora = obter_distribuidora()
+    parametros = proposta.calcular_parametros_automaticos(distribuidora=distribuidora)
+    valores = proposta.calcular_valores_financeiros(parametros, distribuidora)
+
+    inicio = time.perf_counter()
+    simulacao.simular_economia(valores, distribuidora, semente=1)
+    primeira_ms = (time.perf_counter() - inicio) * 1000
+    tempo_ms = cronometrar(lambda: simulacao.simular_economia(valores, distribuidora, semente=1), repeticoes)
+
+    # Só bandeira verde e sem reajuste: a simulação tem de reproduzir o desconto fixo
+    fixo = simulacao.simular_economia(valores, distribuidora, caminhos=1000, semente=1, bandeiras={'verde': 1},
+                                      reajuste_medio=0, reajuste_desvio=0)
+    confere = fixo['economia_contrato']['p5'] == fixo['economia_contrato']['p95'] == valores['centavos']['economia_5ano']
+
+    print(f"Simulação ({simulacao.CAMINHOS_PADRAO} caminhos, {simulacao.ANOS_PADRAO} anos): {tempo_ms:.1f} ms "
+          f"(primeira {primeira_ms:.1f} ms; orçamento {ORCAMENTO_SIMULACAO_MS:.0f} ms) | caso fixo confere: {confere}")
+    return confere and tempo_ms <= ORCAMENTO_SIMULACAO_MS
+
+
+def benchmark_escalonador(duracao_s=0.02):
+    """
+    Simula um lote grande de um inquilino concorrendo com propostas interativas
+    e com o lote de um segundo inquilino, com trabalhos de `duracao_s` segundos
+    """
+    import asyncio
+    from escalonador import Escalonador
+
+    async def simular():
+        escalonador = Escalonador(simultaneos=2, limites={'interativa': 2, 'lote': 1, 'pre_render': 1},
+                                  envelhecimento=60)
+        lote = [asyncio.create_task(escalonador.executar(time.sleep, duracao_s, classe='lote', inquilino='crm'))
+                for _ in range(40)]
+        await asyncio.sleep(duracao_s * 3)
+        # Segundo inquilino chega com o lote do primeiro na fila
+        chegada = time.perf_counter()
+        outro = asyncio.create_task(escalonador.executar(time.perf_counter, classe='lote', inquilino='outro'))
+        # Rajadas de três propostas interativas (mais que as vagas)
+        interativas = []
+        for _ in range(8):
+            interativas += [asyncio.create_task(
+                escalonador.executar(time.sleep, duracao_s, classe='interativa', inquilino=f'vendedor{i}'))
+                for i in range(3)]
+            await asyncio.sleep(duracao_s * 4)
+        espera_outro = await outro - chegada
+        await asyncio.gather(*interativas, *lote)
+        return escalonador.metricas()['classes'], espera_outro
+
+    classes, espera_outro = asyncio.run(simular())
+    espera_interativa = classes['interativa']['espera_maxima_s'] / duracao_s
+    # Com WFQ o segundo inquilino espera poucas renderizações, não o lote inteiro
+    justo = espera_outro / duracao_s < 10
+    for classe in ('interativa', 'lote'):
+        metricas = classes[classe]
+        print(f"{classe:>10}: {metricas['concluidos']} trabalhos | espera média "
+              f"{metricas['espera_media_s'] * 1000:.1f} ms, P95 {metricas['espera_p95_s'] * 1000:.1f} ms, "
+              f"máxima {metricas['espera_maxima_s'] * 1000:.1f} ms")
+    print(f"Espera interativa máxima: {espera_interativa:.2f} renderizações "
+          f"(orçamento {ORCAMENTO_ESPERA_INTERATIVA}) | segundo inquilino do lote: "
+          f"{espera_outro * 1000:.1f} ms ({espera_outro / duracao_s:.1f} renderizações; justo: {justo})")
+    return justo and espera_interativa <= ORCAMENTO_ESPERA_INTERATIVA
+
+
+def benchmark_sobrecarga(base_s=0.01, chegadas=300, intervalo_s=0.002, prazo_s=0.1):
+    """
+    Simula uma rajada de propostas interativas 5x acima da capacidade de um host
+    que renderiza duas propostas em paralelo (a latência cresce com a concorrência)
+    e compara um limite fixo alto com o limite adaptativo (partindo do mesmo valor)
+    com recusa (503)
+    """
+    import asyncio
+    import threading
+    from capacidade import LimiteAdaptativo
+    from escalonador import Escalonador, Sobrecarga
+
+    estado = {'em_execucao': 0}
+    lock = threading.Lock()
+
+    def renderizar():
+        with lock:
+            estado['em_execucao'] += 1
+            concorrencia = estado['em_execucao']
+        time.sleep(base_s * max(1.0, concorrencia / 2))
+        with lock:
+            estado['em_execucao'] -= 1
+
+    async def rajada(escalonador):
+        async def requisicao():
+            inicio = time.perf_counter()
+            try:
+                await escalonador.executar(renderizar)
+            except Sobrecarga:
+                return None
+            return time.perf_counter() - inicio
+
+        tarefas = []
+        for _ in range(chegadas):
+            tarefas.append(asyncio.create_task(requisicao()))
+            await asyncio.sleep(intervalo_s)
+        latencias = sorted(latencia for latencia in await asyncio.gather(*tarefas) if latencia is not None)
+        return latencias, escalonador
+
+    def p95(latencias):
+        return latencias[(len(latencias) - 1) * 95 // 100] if latencias else 0.0
+
+    fixo, _ = asyncio.run(rajada(Escalonador(simultaneos=16, limites={'interativa': 16, 'lote': 8, 'pre_render': 1})))
+    adaptativo, escalonador = asyncio.run(rajada(Escalonador(
+        simultaneos=16, limites={'interativa': 16, 'lote': 8, 'pre_render': 1},
+        capacidade=LimiteAdaptativo(16, minimo=1, maximo=16), espera_maxima={'interativa': prazo_s},
+    )))
+
+    recusadas = chegadas - len(adaptativo)
+    print(f"Limite fixo (16): {len(fixo)} aceitas | P95 {p95(fixo) * 1000:.0f} ms")
+    print(f"Limite adaptativo: {len(adaptativo)} aceitas, {recusadas} recusadas com 503 | "
+          f"P95 {p95(adaptativo) * 1000:.0f} ms (orçamento {ORCAMENTO_LATENCIA_SOBRECARGA * prazo_s * 1000:.0f} ms) | "
+          f"limite 16 -> {escalonador.limite_total()}")
+    return p95(adaptativo) <= ORCAMENTO_LATENCIA_SOBRECARGA * prazo_s and recusadas < chegadas
+
+
+def benchmark_fila(trabalhos=1000, trabalhadores=4):
+    """
+    Mede o ciclo completo da fila compartilhada no broker SQLite e confere a
+    entrega de novo após o fim da visibilidade e a fila de mortos
+    """
+    import tempfile
+    import threading
+    import fila_renderizacao
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        broker = fila_renderizacao.BrokerSQLite(os.path.join(diretorio, 'fila.db'))
+        identificadores = [broker.enfileirar('eco', {'indice': i}, 'interativa', f'inquilino{i % 7}')
+                           for i in range(trabalhos)]
+
+        def consumir():
+            while (trabalho := broker.reservar()) is not None:
+                broker.concluir(trabalho['id'], trabalho['recibo'], trabalho['argumentos'])
+
+        inicio = time.perf_counter()
+        threads = [threading.Thread(target=consumir) for _ in range(trabalhadores)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        resultados = [broker.obter_resultado(identificador) for identificador in identificadores]
+        por_segundo = trabalhos / (time.perf_counter() - inicio)
+        completos = resultados == [{'indice': i} for i in range(trabalhos)]
+
+        # Worker que "morre" duas vezes: entregue de novo e, sem tentativas, morto com resultado de erro
+        identificador = broker.enfileirar('eco', {}, 'lote', 'crm', max_tentativas=2)
+        primeira = broker.reservar(visibilidade=0.01)
+        time.sleep(0.02)
+        segunda = broker.reservar(visibilidade=0.01)
+        time.sleep(0.02)
+        broker.reservar()
+        erro = broker.obter_resultado(identificador)
+        semantica = (segunda is not None and segunda['id'] == identificador and segunda['tentativas'] == 2
+                     and not broker.concluir(identificador, primeira['recibo'], {})
+                     and erro is not None and not erro['sucesso'] and broker.metricas()['mortos'] == 1)
+
+    print(f"Fila SQLite: {por_segundo:,.0f} trabalhos/s com {trabalhadores} workers "
+          f"(orçamento {ORCAMENTO_FILA_POR_SEGUNDO:,}/s) | resultados completos: {completos} | "
+          f"visibilidade, tentativas e mortos: {semantica}")
+    return completos and semantica and por_segundo >= ORCAMENTO_FILA_POR_SEGUNDO
+
+
+def benchmark_pre_render(amostras=5):
+    """
+    Compara a latência do webhook com a proposta pré-renderizada pela cotação
+    (acerto) e renderizada por completo, e confere que o PDF é o mesmo
+    """
+    import tempfile
+    import pre_render
+    from entrada import normalizar_entrada
+    from proposta import processar_proposta_webhook
+
+    entradas = [normalizar_entrada(f'Cliente Especulado {i}', 'Rua das Flores 123, Centro, Sao Paulo SP',
+                                   400 + 37 * i) for i in range(amostras)]
+
+    def medir(entrada):
+        inicio = time.perf_counter()
+        resultado = processar_proposta_webhook(entrada, previa='png')
+        duracao = time.perf_counter() - inicio
+        with open(resultado['arquivo_path'], 'rb') as f:
+            return duracao, f.read()
+
+    ativo, diretorio_original = pre_render.ATIVO, pre_render.DIRETORIO
+    with tempfile.TemporaryDirectory() as diretorio:
+        pre_render.ATIVO, pre_render.DIRETORIO = True, diretorio
+        try:
+            medir(entradas[0])  # aquecimento (fontes, layout, gráfico)
+            completas, acertos, iguais = [], [], True
+            for entrada in entradas:
+                duracao, pdf = medir(entrada)
+                completas.append(duracao)
+                pre_render.pre_renderizar(entrada._asdict(), previa='png')
+                duracao, pdf_especulado = medir(entrada)
+                acertos.append(duracao)
+                iguais = iguais and len(pdf) == len(pdf_especulado)
+            consumidas = not os.listdir(diretorio)
+        finally:
+            pre_render.ATIVO, pre_render.DIRETORIO = ativo, diretorio_original
+
+    completa, acerto = statistics.median(completas), statistics.median(acertos)
+    fracao = acerto / completa
+    print(f"Webhook com pré-renderização: {acerto * 1000:.1f} ms | renderização completa: {completa * 1000:.1f} ms "
+          f"| fração {fracao:.2f} (orçamento {ORCAMENTO_PRE_RENDER_FRACAO}) | PDF igual: {iguais} | "
+          f"cache consumido: {consumidas}")
+    return iguais and consumidas and fracao <= ORCAMENTO_PRE_RENDER_FRACAO
+
+
+def benchmark_rastreamento(rastros=2000, spans_por_rastro=15):
+    """
+    Mede o custo de um span (ativo, com amostragem na cauda) e de uma etapa
+    rastreada com o rastreamento desativado, e confere a decisão na cauda
+    """
+    import rastreamento
+
+    @rastreamento.rastrear('benchmark.etapa')
+    def etapa():
+        return None
+
+    def executar(quantidade, lento_ms=None):
+        for _ in range(quantidade):
+            with rastreamento.span('benchmark.raiz', raiz=True):
+                for _ in range(spans_por_rastro - 1):
+                    etapa()
+                if lento_ms:
+                    time.sleep(lento_ms / 1000)
+
+    originais = (rastreamento.ATIVO, rastreamento.EXPORTADOR, rastreamento.AMOSTRAGEM, rastreamento.LENTO_MS)
+    try:
+        rastreamento.ATIVO = False
+        inicio = time.perf_counter()
+        executar(rastros)
+        desativado_us = (time.perf_counter() - inicio) / (rastros * spans_por_rastro) * 1e6
+
+        rastreamento.ATIVO, rastreamento.EXPORTADOR = True, 'memoria'
+        rastreamento.AMOSTRAGEM, rastreamento.LENTO_MS = 0.0, 5.0
+        antes = rastreamento.metricas()
+        inicio = time.perf_counter()
+        executar(rastros)
+        ativo_us = (time.perf_counter() - inicio) / (rastros * spans_por_rastro) * 1e6
+        # Um rastro lento é mantido com todos os spans
+        executar(1, lento_ms=10)
+        depois = rastreamento.metricas()
+        mantido = rastreamento.listar_rastros(1)[0]
+        cauda = (depois['descartados'] - antes['descartados'] == rastros and depois['lento'] - antes['lento'] == 1
+                 and len(mantido['spans']) == spans_por_rastro)
+    finally:
+        rastreamento.ATIVO, rastreamento.EXPORTADOR, rastreamento.AMOSTRAGEM, rastreamento.LENTO_MS = originais
+
+    print(f"Span ativo: {ativo_us:.1f} µs (orçamento {ORCAMENTO_SPAN_US} µs) | desativado: {desativado_us:.2f} µs | "
+          f"amostragem na cauda: {cauda}")
+    return cauda and ativo_us <= ORCAMENTO_SPAN_US
+
+
+def benchmark_memoria_compartilhada(valores=40, tamanho=2 * 1024 * 1024):
+    """
+    Um processo grava PDFs e a imagem de fundo na memória compartilhada; outro
+    processo os lê: todos devem ser acertos, sem nova decodificação da imagem
+    """
+    import json
+    import memoria_compartilhada
+
+    ambiente = dict(os.environ, MEMORIA_COMPARTILHADA='1', MEMORIA_COMPARTILHADA_MB='128',
+                    MEMORIA_COMPARTILHADA_NOME=f'prop_benchmark_{os.getpid()}')
+    modelo = os.path.join(DIRETORIO, 'img', 'modelo-SEM-texto.png')
+    gravar = (
+        "import memoria_compartilhada as m; "
+        "c = m.CacheCompartilhado('pdfs', 1); "
+        f"[c.guardar('v', i, bytes([i]) * {tamanho}) for i in range({valores})]; "
+        f"m.imagem_compartilhada({modelo!r})"
+    )
+    ler = (
+        "import json, time, PIL.Image, memoria_compartilhada as m; "
+        "c = m.CacheCompartilhado('pdfs', 1); "
+        "inicio = time.perf_counter(); "
+        f"lidos = [c.obter('v', i) for i in range({valores})]; "
+        f"leitura_ms = (time.perf_counter() - inicio) / {valores} * 1000; "
+        f"acertos = sum(valor == bytes([i]) * {tamanho} for i, valor in enumerate(lidos)); "
+        "inicio = time.perf_counter(); "
+        f"imagem = m.imagem_compartilhada({modelo!r}); imagem.getpixel((0, 0)); "
+        "imagem_ms = (time.perf_counter() - inicio) * 1000; "
+        "print(json.dumps({'acertos': acertos, 'leitura_ms': leitura_ms, 'imagem_ms': imagem_ms}))"
+    )
+    originais = memoria_compartilhada.NOME
+    try:
+        for codigo in (gravar, ler):
+            resultado = subprocess.run([sys.executable, '-c', codigo], cwd=DIRETORIO, env=ambiente,
+                                       capture_output=True, text=True, check=True)
+        medido = json.loads(resultado.stdout.splitlines()[-1])
+    finally:
+        memoria_compartilhada.NOME = ambiente['MEMORIA_COMPARTILHADA_NOME']
+        memoria_compartilhada.remover()
+        memoria_compartilhada.NOME = originais
+
+    print(f"Acertos entre processos: {medido['acertos']}/{valores} | leitura de {tamanho // 1024 // 1024} MB: "
+          f"{medido['leitura_ms']:.2f} ms (orçamento {ORCAMENTO_MEMORIA_COMPARTILHADA_MS} ms) | "
+          f"imagem de fundo já decodificada: {medido['imagem_ms']:.1f} ms")
+    return medido['acertos'] == valores and medido['leitura_ms'] <= ORCAMENTO_MEMORIA_COMPARTILHADA_MS
+
+
+def benchmark_midia(repeticoes=200):
+    """
+    Mede a revalidação (304) pela rota /media e confere o X-Accel-Redirect de
+    nomes acentuados e fora do latin-1
+    """
+    import logging
+    import tempfile
+    from urllib.parse import quote, unquote
+    from fastapi.testclient import TestClient
+    import midia
+    from app import app
+
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    cliente = TestClient(app)
+    originais = midia.OUTPUT_DIR, midia.X_ACCEL_REDIRECT
+    chaves_originais = midia._chaves
+    try:
+        with tempfile.TemporaryDirectory() as diretorio:
+            midia.OUTPUT_DIR, midia.X_ACCEL_REDIRECT = diretorio, '/interno'
+            nomes = ('simulacao_Joao_Silva.pdf', 'simulacao_João_Silva.pdf', 'simulacao_Łukasz_Nowak.pdf')
+            for nome in nomes:
+                with open(os.path.join(diretorio, nome), 'wb') as f:
+                    f.write(nome.encode('utf-8') * 1000)
+            redirecionados = []
+            for nome in nomes:
+                resposta = cliente.get(f"/media/{quote(nome)}")
+                destino = resposta.headers.get('x-accel-redirect', '')
+                redirecionados.append(resposta.status_code == 200 and destino.isascii()
+                                      and unquote(destino) == f"/interno/{nome}")
+            etag = cliente.get(f"/media/{nomes[0]}").headers['etag']
+            revalidacao_ms = cronometrar(
+                lambda: cliente.get(f"/media/{nomes[0]}", headers={'If-None-Match': etag}), repeticoes)
+            nao_modificado = cliente.get(f"/media/{nomes[0]}", headers={'If-None-Match': etag}).status_code == 304
+
+            midia.definir_chaves({'k1': b'segredo'})
+            assinada = midia.parametros_assinados(nomes[1], 'v1')
+            codigos = [cliente.get(f"/media/{quote(nomes[1])}", params=dict(assinada, v='v1', sig=sig)).status_code
+                       for sig in (assinada['sig'], 'é', '\u0141' * 43)]
+            assinatura_confere = codigos == [200, 403, 403]
+    finally:
+        midia.definir_chaves(chaves_originais)
+        midia.OUTPUT_DIR, midia.X_ACCEL_REDIRECT = originais
+
+    print(f"Revalidação (304): {revalidacao_ms:.2f} ms (orçamento {ORCAMENTO_MIDIA_304_MS} ms) | "
+          f"X-Accel-Redirect de nomes ASCII, acentuados e fora do latin-1: {all(redirecionados)} | "
+          f"assinaturas fora do ASCII recusadas com 403: {assinatura_confere}")
+    return all(redirecionados) and nao_modificado and assinatura_confere and revalidacao_ms <= ORCAMENTO_MIDIA_304_MS
+
+
+BENCHMARKS = {
+    'importacao': benchmark_importacao,
+    'grafico': benchmark_grafico,
+    'distribuidoras': benchmark_distribuidoras,
+    'unidades': benchmark_unidades,
+    'perfis': benchmark_perfis,
+    'previa': benchmark_previa,
+    'historico': benchmark_historico,
+    'entrada': benchmark_entrada,
+    'centavos': benchmark_centavos,
+    'formatacao': benchmark_formatacao,
+    'simulacao': benchmark_simulacao,
+    'escalonador': benchmark_escalonador,
+    'sobrecarga': benchmark_sobrecarga,
+    'fila': benchmark_fila,
+    'pre_render': benchmark_pre_render,
+    'rastreamento': benchmark_rastreamento,
+    'memoria_compartilhada': benchmark_memoria_compartilhada,
+    'midia': benchmark_midia,
+}
+
+
+def main():
+    """Executa os benchmarks selecionados na linha de comando"""
+    selecionados = sys.argv[1:] or list(BENCHMARKS)
+    falhas = []
+    for nome in selecionados:
+        if nome not in BENCHMARKS:
+            print(f"Benchmark desconhecido: {nome} (disponíveis: {', '.join(BENCHMARKS)})")
+            sys.exit(2)
+        print(f"=== {nome} ===")
+        if not BENCHMARKS[nome]():
+            falhas.append(nome)
+        print()
+
+    if falhas:
+        print(f"❌ Orçamento excedido em: {', '.join(falhas)}")
+        sys.exit(1)
+    print("✅ Todos os benchmarks dentro do orçamento")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Caches em memória com número máximo de entradas (LRU)
+
+As entradas são gravadas junto com a versão da tabela de tarifas usada para
+calculá-las. Quando distribuidoras.py troca a tabela, cada cache registrado
+descarta apenas as entradas da versão antiga; os demais caches do processo
+(figuras do gráfico, layouts compilados) continuam aquecidos.
+
+Os caches de bytes (PNGs dos gráficos, PDFs renderizados) podem ficar na
+memória compartilhada entre os workers (memoria_compartilhada.py).
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """Cache LRU thread-safe cujas chaves incluem a versão das tarifas"""
+
+    def __init__(self, nome, max_entradas):
+        self.nome = nome
+        self.max_entradas = max_entradas
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, versao, chave):
+        """Retorna o valor em cache ou None"""
+        with self._lock:
+            valor = self._entradas.get((versao, chave))
+            if valor is None:
+                self.falhas += 1
+                return None
+            self._entradas.move_to_end((versao, chave))
+            self.acertos += 1
+            return valor
+
+    def guardar(self, versao, chave, valor):
+        """Grava o valor, descartando as entradas usadas há mais tempo"""
+        if self.max_entradas <= 0:
+            return
+        with self._lock:
+            self._entradas[(versao, chave)] = valor
+            self._entradas.move_to_end((versao, chave))
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def invalidar_versao(self, versao):
+        """Descarta as entradas de uma versão das tarifas e retorna quantas eram"""
+        with self._lock:
+            chaves = [chave for chave in self._entradas if chave[0] == versao]
+            for chave in chaves:
+                del self._entradas[chave]
+        return len(chaves)
+
+    def limpar(self):
+        """Descarta todas as entradas"""
+        with self._lock:
+            self._entradas.clear()
+
+    def __len__(self):
+        return len(self._entradas)
+
+
+def criar_cache_por_tarifas(nome, max_entradas, compartilhado=False, max_local=None):
+    """
+    Cria um cache que é invalidado quando a tabela de tarifas é trocada.
+
+    Com `compartilhado` (valores em bytes) o cache fica na memória
+    compartilhada entre os processos do host (memoria_compartilhada.py), se
+    ativa; senão é local, com `max_local` entradas (padrão: max_entradas).
+    """
+    from distribuidoras import registrar_invalidacao
+
+    if compartilhado:
+        from memoria_compartilhada import CacheCompartilhado
+        cache = CacheCompartilhado(nome, max_entradas, max_local)
+    else:
+        cache = CacheLRU(nome, max_entradas)
+    registrar_invalidacao(cache.invalidar_versao)
+    return cache
@@ -0,0 +1,91 @@
+"""
+Limite adaptativo de renderizações simultâneas (AIMD pela latência)
+
+O rate limit por IP não mede a capacidade do servidor: uma rajada de muitos
+IPs sobrecarrega o host e um lote legítimo de um único IP fica barrado com a
+máquina ociosa. Aqui o número de renderizações simultâneas admitidas pelo
+escalonador se ajusta pela latência das renderizações concluídas:
+
+    latência por unidade de custo <= TOLERANCIA x base -> limite += 1 / limite
+    latência por unidade de custo >  TOLERANCIA x base -> limite *= REDUCAO
+
+(aumento aditivo de uma vaga por "rodada" de renderizações e redução
+multiplicativa no máximo uma vez por latência, como no controle de
+congestionamento do TCP). A base é a menor latência observada, que deriva
+lentamente para cima (DERIVA_BASE por amostra) para acompanhar um host que
+ficou mais lento de vez. O limite só cresce quando está sendo usado (metade
+ou mais das vagas ocupadas), senão um período ocioso o levaria ao máximo.
+
+A latência é o tempo de execução da renderização (sem a espera na fila)
+dividido pelo custo do trabalho (páginas), então propostas de várias
+unidades e propostas simples alimentam a mesma base. A média móvel desse
+tempo estima a espera de quem chega (escalonador.Escalonador.estimar_espera())
+para recusar cedo, com 503 e Retry-After, o que não seria atendido a tempo.
+"""
+
+import os
+import time
+
+LIMITE_MINIMO = int(os.getenv('CAPACIDADE_LIMITE_MINIMO', '1'))
+LIMITE_MAXIMO = int(os.getenv('CAPACIDADE_LIMITE_MAXIMO', str(max(4, (os.cpu_count() or 1) * 2))))
+# Latência acima de TOLERANCIA x base indica sobrecarga
+TOLERANCIA = float(os.getenv('CAPACIDADE_TOLERANCIA', '2.0'))
+REDUCAO = 0.9
+DERIVA_BASE = 0.001
+# Peso de cada amostra na média móvel do tempo por unidade de custo
+PESO_MEDIA = 0.1
+
+
+class LimiteAdaptativo:
+    """Limite de concorrência AIMD alimentado pela latência das renderizações"""
+
+    def __init__(self, inicial, minimo=LIMITE_MINIMO, maximo=LIMITE_MAXIMO, tolerancia=TOLERANCIA):
+        self.minimo = minimo
+        self.maximo = max(minimo, maximo)
+        self.tolerancia = tolerancia
+        self.limite = float(min(self.maximo, max(self.minimo, inicial)))
+        self.base = None
+        self.tempo_medio = None
+        self.ultima_reducao = 0.0
+        self.reducoes = 0
+
+    @property
+    def atual(self):
+        """Vagas admitidas agora (inteiro, ao menos o mínimo)"""
+        return int(self.limite)
+
+    def registrar(self, latencia, custo=1, em_execucao=None):
+        """
+        Registra uma renderização concluída e ajusta o limite.
+
+        Args:
+            latencia (float): Tempo de execução em segundos (sem a fila)
+            custo (float): Custo do trabalho no escalonador
+            em_execucao (int): Renderizações em execução quando esta terminou
+        """
+        amostra = latencia / max(custo, 1)
+        agora = time.monotonic()
+        self.tempo_medio = amostra if self.tempo_medio is None else (
+            self.tempo_medio + PESO_MEDIA * (amostra - self.tempo_medio))
+        self.base = amostra if self.base is None else min(self.base * (1 + DERIVA_BASE), amostra)
+
+        if amostra > self.tolerancia * self.base:
+            # Uma redução por latência: as renderizações que já estavam em
+            # execução terminam lentas pela mesma sobrecarga
+            if agora - self.ultima_reducao >= latencia:
+                self.limite = max(self.minimo, self.limite * REDUCAO)
+                self.ultima_reducao = agora
+                self.reducoes += 1
+        elif em_execucao is None or em_execucao + 1 >= self.limite / 2:
+            self.limite = min(self.maximo, self.limite + 1 / self.limite)
+
+    def metricas(self):
+        """Estado do controlador"""
+        return {
+            'limite': self.atual,
+            'limite_minimo': self.minimo,
+            'limite_maximo': self.maximo,
+            'latencia_base_s': self.base,
+            'latencia_media_s': self.tempo_medio,
+            'reducoes': self.reducoes,
+        }
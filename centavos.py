@@ -0,0 +1,190 @@
+"""
+Motor financeiro em ponto fixo (centavos e micro-reais inteiros)
+
+Os valores monetários são inteiros em centavos e as tarifas por kWh inteiros
+em micro-reais (seis casas, como no arquivo de distribuidoras e no PDF).
+Consumo (kWh inteiro) x tarifa (micro-reais) é exato; a única conversão com
+arredondamento é de micro-reais para centavos, sempre pela mesma regra:
+
+    meio centavo arredonda para cima (em direção a +infinito)
+
+aplicada uma vez a cada produto consumo x tarifa. Somas e diferenças são
+feitas já em centavos, e cada total é a soma das parcelas exibidas no PDF e
+no JSON da API, então os totais batem centavo a centavo com elas. A parcela
+do consumo mínimo, rotulada no gráfico, é o que sobra da fatura depois da
+energia compensada e absorve o arredondamento dos dois produtos: pode
+diferir em um centavo do consumo mínimo x tarifa arredondado sozinho (com 103
+kWh, 100 kWh de mínimo x 1,138131 aparece como R$ 113,82, não 113,81). A tarifa com desconto também
+é arredondada para micro-reais antes de multiplicar, de modo que a tarifa
+impressa (seis casas) x consumo impresso = valor impresso.
+
+calcular_centavos() usa apenas +, -, * e //; a mesma função calcula uma
+proposta (int do Python) ou uma lista de leads inteira (arrays int64 do
+NumPy, precificar_lote()), e os dois caminhos dão resultados idênticos.
+"""
+
+import math
+
+CENTAVOS_POR_REAL = 100
+MICRO_POR_REAL = 1_000_000
+MICRO_POR_CENTAVO = MICRO_POR_REAL // CENTAVOS_POR_REAL
+# Percentuais (desconto do contrato) em pontos-base: 20% = 2000
+PONTOS_BASE = 10_000
+
+MESES_ANO = 12
+ANOS_PROJECAO = 5
+
+
+def dividir_arredondando(numerador, divisor):
+    """Divisão inteira com meio arredondado para cima (int ou array int64, divisor > 0)"""
+    return (2 * numerador + divisor) // (2 * divisor)
+
+
+def para_centavos(valor):
+    """Reais (float, int ou texto numérico) -> centavos inteiros"""
+    return math.floor(float(valor) * CENTAVOS_POR_REAL + 0.5)
+
+
+def para_micro(valor):
+    """Reais por kWh -> micro-reais inteiros"""
+    return math.floor(float(valor) * MICRO_POR_REAL + 0.5)
+
+
+def para_reais(centavos):
+    """Centavos inteiros -> float em reais (o double mais próximo das duas casas)"""
+    return centavos / CENTAVOS_POR_REAL
+
+
+def micro_para_centavos(micro):
+    """Micro-reais -> centavos, com a regra de arredondamento do motor"""
+    return dividir_arredondando(micro, MICRO_POR_CENTAVO)
+
+
+def tarifas_micro(distribuidora):
+    """
+    Tarifas da distribuidora em ponto fixo: tarifa, tarifa com desconto e
+    bandeiras em micro-reais, desconto em pontos-base e faixas com limite e
+    taxa de iluminação em centavos (limite None na última faixa).
+    """
+    tarifas = distribuidora.get('micro')
+    if tarifas is not None:
+        return tarifas
+    tarifa = para_micro(distribuidora['tarifa'])
+    desconto = math.floor(distribuidora['desconto_contrato'] * 100 + 0.5)
+    return {
+        'tarifa': tarifa,
+        'tarifa_com_desconto': dividir_arredondando(tarifa * (PONTOS_BASE - desconto), PONTOS_BASE),
+        'desconto': desconto,
+        'bandeiras': {nome: para_micro(valor) for nome, valor in distribuidora['bandeiras'].items()},
+        'faixas': tuple(
+            (None if limite == math.inf else para_centavos(limite), consumo_minimo, para_centavos(taxa))
+            for limite, consumo_minimo, taxa in distribuidora['faixas']
+        ),
+    }
+
+
+def ajustar_consumo(valor_fatura, taxa_estimada, tarifa):
+    """
+    Consumo (kWh inteiro) e taxa de iluminação ajustada (centavos) de uma fatura.
+
+    O consumo é (fatura - taxa estimada) / tarifa arredondado; a taxa ajustada
+    é o que sobra da fatura, de modo que consumo x tarifa + taxa = fatura.
+
+    Args:
+        valor_fatura, taxa_estimada: Centavos (int ou array int64)
+        tarifa: Micro-reais por kWh
+    """
+    consumo = dividir_arredondando((valor_fatura - taxa_estimada) * MICRO_POR_CENTAVO, tarifa)
+    return consumo, valor_fatura - micro_para_centavos(consumo * tarifa)
+
+
+def calcular_centavos(consumo, consumo_minimo, taxa_iluminacao, tarifas):
+    """
+    Valores financeiros da proposta em centavos.
+
+    Args:
+        consumo, consumo_minimo: kWh inteiros (int ou array int64)
+        taxa_iluminacao: Centavos (int ou array int64)
+        tarifas (dict): tarifas_micro() da distribuidora
+
+    Returns:
+        dict: Campo -> centavos (os mesmos nomes de calcular_valores_financeiros())
+    """
+    tarifa = tarifas['tarifa']
+    energia_energia_a = consumo - consumo_minimo
+
+    # Parcelas exibidas: cada total abaixo é a soma exata delas
+    valor_fatura = micro_para_centavos(consumo * tarifa)
+    valor_fatura_sem_imposto = micro_para_centavos(energia_energia_a * tarifa)
+    fatura_geradora = micro_para_centavos(energia_energia_a * tarifas['tarifa_com_desconto'])
+    consumo_minimo_energisa = valor_fatura - valor_fatura_sem_imposto
+    energia_compensada = valor_fatura_sem_imposto
+
+    valor_total_fatura = valor_fatura + taxa_iluminacao
+    # Residual da distribuidora (consumo mínimo + CIP) e o total "O que vou pagar"
+    total_a_pagar_CGS = consumo_minimo_energisa + taxa_iluminacao
+    fatura_distribuidora = total_a_pagar_CGS
+    total_fatura_energia_a = total_a_pagar_CGS + fatura_geradora
+
+    total_sem_desconto = valor_total_fatura
+    valor_desconto = total_sem_desconto - total_fatura_energia_a
+    total_fatura_energisa_para_pagar = valor_fatura - energia_compensada
+
+    valores = {
+        'tax_ilu_pub': taxa_iluminacao,
+        'valor_fatura': valor_fatura,
+        'valor_total_fatura': valor_total_fatura,
+        'valor_fatura_sem_imposto': valor_fatura_sem_imposto,
+        'fatura_distribuidora': fatura_distribuidora,
+        'fatura_geradora': fatura_geradora,
+        'total_fatura_energia_a': total_fatura_energia_a,
+        'energia_compensada': energia_compensada,
+        'consumo_minimo_energisa': consumo_minimo_energisa,
+        'total_sem_desconto': total_sem_desconto,
+        'valor_desconto': valor_desconto,
+        'total_com_desconto': valor_fatura - valor_desconto + taxa_iluminacao,
+        'total_fatura_energisa_para_pagar': total_fatura_energisa_para_pagar,
+        'fatura_locacao': total_fatura_energisa_para_pagar + energia_compensada - valor_desconto,
+        'total_a_pagar_CGS': total_a_pagar_CGS,
+        'economia_ano': valor_desconto * MESES_ANO,
+        'economia_5ano': valor_desconto * MESES_ANO * ANOS_PROJECAO,
+    }
+    for bandeira, adicional in tarifas['bandeiras'].items():
+        economia = valor_desconto + micro_para_centavos(energia_energia_a * adicional)
+        valores[f'economia_incidencia_bandeira_{bandeira}'] = economia
+        valores[f'economia_anual_incidencia_bandeira_{bandeira}'] = economia * MESES_ANO
+        valores[f'economia_5ano_incidencia_bandeira_{bandeira}'] = economia * MESES_ANO * ANOS_PROJECAO
+    return valores
+
+
+def precificar_lote(valores_fatura, distribuidora):
+    """
+    Precifica uma lista de leads de uma vez (NumPy, int64).
+
+    Args:
+        valores_fatura: Valores das faturas em reais (sequência ou array)
+        distribuidora (dict): Snapshot da distribuidora (obter_distribuidora())
+
+    Returns:
+        dict: 'valor_fatura_original', 'consumo', 'consumo_minimo' e os campos
+        de calcular_centavos(), cada um um array int64 (centavos ou kWh)
+    """
+    import numpy as np
+
+    tarifas = tarifas_micro(distribuidora)
+    faturas = np.floor(np.asarray(valores_fatura, dtype=np.float64) * CENTAVOS_POR_REAL + 0.5).astype(np.int64)
+
+    limites = np.array([limite for limite, _, _ in tarifas['faixas'][:-1]], dtype=np.int64)
+    minimos = np.array([minimo for _, minimo, _ in tarifas['faixas']], dtype=np.int64)
+    taxas = np.array([taxa for _, _, taxa in tarifas['faixas']], dtype=np.int64)
+    # Primeira faixa cujo limite é >= a fatura (a última não tem limite)
+    faixa = np.searchsorted(limites, faturas, side='left')
+
+    consumo, taxa_iluminacao = ajustar_consumo(faturas, taxas[faixa], tarifas['tarifa'])
+    consumo_minimo = minimos[faixa]
+    return {
+        'valor_fatura_original': faturas,
+        'consumo': consumo,
+        'consumo_minimo': consumo_minimo,
+        **calcular_centavos(consumo, consumo_minimo, taxa_iluminacao, tarifas),
+    }
@@ -0,0 +1,305 @@
+"""
+Registro de distribuidoras (concessionárias)
+
+Cada distribuidora tem sua tabela de tarifas (tarifa por kWh, desconto do
+contrato, adicionais das bandeiras), as faixas de consumo mínimo e taxa de
+iluminação pública e o modelo de página da proposta. O arquivo
+dados/distribuidoras.json é lido uma única vez por processo; o layout de cada
+modelo é compilado (fontes, imagem de fundo e operações) na primeira proposta
+da distribuidora ou no aquecimento, por preparar_distribuidoras(). Distribuidoras
+que compartilham o mesmo modelo compartilham a mesma compilação.
+
+O arquivo é versionado e monitorado por uma thread (iniciar_monitoramento()):
+quando a 'versao' muda, a nova tabela é validada, seus modelos são compilados
+e só então o registro é trocado atomicamente. Uma renderização em andamento
+continua com a entrada (snapshot) obtida no início; apenas os caches
+registrados em registrar_invalidacao() descartam as entradas da versão antiga.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+
+from centavos import tarifas_micro
+from proposta import EXPORTADOR_DIR, FONTS_DIR, IMG_DIR, LAYOUTS_DIR
+
+logger = logging.getLogger(__name__)
+
+DADOS_DIR = os.path.join(EXPORTADOR_DIR, 'dados')
+ARQUIVO_DISTRIBUIDORAS = os.path.join(DADOS_DIR, 'distribuidoras.json')
+
+BANDEIRAS = ('amarela', 'vermelha_patamar_1', 'vermelha_patamar_2', 'escassez_hibrida')
+# Bandeira sem adicional, usada apenas na distribuição mensal da simulação
+BANDEIRA_VERDE = 'verde'
+
+# Distribuição mensal das bandeiras e reajuste anual usados na simulação
+# (simulacao.py) quando a distribuidora não define a seção 'simulacao'
+SIMULACAO_PADRAO = {
+    'bandeiras': {'verde': 0.55, 'amarela': 0.20, 'vermelha_patamar_1': 0.12,
+                  'vermelha_patamar_2': 0.10, 'escassez_hibrida': 0.03},
+    'reajuste_anual': {'media': 0.06, 'desvio': 0.03},
+}
+# Faixas aceitas para o reajuste anual (média) e seu desvio
+REAJUSTE_MEDIO_LIMITES = (-0.5, 1.0)
+REAJUSTE_DESVIO_MAXIMO = 0.5
+
+# Intervalo (segundos) entre as verificações do arquivo de distribuidoras
+INTERVALO_MONITORAMENTO = float(os.getenv('TARIFAS_INTERVALO_MONITORAMENTO', '5'))
+
+# O registro nunca é alterado depois de publicado; uma recarga cria um novo
+# registro e troca a referência
+_registro = None
+_assinatura_arquivo = None
+_modelos_preparados = False
+_lock = threading.Lock()
+_callbacks_invalidacao = []
+_monitor = None
+_parar_monitor = threading.Event()
+
+
+def normalizar_simulacao(dados):
+    """
+    Valida a seção 'simulacao' (probabilidades mensais das bandeiras e
+    reajuste anual) e normaliza as probabilidades para somarem 1.
+    """
+    probabilidades = {bandeira: float(valor) for bandeira, valor in dados['bandeiras'].items()}
+    desconhecidas = set(probabilidades) - {BANDEIRA_VERDE, *BANDEIRAS}
+    if desconhecidas:
+        raise ValueError(f"bandeiras desconhecidas na simulação: {', '.join(sorted(desconhecidas))}")
+    total = sum(probabilidades.values())
+    if any(valor < 0 for valor in probabilidades.values()) or total <= 0:
+        raise ValueError("probabilidades das bandeiras devem ser não negativas e somar mais que zero")
+    reajuste = dados.get('reajuste_anual', {})
+    simulacao = {
+        'bandeiras': {bandeira: probabilidades.get(bandeira, 0.0) / total
+                      for bandeira in (BANDEIRA_VERDE, *BANDEIRAS)},
+        'reajuste_anual': {'media': float(reajuste.get('media', 0.0)),
+                           'desvio': float(reajuste.get('desvio', 0.0))},
+    }
+    minimo, maximo = REAJUSTE_MEDIO_LIMITES
+    if not minimo <= simulacao['reajuste_anual']['media'] <= maximo:
+        raise ValueError(f"reajuste anual médio deve estar entre {minimo} e {maximo}")
+    if not 0 <= simulacao['reajuste_anual']['desvio'] <= REAJUSTE_DESVIO_MAXIMO:
+        raise ValueError(f"desvio do reajuste anual deve estar entre 0 e {REAJUSTE_DESVIO_MAXIMO}")
+    return simulacao
+
+
+def _normalizar_distribuidora(codigo, dados, versao):
+    """Valida uma entrada do arquivo e converte para o formato usado nos cálculos"""
+    try:
+        bandeiras = {bandeira: float(dados['bandeiras'][bandeira]) for bandeira in BANDEIRAS}
+        faixas = tuple(
+            (math.inf if faixa['ate'] is None else float(faixa['ate']),
+             int(faixa['consumo_minimo']),
+             float(faixa['taxa_iluminacao']))
+            for faixa in dados['faixas']
+        )
+        distribuidora = {
+            'codigo': codigo,
+            'versao': versao,
+            'nome': dados['nome'],
+            'tarifa': float(dados['tarifa']),
+            'desconto_contrato': float(dados['desconto_contrato']),
+            'bandeiras': bandeiras,
+            'faixas': faixas,
+            'simulacao': normalizar_simulacao(dados.get('simulacao', SIMULACAO_PADRAO)),
+            'layout': os.path.join(LAYOUTS_DIR, dados['modelo']['layout']),
+        }
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Distribuidora {codigo} inválida: {str(e)}")
+
+    if distribuidora['tarifa'] <= 0:
+        raise ValueError(f"Distribuidora {codigo} inválida: tarifa deve ser maior que zero")
+    limites = [limite for limite, _, _ in faixas]
+    if not faixas or limites != sorted(limites) or limites[-1] != math.inf:
+        raise ValueError(f"Distribuidora {codigo} inválida: faixas devem ser crescentes e terminar com 'ate': null")
+    # Tarifas em ponto fixo (micro-reais e centavos), convertidas uma vez por versão
+    distribuidora['micro'] = tarifas_micro(distribuidora)
+    return distribuidora
+
+
+def carregar_registro(caminho=ARQUIVO_DISTRIBUIDORAS):
+    """Lê e valida o arquivo de distribuidoras"""
+    with open(caminho, 'r', encoding='utf-8') as f:
+        dados = json.load(f)
+
+    versao = str(dados['versao'])
+    distribuidoras = {
+        codigo: _normalizar_distribuidora(codigo, entrada, versao)
+        for codigo, entrada in dados['distribuidoras'].items()
+    }
+    if dados['padrao'] not in distribuidoras:
+        raise ValueError(f"Distribuidora padrão desconhecida: {dados['padrao']}")
+
+    return {
+        'versao': versao,
+        'padrao': dados['padrao'],
+        'distribuidoras': distribuidoras,
+    }
+
+
+def _assinatura(caminho):
+    """Identifica uma gravação do arquivo (data de modificação e tamanho)"""
+    info = os.stat(caminho)
+    return info.st_mtime_ns, info.st_size
+
+
+def obter_registro():
+    """Retorna o registro de distribuidoras, carregando o arquivo na primeira chamada"""
+    global _registro, _assinatura_arquivo
+    if _registro is None:
+        with _lock:
+            if _registro is None:
+                _assinatura_arquivo = _assinatura(ARQUIVO_DISTRIBUIDORAS)
+                _registro = carregar_registro()
+                logger.info(f"Registro de distribuidoras v{_registro['versao']} carregado "
+                            f"({len(_registro['distribuidoras'])} distribuidoras)")
+    return _registro
+
+
+def versao_tarifas():
+    """Retorna a versão da tabela de tarifas em uso"""
+    return obter_registro()['versao']
+
+
+def registrar_invalidacao(callback):
+    """
+    Registra uma função chamada com a versão antiga quando a tabela é trocada.
+
+    Usado pelos caches cujas chaves dependem da versão das tarifas.
+    """
+    with _lock:
+        _callbacks_invalidacao.append(callback)
+
+
+def recarregar_registro():
+    """
+    Relê o arquivo de distribuidoras e troca o registro se a versão mudou.
+
+    Um arquivo inválido (inclusive gravado pela metade) é ignorado e o
+    registro atual continua em uso.
+
+    Returns:
+        bool: True se o registro foi trocado
+    """
+    global _registro, _assinatura_arquivo
+    atual = obter_registro()
+    assinatura = _assinatura(ARQUIVO_DISTRIBUIDORAS)
+    if assinatura == _assinatura_arquivo:
+        return False
+
+    # A assinatura é registrada mesmo se o arquivo for inválido, para que o
+    # erro seja registrado uma vez por gravação e não a cada verificação
+    _assinatura_arquivo = assinatura
+    try:
+        novo = carregar_registro()
+    except (OSError, KeyError, TypeError, ValueError) as e:
+        logger.error(f"Tabela de distribuidoras inválida, mantendo v{atual['versao']}: {str(e)}")
+        return False
+
+    if novo['versao'] == atual['versao']:
+        logger.warning(f"Arquivo de distribuidoras alterado sem mudar a versão "
+                       f"(v{atual['versao']}); alteração ignorada")
+        return False
+
+    # Os modelos da nova tabela são compilados antes da troca para que a
+    # primeira proposta da nova versão não pague a compilação
+    if _modelos_preparados:
+        for distribuidora in novo['distribuidoras'].values():
+            obter_layout_distribuidora(distribuidora)
+
+    with _lock:
+        _registro = novo
+        callbacks = list(_callbacks_invalidacao)
+    logger.info(f"Tabela de distribuidoras trocada: v{atual['versao']} -> v{novo['versao']}")
+
+    for callback in callbacks:
+        try:
+            callback(atual['versao'])
+        except Exception as e:
+            logger.error(f"Erro ao invalidar cache da versão {atual['versao']}: {str(e)}", exc_info=True)
+    return True
+
+
+def _monitorar(intervalo):
+    """Laço da thread de monitoramento do arquivo de distribuidoras"""
+    while not _parar_monitor.wait(intervalo):
+        try:
+            recarregar_registro()
+        except Exception as e:
+            logger.error(f"Erro ao verificar a tabela de distribuidoras: {str(e)}", exc_info=True)
+
+
+def iniciar_monitoramento(intervalo=INTERVALO_MONITORAMENTO):
+    """Inicia a thread que recarrega a tabela quando o arquivo muda"""
+    global _monitor
+    obter_registro()
+    if _monitor is not None and _monitor.is_alive():
+        return
+    _parar_monitor.clear()
+    _monitor = threading.Thread(target=_monitorar, args=(intervalo,),
+                                name='monitor-distribuidoras', daemon=True)
+    _monitor.start()
+
+
+def parar_monitoramento():
+    """Interrompe a thread de monitoramento"""
+    global _monitor
+    _parar_monitor.set()
+    if _monitor is not None:
+        _monitor.join(timeout=5)
+        _monitor = None
+
+
+def listar_distribuidoras():
+    """Retorna os códigos das distribuidoras cadastradas"""
+    return list(obter_registro()['distribuidoras'])
+
+
+def obter_distribuidora(codigo=None):
+    """
+    Retorna a distribuidora pelo código (ou a padrão quando codigo é None).
+
+    Também aceita uma entrada já obtida, que é devolvida como está: assim uma
+    proposta usa do início ao fim a mesma versão das tarifas.
+    """
+    if isinstance(codigo, dict):
+        return codigo
+    registro = obter_registro()
+    codigo = codigo or registro['padrao']
+    distribuidora = registro['distribuidoras'].get(codigo)
+    if distribuidora is None:
+        raise ValueError(f"Distribuidora desconhecida: {codigo}")
+    return distribuidora
+
+
+def obter_faixa(distribuidora, valor_fatura):
+    """Retorna (consumo_minimo, taxa_iluminacao) da faixa do valor da fatura"""
+    for limite, consumo_minimo, taxa_iluminacao in distribuidora['faixas']:
+        if valor_fatura <= limite:
+            return consumo_minimo, taxa_iluminacao
+
+
+def rotulo_faixa(distribuidora, valor_fatura):
+    """Rótulo da faixa do valor da fatura (ex.: '0-300', '300-500', '500+')"""
+    anterior = 0
+    for limite, _, _ in distribuidora['faixas']:
+        if valor_fatura <= limite:
+            return f"{anterior:g}+" if limite == math.inf else f"{anterior:g}-{limite:g}"
+        anterior = limite
+
+
+def obter_layout_distribuidora(distribuidora):
+    """Retorna o layout compilado do modelo da distribuidora"""
+    from layout import obter_layout
+    return obter_layout(distribuidora['layout'], IMG_DIR, FONTS_DIR)
+
+
+def preparar_distribuidoras():
+    """Compila os modelos de todas as distribuidoras (aquecimento)"""
+    global _modelos_preparados
+    for distribuidora in obter_registro()['distribuidoras'].values():
+        obter_layout_distribuidora(distribuidora)
+    _modelos_preparados = True
@@ -0,0 +1,148 @@
+"""
+Normalização das entradas da proposta (nome, endereço e valor da fatura)
+
+Uma única implementação, usada pela API, pelo motor e pela linha de comando:
+cada campo é interpretado uma vez e a proposta segue com um registro imutável
+(EntradaProposta / EntradaUnidade). As funções são idempotentes, então
+normalizar de novo um valor já normalizado não muda nada.
+
+Valores monetários aceitam o formato brasileiro e o simples:
+'R$ 1.234,56', '1234,56', '1.234', '1234.56', '1,234.56' e números. Ponto
+seguido de exatamente três dígitos é separador de milhar ('1.234' = 1234);
+os centavos têm no máximo duas casas.
+"""
+
+import re
+import unicodedata
+from typing import NamedTuple, Optional
+
+VALOR_MAXIMO = 99999.99
+TAMANHO_MINIMO_NOME = 3
+TAMANHO_MAXIMO_NOME = 100
+TAMANHO_MINIMO_ENDERECO = 10
+
+# Caminho rápido: o formato que a própria API devolve ('439.85', '100')
+_PADRAO_SIMPLES = re.compile(r'\d+(?:\.\d{1,2})?')
+_PADRAO_BR = re.compile(r'\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?|\d+(?:,\d{1,2})?')
+_PADRAO_INTERNACIONAL = re.compile(r'\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?')
+_PADRAO_DESCARTAR = re.compile(r'(?i)r\$|\s')
+_PADRAO_LETRA = re.compile(r'[^\W\d_]')
+
+
+class EntradaProposta(NamedTuple):
+    """Entrada normalizada de uma proposta individual"""
+    nome: str
+    endereco: str
+    valor_fatura: float
+    distribuidora: Optional[str] = None
+
+
+class EntradaUnidade(NamedTuple):
+    """Entrada normalizada de uma unidade consumidora"""
+    endereco: str
+    valor_fatura: float
+
+
+def interpretar_valor(valor):
+    """
+    Interpreta o valor da fatura (texto em formato brasileiro ou simples, ou número).
+
+    Returns:
+        float: Valor com duas casas decimais
+
+    Raises:
+        ValueError: Valor ausente, inválido, não positivo ou acima de VALOR_MAXIMO
+    """
+    if isinstance(valor, str):
+        texto = valor.strip()
+        if _PADRAO_SIMPLES.fullmatch(texto):
+            numero = float(texto)
+        else:
+            texto = _PADRAO_DESCARTAR.sub('', texto)
+            if not texto:
+                raise ValueError("Valor da fatura é obrigatório")
+            if _PADRAO_BR.fullmatch(texto):
+                numero = float(texto.replace('.', '').replace(',', '.'))
+            elif _PADRAO_INTERNACIONAL.fullmatch(texto):
+                numero = float(texto.replace(',', ''))
+            else:
+                raise ValueError("Valor da fatura deve ser um número válido")
+    elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        numero = float(valor)
+    elif valor is None:
+        raise ValueError("Valor da fatura é obrigatório")
+    else:
+        raise ValueError("Valor da fatura deve ser um número válido")
+
+    if not numero > 0:
+        raise ValueError("Valor da fatura deve ser maior que zero")
+    if numero > VALOR_MAXIMO:
+        raise ValueError("Valor da fatura muito alto")
+    return round(numero, 2)
+
+
+def _texto(valor):
+    """Texto em NFC, sem espaços nas pontas e com espaços internos simples"""
+    return ' '.join(unicodedata.normalize('NFC', valor).split())
+
+
+def normalizar_nome(nome):
+    """Normaliza e valida o nome completo do cliente"""
+    if not nome or not isinstance(nome, str):
+        raise ValueError("Nome completo é obrigatório e deve ser uma string")
+    nome = _texto(nome)
+    if len(nome) < TAMANHO_MINIMO_NOME:
+        raise ValueError("Nome completo deve ter pelo menos 3 caracteres")
+    if len(nome) > TAMANHO_MAXIMO_NOME:
+        raise ValueError("Nome completo não pode ter mais de 100 caracteres")
+    if not _PADRAO_LETRA.search(nome):
+        raise ValueError("Nome completo deve conter pelo menos uma letra")
+    return nome
+
+
+def normalizar_endereco(endereco):
+    """Normaliza e valida um endereço"""
+    if not endereco or not isinstance(endereco, str):
+        raise ValueError("Endereço é obrigatório")
+    endereco = _texto(endereco)
+    if len(endereco) < TAMANHO_MINIMO_ENDERECO:
+        raise ValueError("Endereço deve ter pelo menos 10 caracteres")
+    return endereco
+
+
+def normalizar_codigo(codigo):
+    """Normaliza um código opcional (distribuidora, perfil): minúsculas, sem espaços nas pontas"""
+    if codigo is None:
+        return None
+    codigo = codigo.strip().lower()
+    return codigo or None
+
+
+def normalizar_entrada(nome, endereco, valor_fatura, distribuidora=None):
+    """Normaliza os campos de uma proposta individual em um único passo"""
+    return EntradaProposta(
+        normalizar_nome(nome),
+        normalizar_endereco(endereco),
+        interpretar_valor(valor_fatura),
+        normalizar_codigo(distribuidora),
+    )
+
+
+def normalizar_unidade(endereco, valor_fatura):
+    """Normaliza os campos de uma unidade consumidora"""
+    return EntradaUnidade(normalizar_endereco(endereco), interpretar_valor(valor_fatura))
+
+
+def normalizar_unidades(unidades):
+    """
+    Normaliza a lista de unidades (dicts com 'endereco' e 'valor_fatura' ou
+    EntradaUnidade, que passam direto).
+
+    Returns:
+        tuple: EntradaUnidade de cada unidade, na ordem recebida
+    """
+    return tuple(
+        unidade if isinstance(unidade, EntradaUnidade)
+        else normalizar_unidade(unidade.get('endereco'), unidade.get('valor_fatura'))
+        for unidade in unidades
+    )
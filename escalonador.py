@@ -0,0 +1,441 @@
+"""
+Escalonador das renderizações (prioridade por classe e justiça por inquilino)
+
+Toda renderização pedida pela API passa por aqui antes de ocupar uma thread.
+Há três classes, em ordem de prioridade:
+
+    interativa  - propostas pedidas em tempo real (vendedor em atendimento)
+    lote        - importações em massa (CRM, várias unidades)
+    pre_render  - renderizações especulativas em segundo plano
+
+Cada classe tem um limite de renderizações simultâneas, além do limite
+total; assim um lote grande nunca ocupa todas as vagas e uma proposta
+interativa espera no máximo o fim de uma renderização. Um pre_render só é
+despachado se sobrarem VAGAS_LIVRES_PRE_RENDER vagas livres para as demais
+classes. Dentro de uma classe a fila é justa por inquilino (X-Tenant de um
+chamador autenticado, chave de API ou IP), por enfileiramento justo
+ponderado (WFQ): cada trabalho recebe uma etiqueta de término virtual
+max(tempo virtual da classe, última etiqueta do inquilino) + custo / peso e
+sai primeiro o de menor etiqueta. Um inquilino com 500 propostas na fila não
+atrasa o próximo inquilino mais do que uma proposta. A última etiqueta de um
+inquilino é esquecida quando o tempo virtual a alcança.
+
+Para que as classes de baixa prioridade não fiquem paradas para sempre, o
+trabalho que espera há mais de ENVELHECIMENTO segundos sobe uma classe (e
+mais uma a cada intervalo); o limite de simultâneas continua sendo o da sua
+classe de origem. A especulação (pre_render) não envelhece: ela nunca passa
+na frente de uma requisição real.
+
+O limite total de simultâneas é adaptativo (capacidade.LimiteAdaptativo):
+cresce enquanto a latência das renderizações se mantém e cai quando ela
+dispara; os limites das classes acompanham na mesma proporção. Com a
+latência média e o custo na fila à frente, o escalonador estima a espera de
+quem chega e recusa cedo (Sobrecarga, 503 com Retry-After na API) o
+trabalho que passaria de ESPERA_MAXIMA da sua classe; um trabalho que já
+esperou além desse prazo também é recusado em vez de renderizar para um
+cliente que provavelmente desistiu.
+
+O escalonador vive no event loop (sem locks): a escolha do próximo trabalho
+acontece quando um trabalho chega ou termina. O tempo de espera na fila de
+cada classe é medido (média, percentis recentes e histograma) e exposto em
+/metricas.
+"""
+
+import asyncio
+import hashlib
+import heapq
+import hmac
+import itertools
+import math
+import os
+import time
+from collections import deque
+
+from capacidade import LimiteAdaptativo
+from rastreamento import span
+
+CLASSES = ('interativa', 'lote', 'pre_render')
+CLASSE_PADRAO = 'interativa'
+
+# Renderizações simultâneas no total e por classe
+SIMULTANEOS = int(os.getenv('ESCALONADOR_SIMULTANEOS', str(max(2, min(4, os.cpu_count() or 1)))))
+LIMITES_CLASSE = {
+    'interativa': SIMULTANEOS,
+    'lote': int(os.getenv('ESCALONADOR_LIMITE_LOTE', str(max(1, SIMULTANEOS // 2)))),
+    'pre_render': int(os.getenv('ESCALONADOR_LIMITE_PRE_RENDER', '1')),
+}
+# Segundos de espera para um trabalho subir uma classe
+ENVELHECIMENTO = float(os.getenv('ESCALONADOR_ENVELHECIMENTO', '15'))
+# Classes que não sobem por envelhecimento
+CLASSES_SEM_ENVELHECIMENTO = ('pre_render',)
+# Vagas mantidas livres para as requisições reais enquanto um pre_render roda
+# (com o limite total em 1 a especulação nunca é despachada)
+VAGAS_LIVRES_PRE_RENDER = 1
+# Espera máxima na fila (segundos) de cada classe antes de recusar com 503
+ESPERA_MAXIMA = {
+    'interativa': float(os.getenv('ESCALONADOR_ESPERA_INTERATIVA', '20')),
+    'lote': float(os.getenv('ESCALONADOR_ESPERA_LOTE', '120')),
+    'pre_render': float(os.getenv('ESCALONADOR_ESPERA_PRE_RENDER', '30')),
+}
+# Limite total adaptativo pela latência (0 mantém SIMULTANEOS fixo)
+ADAPTATIVO = os.getenv('CAPACIDADE_ADAPTATIVA', '1') != '0'
+# Intervalo do Retry-After das recusas (segundos)
+TENTAR_EM_MINIMO = 1
+TENTAR_EM_MAXIMO = 120
+
+# Token dos chamadores que podem declarar o inquilino com X-Tenant (ex.: o
+# gateway ou o CRM); sem ele o cabeçalho é ignorado
+TOKEN_INQUILINO = os.getenv('ESCALONADOR_TOKEN_INQUILINO')
+
+# Limites (segundos) do histograma de espera na fila
+BALDES_ESPERA = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Esperas recentes guardadas por classe para os percentis
+AMOSTRAS_ESPERA = 1024
+
+
+def ler_pesos(texto):
+    """Interpreta 'inquilino:peso,inquilino:peso' (peso padrão 1)"""
+    pesos = {}
+    for item in filter(None, (parte.strip() for parte in texto.split(','))):
+        inquilino, separador, peso = item.rpartition(':')
+        if not separador or not inquilino:
+            raise ValueError("ESCALONADOR_PESOS deve ter o formato 'inquilino:peso,inquilino:peso'")
+        pesos[inquilino] = float(peso)
+        if pesos[inquilino] <= 0:
+            raise ValueError("Os pesos do escalonador devem ser maiores que zero")
+    return pesos
+
+
+def _chamador_autenticado(cabecalhos, token=None):
+    """True se a requisição traz 'Authorization: Bearer <ESCALONADOR_TOKEN_INQUILINO>'"""
+    token = token or TOKEN_INQUILINO
+    if not token:
+        return False
+    autorizacao = cabecalhos.get('authorization', '')
+    return hmac.compare_digest(autorizacao.encode('utf-8', 'surrogateescape'), f"Bearer {token}".encode('utf-8'))
+
+
+def identificar_inquilino(cabecalhos, endereco, token=None):
+    """
+    Inquilino de uma requisição: cabeçalho X-Tenant de um chamador autenticado
+    (ESCALONADOR_TOKEN_INQUILINO), senão a chave X-API-Key (guardada só como
+    hash) e, sem nenhum dos dois, o IP. Sem autenticação o X-Tenant é
+    ignorado: trocar o valor a cada requisição daria ao cliente uma nova cota
+    da fila justa.
+    """
+    inquilino = cabecalhos.get('x-tenant')
+    if inquilino and _chamador_autenticado(cabecalhos, token):
+        return inquilino.strip()[:64]
+    chave = cabecalhos.get('x-api-key')
+    if chave:
+        return 'chave:' + hashlib.sha256(chave.encode('utf-8')).hexdigest()[:16]
+    return endereco or 'anonimo'
+
+
+def classe_requisicao(cabecalhos, padrao=CLASSE_PADRAO):
+    """
+    Classe de uma requisição: a do endpoint ou, com o cabeçalho X-Prioridade,
+    uma classe de prioridade igual ou menor (um cliente pode rebaixar suas
+    requisições, nunca promovê-las).
+    """
+    pedida = (cabecalhos.get('x-prioridade') or '').strip().lower()
+    if pedida in CLASSES and CLASSES.index(pedida) > CLASSES.index(padrao):
+        return pedida
+    return padrao
+
+
+class Sobrecarga(Exception):
+    """Trabalho recusado: a espera estimada passa do prazo da classe"""
+
+    def __init__(self, classe, espera):
+        super().__init__(f"Servidor sobrecarregado: espera estimada de {espera:.0f}s na fila {classe}")
+        self.classe = classe
+        # Segundos sugeridos ao cliente (cabeçalho Retry-After)
+        self.tentar_em = min(TENTAR_EM_MAXIMO, max(TENTAR_EM_MINIMO, math.ceil(espera)))
+
+
+class _Trabalho:
+    __slots__ = ('classe', 'inquilino', 'custo', 'chegada', 'futuro', 'cancelado')
+
+    def __init__(self, classe, inquilino, custo, futuro):
+        self.classe = classe
+        self.inquilino = inquilino
+        self.custo = custo
+        self.chegada = time.monotonic()
+        self.futuro = futuro
+        self.cancelado = False
+
+
+class Escalonador:
+    """Fila de renderizações com prioridade por classe, WFQ por inquilino e envelhecimento"""
+
+    def __init__(self, simultaneos=SIMULTANEOS, limites=None, envelhecimento=ENVELHECIMENTO, pesos=None,
+                 capacidade=None, espera_maxima=None):
+        """
+        Args:
+            simultaneos (int): Limite total (com `capacidade`, o inicial, que
+                também serve de escala para os limites das classes)
+            capacidade (LimiteAdaptativo): Ajusta o limite total pela latência (None: fixo)
+            espera_maxima (dict): Prazo de espera por classe (None: sem recusas)
+        """
+        self.simultaneos = simultaneos
+        self.limites = dict(LIMITES_CLASSE if limites is None else limites)
+        self.envelhecimento = envelhecimento
+        self.capacidade = capacidade
+        self.espera_maxima = dict(espera_maxima or {})
+        self.pesos = dict(pesos or {})
+        self._filas = {classe: [] for classe in CLASSES}
+        self._tempo_virtual = dict.fromkeys(CLASSES, 0.0)
+        self._ultima_etiqueta = {classe: {} for classe in CLASSES}
+        # (etiqueta, inquilino) de cada enfileiramento, para esquecer os inquilinos já alcançados
+        self._etiquetas = {classe: [] for classe in CLASSES}
+        self._sequencia = itertools.count()
+        self._em_execucao = dict.fromkeys(CLASSES, 0)
+        self._metricas = {classe: self._metricas_vazias() for classe in CLASSES}
+
+    @staticmethod
+    def _metricas_vazias():
+        return {
+            'enfileirados': 0, 'concluidos': 0, 'cancelados': 0, 'promovidos': 0, 'recusados': 0,
+            'espera_total': 0.0, 'espera_maxima': 0.0,
+            'baldes': [0] * (len(BALDES_ESPERA) + 1),
+            'recentes': deque(maxlen=AMOSTRAS_ESPERA),
+        }
+
+    def _enfileirar(self, trabalho, custo):
+        classe, inquilino = trabalho.classe, trabalho.inquilino
+        ultima = self._ultima_etiqueta[classe]
+        inicio = max(self._tempo_virtual[classe], ultima.get(inquilino, 0.0))
+        etiqueta = inicio + custo / self.pesos.get(inquilino, 1.0)
+        ultima[inquilino] = etiqueta
+        heapq.heappush(self._etiquetas[classe], (etiqueta, inquilino))
+        heapq.heappush(self._filas[classe], (etiqueta, next(self._sequencia), trabalho))
+        self._metricas[classe]['enfileirados'] += 1
+
+    def _esquecer_inquilinos(self, classe):
+        """
+        Remove os inquilinos cuja última etiqueta o tempo virtual da classe já
+        alcançou: para eles max(tempo virtual, etiqueta) é o próprio tempo
+        virtual, então a entrada não muda nada e o mapa só guarda quem tem
+        trabalho à frente.
+        """
+        tempo_virtual = self._tempo_virtual[classe]
+        etiquetas, ultima = self._etiquetas[classe], self._ultima_etiqueta[classe]
+        while etiquetas and etiquetas[0][0] <= tempo_virtual:
+            etiqueta, inquilino = heapq.heappop(etiquetas)
+            if ultima.get(inquilino) == etiqueta:
+                del ultima[inquilino]
+
+    def limite_total(self):
+        """Renderizações simultâneas admitidas agora"""
+        return self.capacidade.atual if self.capacidade is not None else self.simultaneos
+
+    def limite_classe(self, classe):
+        """Limite da classe, na proporção do limite total atual"""
+        return max(1, self.limites[classe] * self.limite_total() // self.simultaneos)
+
+    def estimar_espera(self, classe):
+        """
+        Espera estimada (segundos) de um trabalho que chega agora na classe:
+        custo na fila das classes de prioridade igual ou maior x tempo médio
+        por unidade de custo / limite total. Zero antes da primeira medição.
+        """
+        tempo_medio = self.capacidade.tempo_medio if self.capacidade is not None else None
+        if not tempo_medio:
+            return 0.0
+        a_frente = sum(
+            trabalho.custo
+            for outra in CLASSES[:CLASSES.index(classe) + 1]
+            for _, _, trabalho in self._filas[outra]
+            if not trabalho.cancelado
+        )
+        if sum(self._em_execucao.values()) >= self.limite_total():
+            a_frente += 1
+        return a_frente * tempo_medio / self.limite_total()
+
+    def na_fila(self, classe):
+        """Trabalhos aguardando na fila da classe"""
+        return sum(1 for _, _, trabalho in self._filas[classe] if not trabalho.cancelado)
+
+    def _cabeca(self, classe):
+        """Próximo trabalho não cancelado da classe (descarta os cancelados)"""
+        fila = self._filas[classe]
+        # futuro.done(): a tarefa foi cancelada e ainda não tratou o cancelamento
+        while fila and (fila[0][2].cancelado or fila[0][2].futuro.done()):
+            heapq.heappop(fila)
+        return fila[0] if fila else None
+
+    def _escolher(self, agora):
+        """Classe do próximo trabalho: menor nível efetivo (com envelhecimento), depois o mais antigo"""
+        escolhida = None
+        for nivel, classe in enumerate(CLASSES):
+            if self._em_execucao[classe] >= self.limite_classe(classe):
+                continue
+            if (classe == 'pre_render'
+                    and sum(self._em_execucao.values()) + VAGAS_LIVRES_PRE_RENDER >= self.limite_total()):
+                continue
+            cabeca = self._cabeca(classe)
+            if cabeca is None:
+                continue
+            espera = agora - cabeca[2].chegada
+            promocoes = 0
+            if self.envelhecimento > 0 and classe not in CLASSES_SEM_ENVELHECIMENTO:
+                promocoes = int(espera // self.envelhecimento)
+            chave = (max(0, nivel - promocoes), cabeca[2].chegada)
+            if escolhida is None or chave < escolhida[0]:
+                escolhida = (chave, classe, nivel)
+        return escolhida
+
+    def _despachar(self):
+        """Libera trabalhos enquanto houver vagas (total e da classe)"""
+        while sum(self._em_execucao.values()) < self.limite_total():
+            agora = time.monotonic()
+            escolhida = self._escolher(agora)
+            if escolhida is None:
+                return
+            (nivel_efetivo, _), classe, nivel = escolhida
+            etiqueta, _, trabalho = heapq.heappop(self._filas[classe])
+            self._tempo_virtual[classe] = etiqueta
+            self._esquecer_inquilinos(classe)
+            espera = agora - trabalho.chegada
+            if espera > self.espera_maxima.get(classe, math.inf):
+                # Passou do prazo na fila: o cliente provavelmente já desistiu
+                self._metricas[classe]['recusados'] += 1
+                trabalho.futuro.set_exception(Sobrecarga(classe, self.estimar_espera(classe)))
+                continue
+            self._em_execucao[classe] += 1
+            self._registrar_espera(classe, espera, nivel_efetivo < nivel)
+            trabalho.futuro.set_result(None)
+
+    def _registrar_espera(self, classe, espera, promovido):
+        metricas = self._metricas[classe]
+        metricas['espera_total'] += espera
+        metricas['espera_maxima'] = max(metricas['espera_maxima'], espera)
+        metricas['recentes'].append(espera)
+        metricas['promovidos'] += promovido
+        for i, limite in enumerate(BALDES_ESPERA):
+            if espera <= limite:
+                metricas['baldes'][i] += 1
+                break
+        else:
+            metricas['baldes'][-1] += 1
+
+    async def _aguardar_vaga(self, classe, inquilino, custo):
+        if classe not in CLASSES:
+            raise ValueError(f"Classe de prioridade desconhecida: {classe}")
+        espera = self.estimar_espera(classe)
+        if espera > self.espera_maxima.get(classe, math.inf):
+            self._metricas[classe]['recusados'] += 1
+            raise Sobrecarga(classe, espera)
+        trabalho = _Trabalho(classe, inquilino, custo, asyncio.get_running_loop().create_future())
+        self._enfileirar(trabalho, custo)
+        self._despachar()
+        try:
+            await trabalho.futuro
+        except asyncio.CancelledError:
+            # Cliente desconectou: sai da fila ou devolve a vaga já recebida
+            futuro = trabalho.futuro
+            if futuro.done() and not futuro.cancelled() and futuro.exception() is None:
+                self._liberar(classe, concluido=False)
+            else:
+                trabalho.cancelado = True
+            self._metricas[classe]['cancelados'] += 1
+            raise
+
+    def _liberar(self, classe, concluido=True):
+        self._em_execucao[classe] -= 1
+        if concluido:
+            self._metricas[classe]['concluidos'] += 1
+        self._despachar()
+
+    async def executar(self, funcao, *args, classe=CLASSE_PADRAO, inquilino='anonimo', custo=1, **kwargs):
+        """
+        Aguarda a vez do trabalho e executa `funcao` em uma thread.
+
+        Args:
+            classe (str): 'interativa', 'lote' ou 'pre_render'
+            inquilino (str): Chave da justiça entre clientes (identificar_inquilino())
+            custo (float): Peso do trabalho no WFQ (ex.: número de páginas)
+        """
+        with span('escalonador.espera', classe=classe, inquilino=inquilino):
+            await self._aguardar_vaga(classe, inquilino, custo)
+        inicio = time.monotonic()
+        renderizacao = asyncio.ensure_future(asyncio.to_thread(funcao, *args, **kwargs))
+
+        def concluir(futuro):
+            # A thread não é interrompida se o cliente desconectar: a vaga só
+            # volta quando ela termina, para os limites valerem de fato
+            if not futuro.cancelled():
+                futuro.exception()
+            if self.capacidade is not None:
+                self.capacidade.registrar(time.monotonic() - inicio, custo, sum(self._em_execucao.values()) - 1)
+            self._liberar(classe)
+
+        renderizacao.add_done_callback(concluir)
+        return await asyncio.shield(renderizacao)
+
+    def metricas(self):
+        """Estado das filas e tempos de espera (segundos) por classe"""
+        resultado = {
+            'simultaneos': self.limite_total(),
+            'envelhecimento_s': self.envelhecimento,
+            'capacidade': self.capacidade.metricas() if self.capacidade is not None else None,
+            'classes': {},
+        }
+        for classe in CLASSES:
+            metricas = self._metricas[classe]
+            recentes = sorted(metricas['recentes'])
+            despachados = sum(metricas['baldes'])
+            resultado['classes'][classe] = {
+                'limite': self.limite_classe(classe),
+                'espera_estimada_s': self.estimar_espera(classe),
+                'em_execucao': self._em_execucao[classe],
+                'na_fila': self.na_fila(classe),
+                'enfileirados': metricas['enfileirados'],
+                'concluidos': metricas['concluidos'],
+                'cancelados': metricas['cancelados'],
+                'promovidos': metricas['promovidos'],
+                'recusados': metricas['recusados'],
+                'espera_media_s': metricas['espera_total'] / despachados if despachados else 0.0,
+                'espera_p50_s': recentes[len(recentes) // 2] if recentes else 0.0,
+                'espera_p95_s': recentes[(len(recentes) - 1) * 95 // 100] if recentes else 0.0,
+                'espera_maxima_s': metricas['espera_maxima'],
+            }
+        return resultado
+
+    def metricas_prometheus(self):
+        """Tempos de espera por classe no formato de texto do Prometheus"""
+        linhas = [
+            '# HELP proposta_fila_espera_segundos Tempo de espera na fila de renderização',
+            '# TYPE proposta_fila_espera_segundos histogram',
+        ]
+        for classe in CLASSES:
+            metricas = self._metricas[classe]
+            acumulado = 0
+            for limite, quantidade in zip(BALDES_ESPERA + ('+Inf',), metricas['baldes']):
+                acumulado += quantidade
+                linhas.append(f'proposta_fila_espera_segundos_bucket{{classe="{classe}",le="{limite}"}} {acumulado}')
+            linhas.append(f'proposta_fila_espera_segundos_sum{{classe="{classe}"}} {metricas["espera_total"]:.6f}')
+            linhas.append(f'proposta_fila_espera_segundos_count{{classe="{classe}"}} {acumulado}')
+        for nome, descricao, valores in (
+            ('proposta_fila_tamanho', 'Trabalhos aguardando na fila',
+             {classe: self.na_fila(classe) for classe in CLASSES}),
+            ('proposta_renderizacoes_em_execucao', 'Renderizações em execução', self._em_execucao),
+            ('proposta_renderizacoes_limite', 'Renderizações simultâneas admitidas',
+             {classe: self.limite_classe(classe) for classe in CLASSES}),
+        ):
+            linhas += [f'# HELP {nome} {descricao}', f'# TYPE {nome} gauge']
+            linhas += [f'{nome}{{classe="{classe}"}} {valores[classe]}' for classe in CLASSES]
+        linhas += ['# HELP proposta_renderizacoes_recusadas_total Trabalhos recusados por sobrecarga (503)',
+                   '# TYPE proposta_renderizacoes_recusadas_total counter']
+        linhas += [f'proposta_renderizacoes_recusadas_total{{classe="{classe}"}} {self._metricas[classe]["recusados"]}'
+                   for classe in CLASSES]
+        return '\n'.join(linhas) + '\n'
+
+
+# Escalonador do processo (pesos por inquilino em ESCALONADOR_PESOS)
+escalonador = Escalonador(
+    pesos=ler_pesos(os.getenv('ESCALONADOR_PESOS', '')),
+    capacidade=LimiteAdaptativo(SIMULTANEOS) if ADAPTATIVO else None,
+    espera_maxima=ESPERA_MAXIMA,
+)
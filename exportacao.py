@@ -0,0 +1,295 @@
+"""
+Exportação das propostas em um arquivo ZIP gerado sob demanda
+
+O ZIP é montado a partir do histórico (historico.py), sem compressão (os PDFs
+já são comprimidos): como o tamanho e o CRC-32 de cada arquivo estão no histórico,
+o tamanho total e a posição de cada byte do ZIP são conhecidos antes de ler
+qualquer arquivo. Isso permite:
+
+- enviar o ZIP em streaming, lendo os PDFs em blocos (memória constante em
+  relação ao tamanho do arquivo; só o plano, uma entrada por PDF, fica em
+  memória);
+- informar Content-Length e atender requisições HTTP Range, retomando
+  downloads interrompidos (o ETag identifica o conteúdo exato do ZIP).
+
+Arquivos ou deslocamentos acima de 4 GiB usam as extensões ZIP64.
+
+Uso pela linha de comando:
+    python exportacao.py --inicio 2026-10-01 --fim 2026-10-31 --saida outubro.zip
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import struct
+import sys
+from datetime import date, datetime
+
+from proposta import OUTPUT_DIR
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_BLOCO = 1024 * 1024
+
+# Valores a partir dos quais os campos de 32/16 bits passam para o ZIP64
+_LIMITE_ZIP32 = 0xFFFFFFFF
+_LIMITE_ENTRADAS_ZIP32 = 0xFFFF
+_MARCADOR_ZIP64 = 0xFFFFFFFF
+_MARCADOR_ENTRADAS_ZIP64 = 0xFFFF
+_FLAG_UTF8 = 0x0800
+_VERSAO_ZIP = 20
+_VERSAO_ZIP64 = 45
+
+
+def selecionar_arquivos(inicio=None, fim=None, distribuidora=None, status=None):
+    """
+    Seleciona no histórico os arquivos a exportar.
+
+    Quando um arquivo aparece mais de uma vez (proposta regerada com o mesmo
+    nome), vale o último registro; arquivos removidos ou alterados depois do
+    registro são ignorados.
+
+    Args:
+        inicio (date): Primeira data de criação (inclusive)
+        fim (date): Última data de criação (inclusive)
+        distribuidora (str): Código da distribuidora
+        status (str): Status da proposta
+
+    Returns:
+        list: Registros do histórico ordenados por data de criação
+    """
+    from historico import descarregar, listar_arquivos
+
+    # Inclui as propostas deste processo que ainda estão na fila de gravação
+    descarregar()
+    selecionados = []
+    for registro in listar_arquivos(inicio, fim, distribuidora, status):
+        try:
+            info = os.stat(os.path.join(OUTPUT_DIR, registro['arquivo']))
+        except OSError:
+            continue
+        if info.st_size != registro['tamanho'] or info.st_mtime_ns != registro['mtime_ns']:
+            continue
+        selecionados.append(registro)
+    return selecionados
+
+
+def _data_hora_dos(criado_em):
+    """Converte a data ISO do histórico para data e hora no formato MS-DOS"""
+    momento = datetime.fromisoformat(criado_em)
+    if momento.year < 1980:
+        momento = datetime(1980, 1, 1)
+    hora = (momento.hour << 11) | (momento.minute << 5) | (momento.second // 2)
+    data = ((momento.year - 1980) << 9) | (momento.month << 5) | momento.day
+    return hora, data
+
+
+def montar_plano(registros):
+    """
+    Calcula a estrutura do ZIP sem ler os arquivos.
+
+    Returns:
+        dict: 'segmentos' (lista de (tamanho, bytes ou caminho, tamanho
+            esperado, mtime_ns)), 'tamanho' total e 'etag'
+    """
+    segmentos = []
+    centrais = []
+    deslocamento = 0
+    digest = hashlib.sha256()
+
+    for registro in registros:
+        nome = registro['arquivo'].encode('utf-8')
+        tamanho = registro['tamanho']
+        crc = registro['crc32']
+        hora, data = _data_hora_dos(registro['criado_em'])
+        digest.update(f"{registro['arquivo']}|{tamanho}|{crc}|{registro['mtime_ns']}|{registro['criado_em']}\n".encode('utf-8'))
+
+        # Cabeçalho local
+        zip64_local = tamanho >= _LIMITE_ZIP32
+        extra_local = struct.pack('<HHQQ', 0x0001, 16, tamanho, tamanho) if zip64_local else b''
+        tamanho_32 = _MARCADOR_ZIP64 if zip64_local else tamanho
+        cabecalho = struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50, _VERSAO_ZIP64 if zip64_local else _VERSAO_ZIP, _FLAG_UTF8,
+            0, hora, data, crc, tamanho_32, tamanho_32, len(nome), len(extra_local),
+        ) + nome + extra_local
+        segmentos.append((len(cabecalho), cabecalho, None, None))
+        segmentos.append((tamanho, os.path.join(OUTPUT_DIR, registro['arquivo']), tamanho, registro['mtime_ns']))
+
+        # Entrada do diretório central (ZIP64 só com os campos que estouram)
+        campos_zip64 = []
+        if tamanho >= _LIMITE_ZIP32:
+            campos_zip64 += [tamanho, tamanho]
+        if deslocamento >= _LIMITE_ZIP32:
+            campos_zip64.append(deslocamento)
+        extra_central = (struct.pack('<HH', 0x0001, 8 * len(campos_zip64))
+                         + struct.pack(f'<{len(campos_zip64)}Q', *campos_zip64)) if campos_zip64 else b''
+        versao = _VERSAO_ZIP64 if campos_zip64 else _VERSAO_ZIP
+        centrais.append(struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | versao, versao, _FLAG_UTF8, 0, hora, data,
+            crc, tamanho_32, tamanho_32, len(nome), len(extra_central), 0, 0, 0, 0o100644 << 16,
+            _MARCADOR_ZIP64 if deslocamento >= _LIMITE_ZIP32 else deslocamento,
+        ) + nome + extra_central)
+
+        deslocamento += len(cabecalho) + tamanho
+
+    diretorio_central = b''.join(centrais)
+    inicio_central = deslocamento
+    tamanho_central = len(diretorio_central)
+    quantidade = len(registros)
+    fim = b''
+    zip64 = (quantidade >= _LIMITE_ENTRADAS_ZIP32 or inicio_central >= _LIMITE_ZIP32
+             or tamanho_central >= _LIMITE_ZIP32)
+    if zip64:
+        inicio_fim_zip64 = inicio_central + tamanho_central
+        fim += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, (3 << 8) | _VERSAO_ZIP64, _VERSAO_ZIP64,
+                           0, 0, quantidade, quantidade, tamanho_central, inicio_central)
+        fim += struct.pack('<IIQI', 0x07064b50, 0, inicio_fim_zip64, 1)
+    entradas_32 = _MARCADOR_ENTRADAS_ZIP64 if zip64 else quantidade
+    fim += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, entradas_32, entradas_32,
+                       _MARCADOR_ZIP64 if zip64 else tamanho_central,
+                       _MARCADOR_ZIP64 if zip64 else inicio_central, 0)
+    segmentos.append((tamanho_central + len(fim), diretorio_central + fim, None, None))
+
+    return {
+        'segmentos': segmentos,
+        'tamanho': deslocamento + tamanho_central + len(fim),
+        'quantidade': quantidade,
+        'etag': f'"{digest.hexdigest()[:32]}"',
+    }
+
+
+def gerar_bytes(plano, inicio=0, fim=None):
+    """
+    Gera os bytes do ZIP entre inicio e fim (inclusive), em blocos.
+
+    Um PDF alterado depois de montado o plano interrompe a geração com
+    RuntimeError, pois o ZIP já anunciado não pode mais ser produzido.
+    """
+    if fim is None:
+        fim = plano['tamanho'] - 1
+    posicao = 0
+    for tamanho, origem, tamanho_esperado, mtime_ns in plano['segmentos']:
+        segmento_inicio, segmento_fim = posicao, posicao + tamanho - 1
+        posicao += tamanho
+        if segmento_fim < inicio or tamanho == 0:
+            continue
+        if segmento_inicio > fim:
+            break
+        de = max(inicio, segmento_inicio) - segmento_inicio
+        ate = min(fim, segmento_fim) - segmento_inicio + 1
+
+        if isinstance(origem, bytes):
+            yield origem[de:ate]
+            continue
+
+        with open(origem, 'rb') as f:
+            info = os.fstat(f.fileno())
+            if info.st_size != tamanho_esperado or info.st_mtime_ns != mtime_ns:
+                raise RuntimeError(f"Arquivo alterado durante a exportação: {os.path.basename(origem)}")
+            f.seek(de)
+            restante = ate - de
+            while restante > 0:
+                bloco = f.read(min(TAMANHO_BLOCO, restante))
+                if not bloco:
+                    raise RuntimeError(f"Arquivo truncado durante a exportação: {os.path.basename(origem)}")
+                restante -= len(bloco)
+                yield bloco
+
+
+def interpretar_range(cabecalho, tamanho):
+    """
+    Interpreta um cabeçalho Range de um único intervalo de bytes.
+
+    Returns:
+        tuple: (inicio, fim) inclusive; None para enviar o arquivo inteiro
+            (cabeçalho ausente ou com vários intervalos)
+
+    Raises:
+        ValueError: Intervalo fora do arquivo (HTTP 416)
+    """
+    if not cabecalho or not cabecalho.startswith('bytes=') or ',' in cabecalho:
+        return None
+    inicio_txt, _, fim_txt = cabecalho[len('bytes='):].strip().partition('-')
+    try:
+        if inicio_txt == '':
+            sufixo = int(fim_txt)
+            if sufixo <= 0:
+                raise ValueError("Intervalo vazio")
+            return max(0, tamanho - sufixo), tamanho - 1
+        inicio = int(inicio_txt)
+        fim = int(fim_txt) if fim_txt else tamanho - 1
+    except ValueError:
+        raise ValueError("Intervalo inválido")
+    if inicio >= tamanho or fim < inicio:
+        raise ValueError("Intervalo fora do arquivo")
+    return inicio, min(fim, tamanho - 1)
+
+
+def nome_exportacao(inicio=None, fim=None, distribuidora=None):
+    """Nome sugerido para o arquivo ZIP"""
+    partes = ['propostas']
+    if distribuidora:
+        partes.append(distribuidora)
+    partes.append(inicio.isoformat() if inicio else 'inicio')
+    partes.append(fim.isoformat() if fim else date.today().isoformat())
+    return '_'.join(partes) + '.zip'
+
+
+def exportar_para_arquivo(caminho, plano, continuar=False):
+    """
+    Grava o ZIP em disco; com continuar=True retoma um download parcial do
+    mesmo conteúdo (mesmo ETag, gravado em '<caminho>.etag').
+
+    Returns:
+        int: Bytes gravados nesta execução
+    """
+    arquivo_etag = f"{caminho}.etag"
+    inicio = 0
+    if continuar and os.path.exists(caminho) and os.path.exists(arquivo_etag):
+        with open(arquivo_etag, 'r', encoding='utf-8') as f:
+            if f.read().strip() == plano['etag']:
+                inicio = min(os.path.getsize(caminho), plano['tamanho'])
+            else:
+                print("Conteúdo da exportação mudou desde o download parcial; recomeçando")
+
+    with open(arquivo_etag, 'w', encoding='utf-8') as f:
+        f.write(plano['etag'])
+    gravados = 0
+    with open(caminho, 'r+b' if inicio else 'wb') as f:
+        f.seek(inicio)
+        f.truncate()
+        if inicio < plano['tamanho']:
+            for bloco in gerar_bytes(plano, inicio):
+                f.write(bloco)
+                gravados += len(bloco)
+    os.remove(arquivo_etag)
+    return gravados
+
+
+def main():
+    """Exporta as propostas pela linha de comando"""
+    parser = argparse.ArgumentParser(description="Exporta as propostas geradas em um arquivo ZIP")
+    parser.add_argument('--inicio', type=date.fromisoformat, help="Data inicial (AAAA-MM-DD)")
+    parser.add_argument('--fim', type=date.fromisoformat, help="Data final (AAAA-MM-DD)")
+    parser.add_argument('--distribuidora', help="Código da distribuidora")
+    parser.add_argument('--status', help="Status da proposta")
+    parser.add_argument('--saida', help="Arquivo ZIP de saída")
+    parser.add_argument('--continuar', action='store_true', help="Retoma uma exportação interrompida")
+    args = parser.parse_args()
+
+    registros = selecionar_arquivos(args.inicio, args.fim, args.distribuidora, args.status)
+    plano = montar_plano(registros)
+    saida = args.saida or nome_exportacao(args.inicio, args.fim, args.distribuidora)
+    print(f"Exportando {plano['quantidade']} propostas ({plano['tamanho'] / 1024 / 1024:.1f} MB) para {saida}")
+
+    try:
+        gravados = exportar_para_arquivo(saida, plano, continuar=args.continuar)
+    except (OSError, RuntimeError) as e:
+        print(f"\n❌ Erro na exportação: {str(e)} (use --continuar para retomar)")
+        sys.exit(1)
+    print(f"\n✅ Exportação concluída: {saida} ({gravados} bytes gravados)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,768 @@
+"""
+Fila de renderização compartilhada entre nós (API e workers de renderização)
+
+Sem FILA_URL cada container da API renderiza no próprio processo, pelo
+escalonador. Com FILA_URL os papéis se separam: os nós da API apenas
+enfileiram os trabalhos e aguardam o resultado, e N nós de renderização
+(`python fila_renderizacao.py`) puxam os trabalhos da fila, de modo que a
+capacidade de renderização escala em outras máquinas, independente da API.
+
+Dois brokers com a mesma semântica:
+
+    redis://host:6379/0       - servidor compatível com Redis (pacote `redis`),
+                                operações atômicas em scripts Lua
+    sqlite:///propostas/fila.db - arquivo SQLite (WAL) para um único host
+                                (containers com o mesmo volume) e testes
+
+Semântica da fila:
+
+- Ordem: classe de prioridade do escalonador (com o mesmo envelhecimento, do
+  qual a especulação fica de fora) e, dentro da classe, justiça por inquilino: a etiqueta de um trabalho é
+  max(agora, última etiqueta do inquilino) + custo x QUANTUM / peso, então um
+  inquilino com um lote de 500 propostas não passa na frente de quem chega
+  depois com uma só.
+- Especulação: cada nó de renderização executa no máximo o limite da classe
+  pre_render do escalonador e só reserva um pre_render se sobrarem
+  VAGAS_LIVRES_PRE_RENDER trabalhadores livres para as requisições reais
+  (com um único trabalhador o nó não especula).
+- Visibilidade: o trabalho reservado fica invisível por VISIBILIDADE segundos,
+  renovados pelo worker enquanto renderiza. Se o worker morrer, a reserva
+  vence e o trabalho volta para a fila.
+- Tentativas: cada reserva conta uma tentativa. Uma exceção no worker
+  devolve o trabalho depois de ATRASO_TENTATIVA x 2^(tentativa - 1) segundos;
+  esgotadas MAX_TENTATIVAS o trabalho vai para os mortos (dead-letter, ver
+  `--mortos` e `--reenfileirar`) e o resultado é um erro. Falhas de negócio
+  (entrada inválida) já voltam como resultado com 'sucesso': False e não são
+  repetidas.
+- Resultado: o worker grava o resultado (JSON) pelo id do trabalho e o nó da
+  API que o enfileirou o recebe; o resultado expira em VALIDADE_RESULTADO.
+  Só o dono da reserva (recibo) conclui o trabalho, então um worker atrasado
+  cuja reserva venceu não sobrescreve o de outro.
+
+Os arquivos gerados (media/) e o histórico (propostas/) precisam estar em um
+armazenamento compartilhado entre os nós (o resultado traz o caminho do PDF).
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import secrets
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+
+from escalonador import (
+    CLASSES, CLASSES_SEM_ENVELHECIMENTO, ENVELHECIMENTO, LIMITES_CLASSE, VAGAS_LIVRES_PRE_RENDER, Sobrecarga,
+    escalonador, ler_pesos,
+)
+from rastreamento import CONSUMIDOR, PRODUTOR, adotar, contexto_atual, executar_remoto, span
+
+logger = logging.getLogger(__name__)
+
+# Broker da fila ('' renderiza no próprio processo)
+FILA_URL = os.getenv('FILA_URL', '')
+# Segundos de invisibilidade de um trabalho reservado (renovados a cada terço)
+VISIBILIDADE = float(os.getenv('FILA_VISIBILIDADE', '60'))
+MAX_TENTATIVAS = int(os.getenv('FILA_MAX_TENTATIVAS', '3'))
+# Espera antes da nova tentativa após uma exceção (dobra a cada tentativa)
+ATRASO_TENTATIVA = 5.0
+# Espera máxima da API pelo resultado de um trabalho
+ESPERA_RESULTADO = float(os.getenv('FILA_ESPERA_RESULTADO', '300'))
+VALIDADE_RESULTADO = 3600
+# Trabalhos pendentes por classe acima dos quais a API recusa com 503
+MAX_PENDENTES = int(os.getenv('FILA_MAX_PENDENTES', '1000'))
+TENTAR_EM_FILA_CHEIA = 30
+# Segundos de "tempo virtual" por unidade de custo na justiça entre inquilinos
+QUANTUM = float(os.getenv('FILA_QUANTUM', '1'))
+# Renderizações simultâneas de um nó de renderização
+TRABALHADORES = int(os.getenv('FILA_TRABALHADORES', str(min(4, os.cpu_count() or 1))))
+# Intervalo de consulta da fila vazia (worker) e do resultado (API)
+INTERVALO_FILA_VAZIA = 0.5
+INTERVALO_RESULTADO_MAXIMO = 0.1
+
+PESOS = ler_pesos(os.getenv('ESCALONADOR_PESOS', ''))
+
+_broker = None
+_lock_broker = threading.Lock()
+
+
+def _renderizar_proposta(entrada, perfil=None, previa=None, simulacao=None):
+    from entrada import EntradaProposta
+    from proposta import processar_proposta_webhook
+
+    return processar_proposta_webhook(nome_completo=EntradaProposta(**entrada), perfil=perfil, previa=previa,
+                                      simulacao=simulacao)
+
+
+def _renderizar_unidades(nome_completo, unidades, distribuidora=None, perfil=None):
+    from entrada import EntradaUnidade
+    from unidades import processar_proposta_unidades_webhook
+
+    return processar_proposta_unidades_webhook(nome_completo, [EntradaUnidade(**unidade) for unidade in unidades],
+                                               distribuidora, perfil)
+
+
+def _pre_renderizar(entrada, perfil=None, previa=None, simulacao=None):
+    from pre_render import pre_renderizar
+
+    return pre_renderizar(entrada, perfil, previa, simulacao)
+
+
+# Chave do contexto de rastreamento nos argumentos e dos spans no resultado
+CAMPO_RASTRO = '_rastro'
+
+# Tipos de trabalho e a função que os executa (argumentos em JSON)
+TIPOS = {
+    'proposta': _renderizar_proposta,
+    'unidades': _renderizar_unidades,
+    'pre_render': _pre_renderizar,
+}
+
+
+def executar_trabalho(tipo, argumentos):
+    """
+    Executa um trabalho da fila no processo atual. Com o contexto de rastreamento
+    da API (CAMPO_RASTRO) os spans voltam no resultado, sob a mesma chave.
+    """
+    if tipo not in TIPOS:
+        raise ValueError(f"Tipo de trabalho desconhecido: {tipo}")
+    argumentos = dict(argumentos)
+    contexto = argumentos.pop(CAMPO_RASTRO, None)
+    if contexto is None:
+        with span(f'fila.{tipo}', tipo=CONSUMIDOR, raiz=True):
+            return TIPOS[tipo](**argumentos)
+    resultado, spans = executar_remoto(contexto, f'fila.{tipo}', TIPOS[tipo], **argumentos)
+    return {**resultado, CAMPO_RASTRO: spans} if isinstance(resultado, dict) else resultado
+
+
+def _nivel_efetivo(classe, criado_em, agora):
+    """Nível de prioridade com o envelhecimento do escalonador"""
+    nivel = CLASSES.index(classe)
+    if classe in CLASSES_SEM_ENVELHECIMENTO or ENVELHECIMENTO <= 0:
+        return nivel
+    promocoes = int((agora - criado_em) // ENVELHECIMENTO)
+    return max(0, nivel - promocoes)
+
+
+def _erro_resultado(erro):
+    return {'sucesso': False, 'erro': erro, 'arquivo_path': None}
+
+
+ESQUEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS trabalhos (
+    id TEXT PRIMARY KEY,
+    tipo TEXT NOT NULL,
+    classe TEXT NOT NULL,
+    inquilino TEXT NOT NULL,
+    etiqueta REAL NOT NULL,
+    argumentos TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    visivel_em REAL NOT NULL,
+    criado_em REAL NOT NULL,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    max_tentativas INTEGER NOT NULL,
+    recibo TEXT,
+    erro TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_trabalhos_fila ON trabalhos (estado, classe, etiqueta);
+CREATE INDEX IF NOT EXISTS idx_trabalhos_visivel ON trabalhos (estado, visivel_em);
+CREATE TABLE IF NOT EXISTS etiquetas (
+    classe TEXT NOT NULL,
+    inquilino TEXT NOT NULL,
+    etiqueta REAL NOT NULL,
+    PRIMARY KEY (classe, inquilino)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS resultados (
+    id TEXT PRIMARY KEY,
+    resultado TEXT NOT NULL,
+    criado_em REAL NOT NULL
+);
+"""
+
+PENDENTE = 'pendente'
+RESERVADO = 'reservado'
+MORTO = 'morto'
+
+
+class BrokerSQLite:
+    """Fila em um arquivo SQLite (WAL); uma conexão por thread"""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._local = threading.local()
+        conexao = self._conexao()
+        conexao.execute('BEGIN IMMEDIATE')
+        try:
+            for comando in ESQUEMA_SQLITE.split(';'):
+                if comando.strip():
+                    conexao.execute(comando)
+            conexao.execute('COMMIT')
+        except Exception:
+            conexao.execute('ROLLBACK')
+            raise
+
+    def _conexao(self):
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            diretorio = os.path.dirname(self.caminho)
+            if diretorio:
+                os.makedirs(diretorio, exist_ok=True)
+            conexao = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute('PRAGMA synchronous=NORMAL')
+            self._local.conexao = conexao
+        return conexao
+
+    def _transacao(self, operacao):
+        """Executa operacao(conexao, agora) em uma transação exclusiva"""
+        conexao = self._conexao()
+        conexao.execute('BEGIN IMMEDIATE')
+        try:
+            resultado = operacao(conexao, time.time())
+            conexao.execute('COMMIT')
+            return resultado
+        except Exception:
+            conexao.execute('ROLLBACK')
+            raise
+
+    def enfileirar(self, tipo, argumentos, classe, inquilino, custo=1, max_tentativas=MAX_TENTATIVAS):
+        """Enfileira um trabalho e retorna seu id (None se a classe passou de MAX_PENDENTES)"""
+        identificador = uuid.uuid4().hex
+        dados = json.dumps(argumentos, ensure_ascii=False, default=str)
+
+        def operacao(conexao, agora):
+            pendentes, = conexao.execute("SELECT COUNT(*) FROM trabalhos WHERE estado = ? AND classe = ?",
+                                         (PENDENTE, classe)).fetchone()
+            if MAX_PENDENTES and pendentes >= MAX_PENDENTES:
+                return None
+            linha = conexao.execute("SELECT etiqueta FROM etiquetas WHERE classe = ? AND inquilino = ?",
+                                    (classe, inquilino)).fetchone()
+            etiqueta = max(agora, linha[0] if linha else 0.0) + custo * QUANTUM / PESOS.get(inquilino, 1.0)
+            conexao.execute("INSERT OR REPLACE INTO etiquetas VALUES (?, ?, ?)", (classe, inquilino, etiqueta))
+            conexao.execute(
+                "INSERT INTO trabalhos (id, tipo, classe, inquilino, etiqueta, argumentos, estado, visivel_em, "
+                "criado_em, max_tentativas) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (identificador, tipo, classe, inquilino, etiqueta, dados, PENDENTE, agora, agora, max_tentativas))
+            return identificador
+
+        return self._transacao(operacao)
+
+    def _guardar_resultado(self, conexao, identificador, resultado, agora):
+        conexao.execute("INSERT OR REPLACE INTO resultados VALUES (?, ?, ?)",
+                        (identificador, json.dumps(resultado, ensure_ascii=False, default=str), agora))
+
+    def reservar(self, visibilidade=VISIBILIDADE, classes=CLASSES):
+        """
+        Reserva o próximo trabalho visível de uma das `classes`.
+
+        Returns:
+            dict: 'id', 'tipo', 'classe', 'argumentos', 'tentativas' e 'recibo'
+            (None se a fila está vazia)
+        """
+        def operacao(conexao, agora):
+            # Reservas vencidas: de volta para a fila ou, sem tentativas, para os mortos
+            vencidos = conexao.execute(
+                "SELECT id, tentativas, max_tentativas FROM trabalhos WHERE estado = ? AND visivel_em <= ?",
+                (RESERVADO, agora)).fetchall()
+            for identificador, tentativas, max_tentativas in vencidos:
+                if tentativas >= max_tentativas:
+                    erro = f"Tempo de visibilidade esgotado após {tentativas} tentativas"
+                    conexao.execute("UPDATE trabalhos SET estado = ?, recibo = NULL, erro = ? WHERE id = ?",
+                                    (MORTO, erro, identificador))
+                    self._guardar_resultado(conexao, identificador, _erro_resultado(erro), agora)
+                else:
+                    conexao.execute("UPDATE trabalhos SET estado = ?, recibo = NULL WHERE id = ?",
+                                    (PENDENTE, identificador))
+
+            # Cabeça de cada classe; vence o menor nível efetivo e, no empate, o mais antigo
+            escolhido = None
+            for classe in classes:
+                linha = conexao.execute(
+                    "SELECT id, tipo, argumentos, tentativas, criado_em, classe FROM trabalhos "
+                    "WHERE estado = ? AND classe = ? AND visivel_em <= ? ORDER BY etiqueta LIMIT 1",
+                    (PENDENTE, classe, agora)).fetchone()
+                if linha is not None:
+                    chave = (_nivel_efetivo(classe, linha[4], agora), linha[4])
+                    if escolhido is None or chave < escolhido[0]:
+                        escolhido = (chave, linha)
+            if escolhido is None:
+                return None
+            identificador, tipo, argumentos, tentativas, _, classe = escolhido[1]
+            recibo = secrets.token_hex(8)
+            conexao.execute(
+                "UPDATE trabalhos SET estado = ?, visivel_em = ?, tentativas = tentativas + 1, recibo = ? "
+                "WHERE id = ?", (RESERVADO, agora + visibilidade, recibo, identificador))
+            return {'id': identificador, 'tipo': tipo, 'classe': classe, 'argumentos': json.loads(argumentos),
+                    'tentativas': tentativas + 1, 'recibo': recibo}
+
+        return self._transacao(operacao)
+
+    def renovar(self, identificador, recibo, visibilidade=VISIBILIDADE):
+        """Estende a reserva; False se ela já não é deste recibo"""
+        def operacao(conexao, agora):
+            return conexao.execute("UPDATE trabalhos SET visivel_em = ? WHERE id = ? AND estado = ? AND recibo = ?",
+                                   (agora + visibilidade, identificador, RESERVADO, recibo)).rowcount == 1
+
+        return self._transacao(operacao)
+
+    def concluir(self, identificador, recibo, resultado):
+        """Grava o resultado e remove o trabalho; False se a reserva já não é deste recibo"""
+        def operacao(conexao, agora):
+            if conexao.execute("DELETE FROM trabalhos WHERE id = ? AND estado = ? AND recibo = ?",
+                               (identificador, RESERVADO, recibo)).rowcount != 1:
+                return False
+            self._guardar_resultado(conexao, identificador, resultado, agora)
+            conexao.execute("DELETE FROM resultados WHERE criado_em < ?", (agora - VALIDADE_RESULTADO,))
+            return True
+
+        return self._transacao(operacao)
+
+    def falhar(self, identificador, recibo, erro, atraso=ATRASO_TENTATIVA):
+        """Devolve o trabalho para nova tentativa após `atraso` segundos ou o envia aos mortos"""
+        def operacao(conexao, agora):
+            linha = conexao.execute(
+                "SELECT tentativas, max_tentativas FROM trabalhos WHERE id = ? AND estado = ? AND recibo = ?",
+                (identificador, RESERVADO, recibo)).fetchone()
+            if linha is None:
+                return False
+            if linha[0] >= linha[1]:
+                conexao.execute("UPDATE trabalhos SET estado = ?, recibo = NULL, erro = ? WHERE id = ?",
+                                (MORTO, erro, identificador))
+                self._guardar_resultado(conexao, identificador, _erro_resultado(erro), agora)
+            else:
+                conexao.execute("UPDATE trabalhos SET estado = ?, recibo = NULL, erro = ?, visivel_em = ? "
+                                "WHERE id = ?", (PENDENTE, erro, agora + atraso, identificador))
+            return True
+
+        return self._transacao(operacao)
+
+    def obter_resultado(self, identificador):
+        """Resultado do trabalho (consumido na leitura) ou None se ainda não terminou"""
+        def operacao(conexao, agora):
+            linha = conexao.execute("SELECT resultado FROM resultados WHERE id = ?", (identificador,)).fetchone()
+            if linha is None:
+                return None
+            conexao.execute("DELETE FROM resultados WHERE id = ?", (identificador,))
+            return json.loads(linha[0])
+
+        return self._transacao(operacao)
+
+    def listar_mortos(self, limite=100):
+        """Trabalhos na fila de mortos (mais recentes primeiro)"""
+        linhas = self._conexao().execute(
+            "SELECT id, tipo, classe, inquilino, tentativas, erro, criado_em FROM trabalhos WHERE estado = ? "
+            "ORDER BY criado_em DESC LIMIT ?", (MORTO, limite)).fetchall()
+        colunas = ('id', 'tipo', 'classe', 'inquilino', 'tentativas', 'erro', 'criado_em')
+        return [dict(zip(colunas, linha)) for linha in linhas]
+
+    def reenfileirar(self, identificador):
+        """Devolve um trabalho morto para a fila, com as tentativas zeradas"""
+        def operacao(conexao, agora):
+            return conexao.execute(
+                "UPDATE trabalhos SET estado = ?, tentativas = 0, visivel_em = ?, erro = NULL "
+                "WHERE id = ? AND estado = ?", (PENDENTE, agora, identificador, MORTO)).rowcount == 1
+
+        return self._transacao(operacao)
+
+    def metricas(self):
+        """Trabalhos pendentes por classe, reservados e mortos"""
+        contagens = {(estado, classe): quantidade for estado, classe, quantidade in self._conexao().execute(
+            "SELECT estado, classe, COUNT(*) FROM trabalhos GROUP BY estado, classe")}
+        return {
+            'broker': 'sqlite',
+            'pendentes': {classe: contagens.get((PENDENTE, classe), 0) for classe in CLASSES},
+            'reservados': sum(quantidade for (estado, _), quantidade in contagens.items() if estado == RESERVADO),
+            'mortos': sum(quantidade for (estado, _), quantidade in contagens.items() if estado == MORTO),
+        }
+
+
+# Scripts Lua do broker Redis: cada operação é atômica no servidor e usa o
+# relógio do servidor (TIME), então os nós não precisam de relógios sincronizados
+_LUA_AGORA = """
+local t = redis.call('TIME')
+local agora = tonumber(t[1]) + tonumber(t[2]) / 1000000
+"""
+
+_LUA_RESULTADO = """
+local function guardar_resultado(p, id, resultado, validade)
+    redis.call('RPUSH', p .. ':resultado:' .. id, resultado)
+    redis.call('EXPIRE', p .. ':resultado:' .. id, validade)
+end
+"""
+
+_LUA_ENFILEIRAR = _LUA_AGORA + """
+local p, id, classe, inquilino = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+local custo, max_pendentes = tonumber(ARGV[6]), tonumber(ARGV[8])
+if max_pendentes > 0 and redis.call('ZCARD', p .. ':pendentes:' .. classe) >= max_pendentes then
+    return 0
+end
+local ultima = tonumber(redis.call('HGET', p .. ':etiquetas:' .. classe, inquilino) or '0')
+local etiqueta = math.max(agora, ultima) + custo
+redis.call('HSET', p .. ':etiquetas:' .. classe, inquilino, etiqueta)
+redis.call('HSET', p .. ':trabalho:' .. id, 'tipo', ARGV[5], 'classe', classe, 'inquilino', inquilino,
+           'argumentos', ARGV[7], 'criado_em', agora, 'etiqueta', etiqueta, 'tentativas', 0,
+           'max_tentativas', ARGV[9], 'recibo', '')
+redis.call('ZADD', p .. ':pendentes:' .. classe, etiqueta, id)
+return 1
+"""
+
+_LUA_RESERVAR = _LUA_AGORA + _LUA_RESULTADO + """
+local p, visibilidade, recibo, envelhecimento = ARGV[1], tonumber(ARGV[2]), ARGV[3], tonumber(ARGV[4])
+local validade = tonumber(ARGV[5])
+-- Listas separadas por vírgula: classes que não envelhecem e classes que podem ser reservadas
+local sem_envelhecimento, permitidas = ',' .. ARGV[6] .. ',', ',' .. ARGV[7] .. ','
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', p .. ':reservados', '-inf', agora)) do
+    redis.call('ZREM', p .. ':reservados', id)
+    local chave = p .. ':trabalho:' .. id
+    local dados = redis.call('HMGET', chave, 'classe', 'tentativas', 'max_tentativas')
+    if dados[1] then
+        if tonumber(dados[2]) >= tonumber(dados[3]) then
+            local erro = 'Tempo de visibilidade esgotado após ' .. dados[2] .. ' tentativas'
+            redis.call('HSET', chave, 'recibo', '', 'erro', erro)
+            redis.call('LPUSH', p .. ':mortos', id)
+            guardar_resultado(p, id, cjson.encode({sucesso = false, erro = erro, arquivo_path = cjson.null}),
+                              validade)
+        else
+            redis.call('HSET', chave, 'recibo', '')
+            redis.call('ZADD', p .. ':pendentes:' .. dados[1], redis.call('HGET', chave, 'etiqueta'), id)
+        end
+    end
+end
+local escolhido, melhor_nivel, melhor_criado, melhor_classe = nil, nil, nil, nil
+for nivel = 8, #ARGV do
+    local classe = ARGV[nivel]
+    local cabeca = nil
+    if string.find(permitidas, ',' .. classe .. ',', 1, true) then
+        cabeca = redis.call('ZRANGE', p .. ':pendentes:' .. classe, 0, 0)[1]
+    end
+    if cabeca then
+        local criado = tonumber(redis.call('HGET', p .. ':trabalho:' .. cabeca, 'criado_em'))
+        local efetivo = nivel - 8
+        if envelhecimento > 0 and not string.find(sem_envelhecimento, ',' .. classe .. ',', 1, true) then
+            efetivo = math.max(0, efetivo - math.floor((agora - criado) / envelhecimento))
+        end
+        if escolhido == nil or efetivo < melhor_nivel or (efetivo == melhor_nivel and criado < melhor_criado) then
+            escolhido, melhor_nivel, melhor_criado, melhor_classe = cabeca, efetivo, criado, classe
+        end
+    end
+end
+if escolhido == nil then
+    return nil
+end
+local chave = p .. ':trabalho:' .. escolhido
+redis.call('ZREM', p .. ':pendentes:' .. melhor_classe, escolhido)
+local tentativas = redis.call('HINCRBY', chave, 'tentativas', 1)
+redis.call('HSET', chave, 'recibo', recibo)
+redis.call('ZADD', p .. ':reservados', agora + visibilidade, escolhido)
+return {escolhido, redis.call('HGET', chave, 'tipo'), redis.call('HGET', chave, 'argumentos'), tentativas,
+        melhor_classe}
+"""
+
+_LUA_RENOVAR = _LUA_AGORA + """
+local p, id, recibo, visibilidade = ARGV[1], ARGV[2], ARGV[3], tonumber(ARGV[4])
+if recibo == '' or redis.call('HGET', p .. ':trabalho:' .. id, 'recibo') ~= recibo then
+    return 0
+end
+redis.call('ZADD', p .. ':reservados', 'XX', agora + visibilidade, id)
+return 1
+"""
+
+_LUA_CONCLUIR = _LUA_RESULTADO + """
+local p, id, recibo = ARGV[1], ARGV[2], ARGV[3]
+if recibo == '' or redis.call('HGET', p .. ':trabalho:' .. id, 'recibo') ~= recibo then
+    return 0
+end
+redis.call('ZREM', p .. ':reservados', id)
+redis.call('DEL', p .. ':trabalho:' .. id)
+guardar_resultado(p, id, ARGV[4], tonumber(ARGV[5]))
+return 1
+"""
+
+_LUA_FALHAR = _LUA_AGORA + _LUA_RESULTADO + """
+local p, id, recibo, erro, atraso = ARGV[1], ARGV[2], ARGV[3], ARGV[4], tonumber(ARGV[5])
+local chave = p .. ':trabalho:' .. id
+if recibo == '' or redis.call('HGET', chave, 'recibo') ~= recibo then
+    return 0
+end
+local dados = redis.call('HMGET', chave, 'tentativas', 'max_tentativas')
+redis.call('HSET', chave, 'recibo', '', 'erro', erro)
+if tonumber(dados[1]) >= tonumber(dados[2]) then
+    redis.call('ZREM', p .. ':reservados', id)
+    redis.call('LPUSH', p .. ':mortos', id)
+    guardar_resultado(p, id, cjson.encode({sucesso = false, erro = erro, arquivo_path = cjson.null}),
+                      tonumber(ARGV[6]))
+else
+    -- Nova tentativa: a "reserva" sem dono vence após o atraso e devolve o trabalho
+    redis.call('ZADD', p .. ':reservados', agora + atraso, id)
+end
+return 1
+"""
+
+_LUA_REENFILEIRAR = """
+local p, id = ARGV[1], ARGV[2]
+if redis.call('LREM', p .. ':mortos', 1, id) == 0 then
+    return 0
+end
+local chave = p .. ':trabalho:' .. id
+redis.call('HSET', chave, 'tentativas', 0, 'erro', '')
+redis.call('ZADD', p .. ':pendentes:' .. redis.call('HGET', chave, 'classe'), redis.call('HGET', chave, 'etiqueta'), id)
+return 1
+"""
+
+
+class BrokerRedis:
+    """Fila em um servidor compatível com Redis (requer o pacote `redis`)"""
+
+    def __init__(self, url, prefixo='proposta:fila'):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("FILA_URL aponta para um Redis, mas o pacote 'redis' não está instalado "
+                               "(pip install redis)") from e
+        self.cliente = redis.Redis.from_url(url)
+        self.prefixo = prefixo
+        self._scripts = {nome: self.cliente.register_script(codigo) for nome, codigo in (
+            ('enfileirar', _LUA_ENFILEIRAR), ('reservar', _LUA_RESERVAR), ('renovar', _LUA_RENOVAR),
+            ('concluir', _LUA_CONCLUIR), ('falhar', _LUA_FALHAR), ('reenfileirar', _LUA_REENFILEIRAR),
+        )}
+
+    def _executar(self, script, *argumentos):
+        return self._scripts[script](args=[self.prefixo, *argumentos])
+
+    def enfileirar(self, tipo, argumentos, classe, inquilino, custo=1, max_tentativas=MAX_TENTATIVAS):
+        identificador = uuid.uuid4().hex
+        if not self._executar('enfileirar', identificador, classe, inquilino, tipo,
+                              custo * QUANTUM / PESOS.get(inquilino, 1.0),
+                              json.dumps(argumentos, ensure_ascii=False, default=str),
+                              MAX_PENDENTES, max_tentativas):
+            return None
+        return identificador
+
+    def reservar(self, visibilidade=VISIBILIDADE, classes=CLASSES):
+        recibo = secrets.token_hex(8)
+        trabalho = self._executar('reservar', visibilidade, recibo, ENVELHECIMENTO, VALIDADE_RESULTADO,
+                                  ','.join(CLASSES_SEM_ENVELHECIMENTO), ','.join(classes), *CLASSES)
+        if not trabalho:
+            return None
+        identificador, tipo, argumentos, tentativas, classe = trabalho
+        return {'id': identificador.decode(), 'tipo': tipo.decode(), 'classe': classe.decode(),
+                'argumentos': json.loads(argumentos), 'tentativas': int(tentativas), 'recibo': recibo}
+
+    def renovar(self, identificador, recibo, visibilidade=VISIBILIDADE):
+        return bool(self._executar('renovar', identificador, recibo, visibilidade))
+
+    def concluir(self, identificador, recibo, resultado):
+        return bool(self._executar('concluir', identificador, recibo,
+                                   json.dumps(resultado, ensure_ascii=False, default=str), VALIDADE_RESULTADO))
+
+    def falhar(self, identificador, recibo, erro, atraso=ATRASO_TENTATIVA):
+        return bool(self._executar('falhar', identificador, recibo, erro, atraso, VALIDADE_RESULTADO))
+
+    def obter_resultado(self, identificador):
+        resultado = self.cliente.lpop(f"{self.prefixo}:resultado:{identificador}")
+        return json.loads(resultado) if resultado is not None else None
+
+    def listar_mortos(self, limite=100):
+        mortos = []
+        for identificador in self.cliente.lrange(f"{self.prefixo}:mortos", 0, limite - 1):
+            dados = {chave.decode(): valor.decode() for chave, valor in
+                     self.cliente.hgetall(f"{self.prefixo}:trabalho:{identificador.decode()}").items()}
+            mortos.append({
+                'id': identificador.decode(), 'tipo': dados.get('tipo'), 'classe': dados.get('classe'),
+                'inquilino': dados.get('inquilino'), 'tentativas': int(dados.get('tentativas', 0)),
+                'erro': dados.get('erro'), 'criado_em': float(dados.get('criado_em', 0)),
+            })
+        return mortos
+
+    def reenfileirar(self, identificador):
+        return bool(self._executar('reenfileirar', identificador))
+
+    def metricas(self):
+        return {
+            'broker': 'redis',
+            'pendentes': {classe: self.cliente.zcard(f"{self.prefixo}:pendentes:{classe}") for classe in CLASSES},
+            'reservados': self.cliente.zcard(f"{self.prefixo}:reservados"),
+            'mortos': self.cliente.llen(f"{self.prefixo}:mortos"),
+        }
+
+
+def criar_broker(url):
+    """Broker a partir da URL ('redis://...', 'rediss://...' ou 'sqlite:///caminho')"""
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return BrokerRedis(url)
+    if url.startswith('sqlite:///'):
+        return BrokerSQLite(url[len('sqlite:///'):])
+    raise ValueError(f"FILA_URL não suportada: {url} (use redis://... ou sqlite:///caminho)")
+
+
+def obter_broker():
+    """Broker configurado em FILA_URL (None: renderização no próprio processo)"""
+    global _broker
+    if _broker is None and FILA_URL:
+        with _lock_broker:
+            if _broker is None:
+                _broker = criar_broker(FILA_URL)
+    return _broker
+
+
+async def executar(tipo, argumentos, classe, inquilino, custo=1, aguardar=True):
+    """
+    Executa um trabalho: pelo escalonador local ou, com FILA_URL, enfileirando
+    para os nós de renderização e aguardando o resultado (com aguardar=False
+    retorna o identificador logo após enfileirar).
+
+    Raises:
+        Sobrecarga: Fila local ou compartilhada cheia (503)
+        TimeoutError: Resultado não chegou em ESPERA_RESULTADO segundos
+    """
+    broker = obter_broker()
+    if broker is None:
+        return await escalonador.executar(executar_trabalho, tipo, argumentos, classe=classe, inquilino=inquilino,
+                                          custo=custo)
+
+    # O nó de renderização continua o rastro e devolve os spans com o resultado
+    contexto = contexto_atual() if aguardar else None
+    if contexto is not None:
+        argumentos = {**argumentos, CAMPO_RASTRO: contexto}
+    with span('fila.enfileirar', tipo=PRODUTOR, trabalho=tipo, classe=classe) as atual:
+        identificador = await asyncio.to_thread(broker.enfileirar, tipo, argumentos, classe, inquilino, custo)
+        if identificador is None:
+            raise Sobrecarga(classe, TENTAR_EM_FILA_CHEIA)
+        atual.definir(identificador=identificador)
+    logger.info(f"Trabalho {identificador} ({tipo}, {classe}) enfileirado para {inquilino}")
+    if not aguardar:
+        return identificador
+
+    # Consulta com intervalo crescente: rápido para as propostas interativas,
+    # sem martelar o broker nas longas
+    with span('fila.resultado', identificador=identificador):
+        limite = time.monotonic() + ESPERA_RESULTADO
+        intervalo = 0.01
+        while time.monotonic() < limite:
+            resultado = await asyncio.to_thread(broker.obter_resultado, identificador)
+            if resultado is not None:
+                return adotar((resultado, resultado.pop(CAMPO_RASTRO, None)))
+            await asyncio.sleep(intervalo)
+            intervalo = min(INTERVALO_RESULTADO_MAXIMO, intervalo * 2)
+        raise TimeoutError(f"Trabalho {identificador} sem resultado após {ESPERA_RESULTADO:.0f}s")
+
+
+def _processar(broker, trabalho):
+    """Executa um trabalho reservado, renovando a reserva enquanto ele roda"""
+    identificador, recibo = trabalho['id'], trabalho['recibo']
+    terminou = threading.Event()
+
+    def renovar():
+        while not terminou.wait(VISIBILIDADE / 3):
+            try:
+                if not broker.renovar(identificador, recibo):
+                    logger.warning(f"Reserva do trabalho {identificador} perdida durante a renderização")
+                    return
+            except Exception as e:
+                logger.error(f"Erro ao renovar o trabalho {identificador}: {str(e)}")
+
+    renovacao = threading.Thread(target=renovar, name=f"renovar-{identificador[:8]}", daemon=True)
+    renovacao.start()
+    try:
+        resultado = executar_trabalho(trabalho['tipo'], trabalho['argumentos'])
+    except Exception as e:
+        terminou.set()
+        logger.error(f"Trabalho {identificador} falhou (tentativa {trabalho['tentativas']}): {str(e)}",
+                     exc_info=True)
+        broker.falhar(identificador, recibo, str(e), ATRASO_TENTATIVA * 2 ** (trabalho['tentativas'] - 1))
+        return
+    terminou.set()
+    if not broker.concluir(identificador, recibo, resultado):
+        logger.warning(f"Trabalho {identificador} concluído após perder a reserva; resultado descartado")
+
+
+def executar_trabalhador(broker, trabalhadores=TRABALHADORES, parar=None):
+    """
+    Laço de um nó de renderização: `trabalhadores` threads reservam e executam
+    trabalhos até `parar` (threading.Event) ser sinalizado; os trabalhos em
+    andamento terminam antes do retorno. A classe pre_render só é reservada
+    dentro do seu limite e com VAGAS_LIVRES_PRE_RENDER trabalhadores livres.
+    """
+    parar = parar or threading.Event()
+    reais = tuple(classe for classe in CLASSES if classe != 'pre_render')
+    # Trabalhadores ocupados (reservando ou executando) e vagas de pre_render em uso no nó
+    estado = {'ocupados': 0, 'pre_render': 0}
+    lock = threading.Lock()
+
+    def laco():
+        while not parar.is_set():
+            with lock:
+                especular = (estado['pre_render'] < LIMITES_CLASSE['pre_render']
+                             and estado['ocupados'] + 1 + VAGAS_LIVRES_PRE_RENDER <= trabalhadores)
+                estado['ocupados'] += 1
+                estado['pre_render'] += especular
+            try:
+                trabalho = broker.reservar(classes=CLASSES if especular else reais)
+            except Exception as e:
+                logger.error(f"Erro ao reservar trabalho: {str(e)}")
+                trabalho = None
+            if especular and (trabalho is None or trabalho['classe'] != 'pre_render'):
+                # Devolve a vaga de pre_render guardada para esta reserva
+                with lock:
+                    estado['pre_render'] -= 1
+                especular = False
+            try:
+                if trabalho is not None:
+                    _processar(broker, trabalho)
+            finally:
+                with lock:
+                    estado['ocupados'] -= 1
+                    estado['pre_render'] -= especular
+            if trabalho is None:
+                parar.wait(INTERVALO_FILA_VAZIA)
+
+    threads = [threading.Thread(target=laco, name=f"renderizador-{indice}") for indice in range(trabalhadores)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    """Nó de renderização e administração da fila de mortos"""
+    parser = argparse.ArgumentParser(description="Nó de renderização da fila compartilhada (FILA_URL)")
+    parser.add_argument('--trabalhadores', type=int, default=TRABALHADORES, help="Renderizações simultâneas")
+    parser.add_argument('--mortos', action='store_true', help="Lista os trabalhos na fila de mortos")
+    parser.add_argument('--reenfileirar', metavar='ID', help="Devolve um trabalho morto para a fila")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    broker = obter_broker()
+    if broker is None:
+        parser.error("Defina FILA_URL (redis://... ou sqlite:///caminho)")
+    if args.mortos:
+        for morto in broker.listar_mortos():
+            print(json.dumps(morto, ensure_ascii=False))
+        return
+    if args.reenfileirar:
+        if not broker.reenfileirar(args.reenfileirar):
+            parser.error(f"Trabalho {args.reenfileirar} não está na fila de mortos")
+        print(f"Trabalho {args.reenfileirar} devolvido para a fila")
+        return
+
+    from proposta import aquecer_renderizacao
+    duracao = aquecer_renderizacao()
+    logger.info(f"Nó de renderização pronto (aquecimento em {duracao:.2f}s, {args.trabalhadores} trabalhadores)")
+
+    parar = threading.Event()
+    for sinal in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sinal, lambda *_: parar.set())
+    executar_trabalhador(broker, args.trabalhadores, parar)
+    from unidades import encerrar_executor
+    from historico import encerrar as encerrar_historico
+    encerrar_executor()
+    encerrar_historico()
+    logger.info("Nó de renderização encerrado")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Formatação pt-BR dos valores da proposta (moeda, inteiros, tarifas e datas)
+
+Não usa o locale do C (locale.setlocale é global ao processo, não é seguro
+entre threads e o pt_BR costuma não existir na imagem Docker slim): os
+separadores e os nomes dos meses estão aqui. Todas as funções são puras e
+podem ser chamadas de qualquer thread.
+
+Os valores monetários são formatados a partir dos centavos inteiros do motor
+(centavos.py), então o texto é exatamente o valor calculado, sem um segundo
+arredondamento. formatar_valores() formata um conjunto de campos de uma vez e
+formatar_lote() uma coluna inteira (lista ou array int64 de precificar_lote()).
+"""
+
+from centavos import CENTAVOS_POR_REAL, MICRO_POR_REAL, para_centavos, para_micro
+
+MESES = (
+    'JANEIRO', 'FEVEREIRO', 'MARÇO', 'ABRIL', 'MAIO', 'JUNHO',
+    'JULHO', 'AGOSTO', 'SETEMBRO', 'OUTUBRO', 'NOVEMBRO', 'DEZEMBRO',
+)
+
+
+def formatar_centavos(centavos):
+    """Centavos inteiros -> '1.234,56' (negativos com '-')"""
+    reais, resto = divmod(abs(centavos), CENTAVOS_POR_REAL)
+    # Milhar com '_' no format() e troca por '.' (uma única substituição)
+    texto = f"{reais:_},{resto:02d}".replace('_', '.')
+    return f"-{texto}" if centavos < 0 else texto
+
+
+def formatar_moeda(valor):
+    """Formata um valor em reais (número ou texto numérico) como '1.234,56'"""
+    try:
+        return formatar_centavos(para_centavos(valor))
+    except (ValueError, TypeError, OverflowError):
+        return "0,00"
+
+
+def formatar_inteiro(valor):
+    """Formata um número inteiro com separador de milhares ('12.345')"""
+    return f"{int(valor):_}".replace('_', '.')
+
+
+def formatar_tarifa(valor):
+    """Tarifa por kWh com seis casas ('1,138131'); aceita reais ou micro-reais (int)"""
+    micro = valor if isinstance(valor, int) else para_micro(valor)
+    reais, resto = divmod(abs(micro), MICRO_POR_REAL)
+    return f"{'-' if micro < 0 else ''}{reais},{resto:06d}"
+
+
+def mes_extenso(data):
+    """Mês e ano da data em maiúsculas ('OUTUBRO/2026')"""
+    return f"{MESES[data.month - 1]}/{data.year}"
+
+
+def formatar_valores(centavos, campos, sufixo='_fmt'):
+    """
+    Formata vários campos monetários de uma vez.
+
+    Args:
+        centavos (dict): Campo -> centavos inteiros (calcular_centavos())
+        campos: Campos a formatar
+        sufixo (str): Acrescentado ao nome de cada campo no resultado
+
+    Returns:
+        dict: Campo + sufixo -> texto
+    """
+    return {f"{campo}{sufixo}": formatar_centavos(centavos[campo]) for campo in campos}
+
+
+def formatar_lote(centavos):
+    """Formata uma coluna de centavos (lista ou array int64) e retorna a lista de textos"""
+    if hasattr(centavos, 'tolist'):
+        centavos = centavos.tolist()
+    return list(map(formatar_centavos, centavos))
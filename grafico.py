@@ -0,0 +1,366 @@
+"""
+Renderizador do gráfico de comparação da proposta
+
+As figuras do matplotlib são construídas uma única vez por processo e mantidas
+em um pool; a cada proposta uma figura é emprestada e apenas as alturas das
+barras, os textos e as posições das linhas de referência são atualizados.
+O pyplot (e seu gerenciador global de figuras) não é usado; a figura é
+desenhada diretamente pelo backend Agg.
+
+Os PNGs gerados ficam em um cache LRU chaveado pela versão da tabela de
+tarifas, pelos valores do gráfico e pela resolução, descartado quando as
+tarifas mudam.
+
+Com a simulação de bandeiras (simulacao.py) a barra "SEM Geração Solar" ganha
+uma faixa (P5-P95) da economia mensal média ao longo do contrato, somada à
+fatura com geração; sem a simulação a faixa fica oculta.
+"""
+
+import threading
+from contextlib import contextmanager
+from io import BytesIO
+
+from cache import criar_cache_por_tarifas
+from formatacao import formatar_moeda
+
+# Quantidade máxima de linhas de referência do eixo y (ver calcular_escala_y)
+MAX_LINHAS_REFERENCIA = 7
+
+CATEGORIAS = ['SEM Geração Solar:', 'COM Geração Solar:']
+POSICOES_X = (0.3, 0.7)
+LARGURA_BARRA = 0.25
+# Largura das marcas nas pontas da faixa da simulação (fração da barra)
+LARGURA_MARCA_FAIXA = 0.4
+COR_FAIXA = 'white'
+
+# Valores de uma proposta típica, usados para calcular o layout da figura
+VALORES_REFERENCIA_LAYOUT = (439.85, 375.66, 56.91, 61.99, 20.0)
+
+# (rótulo da legenda, cor) de cada segmento, na ordem em que são empilhados
+SEGMENTOS_SEM_GERACAO = [
+    ('Iluminação Pública', '#fc8800'),
+    ('Consumo Mínimo', '#F4C430'),
+    ('Consumo Compensável', '#d11d05'),
+]
+SEGMENTOS_COM_GERACAO = [
+    (None, '#fc8800'),
+    (None, '#F4C430'),
+    ('Cons. Comp. c/ Deságio', '#00b050'),
+]
+
+# Tamanho da figura (polegadas) e resolução original do PNG
+TAMANHO_FIGURA = (10, 8.5)
+DPI_GRAFICO = 300
+
+# Quantidade de PNGs mantidos em cache (0 desativa o cache)
+MAX_GRAFICOS_CACHE = 32
+
+# Figuras já construídas e livres para uso (uma por renderização simultânea)
+_figuras_livres = []
+_lock_pool = threading.Lock()
+# O estilo 'ggplot' é aplicado alterando rcParams globais; a construção das
+# figuras é serializada para que threads não vejam o estilo pela metade
+_lock_construcao = threading.Lock()
+
+# Compartilhado entre os workers com MEMORIA_COMPARTILHADA=1
+_cache_png = criar_cache_por_tarifas('graficos', MAX_GRAFICOS_CACHE, compartilhado=True)
+
+
+def calcular_escala_y(max_value):
+    """Retorna o limite do eixo y e as posições das linhas de referência"""
+    import numpy as np
+
+    if max_value < 300:
+        y_max = np.ceil(max_value / 50) * 50
+        y_ticks = np.arange(0, y_max + 50, 50)
+    elif max_value < 400:
+        y_max = 400
+        y_ticks = np.array([0, 66.50, 133.00, 200.50, 267.00, 333.50, 400.00])
+    elif max_value < 600:
+        y_max = 600
+        y_ticks = np.array([0, 100.00, 200.00, 300.00, 400.00, 500.00, 600.00])
+    else:
+        y_max = np.ceil(max_value / 100) * 100
+        intervalo = y_max / 6
+        y_ticks = np.array([i * intervalo for i in range(7)])
+    return y_max, y_ticks
+
+
+def ajustar_altura_visual(valor, valor_maximo):
+    """Garante uma altura mínima visível para segmentos pequenos"""
+    if valor == 0:
+        return 0
+    altura_minima = valor_maximo * 0.05
+    if valor < altura_minima:
+        return altura_minima
+    return valor
+
+
+def construir_grafico():
+    """
+    Constrói a figura com todos os artistas que serão atualizados a cada proposta.
+
+    Returns:
+        dict: Figura e referências para barras, linhas e textos
+    """
+    import matplotlib.style
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from matplotlib.lines import Line2D
+
+    with _lock_construcao, matplotlib.style.context('ggplot'):
+        fig = Figure(figsize=TAMANHO_FIGURA)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        fig.patch.set_alpha(0.0)
+        ax.patch.set_alpha(0.0)
+        fig.subplots_adjust(left=0.2)
+
+        # Linhas de referência e seus rótulos (as não usadas ficam ocultas)
+        linhas = []
+        rotulos_linhas = []
+        for _ in range(MAX_LINHAS_REFERENCIA):
+            linha = Line2D([0, 1.0], [0, 0], color='white', linestyle='-', linewidth=1,
+                           alpha=1.0, solid_capstyle='butt', zorder=1)
+            ax.add_line(linha)
+            linhas.append(linha)
+            rotulos_linhas.append(ax.text(-0.03, 0, '', color='white', va='center',
+                                          ha='right', fontsize=18))
+
+        # Barras empilhadas: três segmentos em cada posição
+        barras = []
+        for x, segmentos in zip(POSICOES_X, (SEGMENTOS_SEM_GERACAO, SEGMENTOS_COM_GERACAO)):
+            for rotulo, cor in segmentos:
+                barras.extend(ax.bar(x, 1, LARGURA_BARRA, label=rotulo, color=cor, zorder=2))
+
+        # Valores dentro das barras e totais abaixo delas
+        valores = [ax.text(0, 0, '', ha='center', va='center', color='white',
+                           fontsize=18, fontweight='bold') for _ in barras]
+        totais = [ax.text(x, 0, '', ha='center', va='top', color='white', fontsize=18)
+                  for x in POSICOES_X]
+
+        # Configurações do gráfico
+        ax.set_xticks(POSICOES_X)
+        ax.set_xticklabels(CATEGORIAS, fontsize=18, color='white')
+        ax.set_title('Economia de          na energia solar injetada\n e compensada, ao longo do Contrato.',
+                     color='white', pad=20, fontsize=24)
+
+        # Faixa P5-P95 da simulação sobre a barra sem geração (oculta por padrão)
+        x_faixa = POSICOES_X[0]
+        meia_marca = LARGURA_BARRA * LARGURA_MARCA_FAIXA / 2
+        faixa = {
+            'linha': Line2D([x_faixa, x_faixa], [0, 0], color=COR_FAIXA, linewidth=3, zorder=3),
+            'marcas': [Line2D([x_faixa - meia_marca, x_faixa + meia_marca], [0, 0], color=COR_FAIXA,
+                              linewidth=3, zorder=3) for _ in range(2)],
+            'texto': ax.text(x_faixa, 0, '', ha='center', va='bottom', color=COR_FAIXA, fontsize=14, zorder=3),
+        }
+        for artista in (faixa['linha'], *faixa['marcas']):
+            ax.add_line(artista)
+            artista.set_visible(False)
+        faixa['texto'].set_visible(False)
+
+        desconto = ax.text(0.375, 1.13, '', color='white', fontsize=28, ha='center',
+                           va='center', fontweight='bold', transform=ax.transAxes)
+
+        ax.tick_params(colors='white', labelsize=18)
+        ax.xaxis.label.set_color('white')
+        ax.yaxis.label.set_color('white')
+        for spine in ax.spines.values():
+            spine.set_visible(False)
+        ax.tick_params(axis='y', length=0)
+        ax.set_yticks([])
+
+        legend = ax.legend(
+            bbox_to_anchor=(0.5, -0.10),
+            loc='upper center',
+            ncol=2,
+            fontsize=14,
+            frameon=False,
+        )
+        for text in legend.get_texts():
+            text.set_color('white')
+
+        grafico = {
+            'fig': fig,
+            'ax': ax,
+            'linhas': linhas,
+            'rotulos_linhas': rotulos_linhas,
+            'barras': barras,
+            'valores': valores,
+            'totais': totais,
+            'desconto': desconto,
+            'faixa': faixa,
+        }
+
+        # O layout é calculado uma única vez, com os textos de uma proposta
+        # típica; as posições x nunca mudam, então os limites do eixo x
+        # também ficam fixos
+        ax.set_xlim(ax.get_xlim())
+        atualizar_grafico(grafico, *VALORES_REFERENCIA_LAYOUT)
+        fig.subplots_adjust(bottom=0.05)
+        fig.tight_layout()
+        fig.subplots_adjust(top=0.831, bottom=0.15)
+
+    return grafico
+
+
+@contextmanager
+def emprestar_grafico():
+    """Empresta uma figura do pool, construindo uma nova se todas estiverem em uso"""
+    with _lock_pool:
+        grafico = _figuras_livres.pop() if _figuras_livres else None
+    if grafico is None:
+        grafico = construir_grafico()
+    try:
+        yield grafico
+    finally:
+        with _lock_pool:
+            _figuras_livres.append(grafico)
+
+
+def preparar_grafico():
+    """Garante que exista ao menos uma figura pré-construída no pool (aquecimento)"""
+    with emprestar_grafico():
+        pass
+
+
+def atualizar_faixa(grafico, com_geracao, faixa, y_max):
+    """Mostra (ou oculta, com faixa None) a faixa (menor, maior) da economia mensal simulada"""
+    artistas = grafico['faixa']
+    visivel = faixa is not None
+    for artista in (artistas['linha'], *artistas['marcas'], artistas['texto']):
+        artista.set_visible(visivel)
+    if not visivel:
+        return
+    inferior, superior = com_geracao + faixa[0], com_geracao + faixa[1]
+    artistas['linha'].set_ydata([inferior, superior])
+    for marca, y in zip(artistas['marcas'], (inferior, superior)):
+        marca.set_ydata([y, y])
+    artistas['texto'].set_y(superior + y_max * 0.01)
+    artistas['texto'].set_text(f"Economia/mês (P5–P95)\nR$ {formatar_moeda(faixa[0])} a R$ {formatar_moeda(faixa[1])}")
+
+
+def atualizar_grafico(grafico, sem_geracao, com_geracao, consumo_minimo_energisa, tax_ilu_pub, desconto,
+                      faixa=None, energia_compensada=None, fatura_geradora=None):
+    """
+    Atualiza alturas, textos e linhas de referência da figura com os valores da proposta.
+
+    `energia_compensada` e `fatura_geradora` são os segmentos de cima das
+    barras como impressos na tabela do PDF (centavos.py); sem eles, são o
+    total menos a iluminação e o consumo mínimo.
+    """
+    ax = grafico['ax']
+    max_value = max(sem_geracao, com_geracao)
+    if faixa is not None:
+        # Espaço para a faixa e seu rótulo acima da barra
+        max_value = max(max_value, (com_geracao + faixa[1]) * 1.15)
+    y_max, y_ticks = calcular_escala_y(max_value)
+
+    # Linhas de referência
+    for i, (linha, rotulo) in enumerate(zip(grafico['linhas'], grafico['rotulos_linhas'])):
+        visivel = i < len(y_ticks)
+        linha.set_visible(visivel)
+        rotulo.set_visible(visivel)
+        if visivel:
+            y_value = y_ticks[i]
+            linha.set_ydata([y_value, y_value])
+            rotulo.set_y(y_value)
+            rotulo.set_text(f"R$ {formatar_moeda(int(y_value))}")
+
+    # Alturas reais e visuais dos segmentos de cada barra
+    alturas = []
+    for total, parcela in ((sem_geracao, energia_compensada), (com_geracao, fatura_geradora)):
+        altura_iluminacao_visual = ajustar_altura_visual(tax_ilu_pub, max_value)
+        altura_consumo_minimo_visual = ajustar_altura_visual(consumo_minimo_energisa, max_value)
+        ajuste_total = (altura_iluminacao_visual - tax_ilu_pub) + (altura_consumo_minimo_visual - consumo_minimo_energisa)
+        altura_restante = total - tax_ilu_pub - consumo_minimo_energisa if parcela is None else parcela
+        alturas.append([
+            (tax_ilu_pub, altura_iluminacao_visual),
+            (consumo_minimo_energisa, altura_consumo_minimo_visual),
+            (altura_restante, altura_restante - ajuste_total),
+        ])
+
+    barras = iter(grafico['barras'])
+    valores = iter(grafico['valores'])
+    for segmentos in alturas:
+        base = 0
+        for valor_real, altura_visual in segmentos:
+            rect = next(barras)
+            rect.set_y(base)
+            rect.set_height(altura_visual)
+            base += altura_visual
+
+            # Valor dentro da barra (usando o valor real, não o visual)
+            texto = next(valores)
+            texto.set_visible(valor_real > 0)
+            if valor_real > 0:
+                font_size = 18
+                if valor_real > 99999:
+                    font_size = 16
+                elif valor_real > 9999:
+                    font_size = 17
+                texto.set_position((rect.get_x() + rect.get_width() / 2., rect.get_y() + altura_visual / 2))
+                texto.set_fontsize(font_size)
+                texto.set_text(f"R$ {formatar_moeda(valor_real)}")
+
+    # Totais abaixo das barras
+    for texto, total in zip(grafico['totais'], (sem_geracao, com_geracao)):
+        texto.set_y(-y_max * 0.07)
+        texto.set_text(f"R$ {formatar_moeda(total)}")
+
+    atualizar_faixa(grafico, com_geracao, faixa, y_max)
+    ax.set_ylim(0, y_max)
+    grafico['desconto'].set_text(f"{int(desconto)}%")
+
+
+def dpi_para_tamanho(largura, altura, dpi=None):
+    """
+    Resolução do PNG para que o gráfico desenhado em largura x altura
+    (pontos) tenha `dpi` na página; None mantém DPI_GRAFICO.
+    """
+    if dpi is None:
+        return DPI_GRAFICO
+    escala = max(largura / 72 / TAMANHO_FIGURA[0], altura / 72 / TAMANHO_FIGURA[1])
+    return min(DPI_GRAFICO, round(dpi * escala, 2))
+
+
+def salvar_grafico(grafico, dpi=DPI_GRAFICO):
+    """Renderiza a figura em PNG transparente e retorna o buffer"""
+    buffer = BytesIO()
+    grafico['fig'].savefig(buffer,
+                           format='png',
+                           transparent=True,
+                           bbox_inches='tight',
+                           dpi=dpi,
+                           facecolor='none',
+                           edgecolor='none')
+    buffer.seek(0)
+    return buffer
+
+
+def renderizar_grafico(sem_geracao, com_geracao, consumo_minimo_energisa, tax_ilu_pub, desconto,
+                       versao_tarifas=None, dpi=DPI_GRAFICO, faixa=None, energia_compensada=None,
+                       fatura_geradora=None):
+    """
+    Atualiza uma figura do pool com os valores da proposta e retorna o PNG.
+
+    Com versao_tarifas informada o PNG é buscado/gravado no cache. `faixa`
+    (menor, maior) é a economia mensal simulada desenhada sobre a barra sem
+    geração; `energia_compensada` e `fatura_geradora` como em atualizar_grafico().
+    """
+    valores = (sem_geracao, com_geracao, consumo_minimo_energisa, tax_ilu_pub, desconto)
+    parcelas = {'energia_compensada': energia_compensada, 'fatura_geradora': fatura_geradora}
+    chave = tuple(None if valor is None else round(float(valor), 6)
+                  for valor in (*valores, energia_compensada, fatura_geradora)) + (dpi, faixa)
+    if versao_tarifas is not None:
+        png = _cache_png.obter(versao_tarifas, chave)
+        if png is not None:
+            return BytesIO(png)
+
+    with emprestar_grafico() as grafico:
+        atualizar_grafico(grafico, *valores, faixa=faixa, **parcelas)
+        buffer = salvar_grafico(grafico, dpi)
+
+    if versao_tarifas is not None:
+        _cache_png.guardar(versao_tarifas, chave, buffer.getvalue())
+    return buffer
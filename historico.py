@@ -0,0 +1,530 @@
+"""
+Histórico das propostas geradas (SQLite em modo WAL)
+
+Cada proposta gerada (ou que falhou) vira uma linha com as entradas, os
+valores calculados, o arquivo gravado (tamanho, CRC-32), as versões das
+tarifas e do layout e o tempo de geração. As gravações não acontecem na
+requisição: registrar_proposta() apenas coloca o registro em uma fila, e uma
+thread grava os registros em lotes, em uma única transação por lote.
+
+Consultas (busca por nome, duplicatas, exportação e relatórios) usam os
+índices de nome, criado_em e valor_fatura em vez de varrer o webhook.log ou
+o diretório media/.
+
+As análises (totais e distribuição das economias por dia, cidade, faixa da
+fatura e distribuidora) vêm de tabelas de resumo atualizadas na mesma
+transação que grava cada lote; uma consulta agrega apenas os resumos, sem
+reler as propostas.
+"""
+
+import json
+import logging
+import math
+import os
+import queue
+import re
+import sqlite3
+import threading
+import zlib
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from proposta import EXPORTADOR_DIR
+from rastreamento import rastrear
+
+logger = logging.getLogger(__name__)
+
+ARQUIVO_HISTORICO = os.getenv('HISTORICO_DB', os.path.join(EXPORTADOR_DIR, 'propostas', 'historico.db'))
+
+STATUS_GERADA = 'gerada'
+STATUS_ERRO = 'erro'
+
+# Registros gravados por transação e espera máxima (s) para completar um lote
+TAMANHO_LOTE = 200
+ESPERA_LOTE = 0.5
+MAX_FILA = 10000
+
+COLUNAS = (
+    'criado_em', 'tipo', 'status', 'nome', 'endereco', 'cidade', 'faixa', 'valor_fatura', 'unidades',
+    'distribuidora', 'versao_tarifas', 'layout', 'versao_layout',
+    'arquivo', 'tamanho', 'crc32', 'mtime_ns',
+    'valor_desconto', 'economia_ano', 'economia_5ano',
+    'parametros', 'valores', 'duracao_ms', 'erro',
+)
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS propostas (
+    id INTEGER PRIMARY KEY,
+    criado_em TEXT NOT NULL,
+    tipo TEXT NOT NULL,
+    status TEXT NOT NULL,
+    nome TEXT,
+    endereco TEXT,
+    cidade TEXT,
+    faixa TEXT,
+    valor_fatura REAL,
+    unidades INTEGER,
+    distribuidora TEXT,
+    versao_tarifas TEXT,
+    layout TEXT,
+    versao_layout TEXT,
+    arquivo TEXT,
+    tamanho INTEGER,
+    crc32 INTEGER,
+    mtime_ns INTEGER,
+    valor_desconto REAL,
+    economia_ano REAL,
+    economia_5ano REAL,
+    parametros TEXT,
+    valores TEXT,
+    duracao_ms REAL,
+    erro TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_propostas_nome ON propostas (nome);
+CREATE INDEX IF NOT EXISTS idx_propostas_criado_em ON propostas (criado_em);
+CREATE INDEX IF NOT EXISTS idx_propostas_valor_fatura ON propostas (valor_fatura);
+CREATE INDEX IF NOT EXISTS idx_propostas_arquivo ON propostas (arquivo);
+"""
+
+# Colunas acrescentadas depois da criação do histórico (migradas com ALTER TABLE)
+COLUNAS_ADICIONADAS = ('cidade', 'faixa')
+
+# Métricas acumuladas nos resumos e dimensões pelas quais podem ser agrupadas
+METRICAS = ('valor_desconto', 'economia_ano', 'economia_5ano')
+DIMENSOES = ('dia', 'cidade', 'faixa', 'distribuidora')
+# Limites (R$) das classes da distribuição de economia_ano; a última classe não tem limite
+LIMITES_DISTRIBUICAO = (500, 1000, 2000, 5000, 10000, 20000)
+
+SEM_CIDADE = 'não informada'
+VARIAS = 'várias'
+
+ESQUEMA_RESUMOS = f"""
+CREATE TABLE IF NOT EXISTS resumos (
+    dia TEXT NOT NULL,
+    cidade TEXT NOT NULL,
+    faixa TEXT NOT NULL,
+    distribuidora TEXT NOT NULL,
+    quantidade INTEGER NOT NULL,
+    soma_valor_fatura REAL NOT NULL,
+    {', '.join(f'soma_{m} REAL NOT NULL, quad_{m} REAL NOT NULL, min_{m} REAL NOT NULL, max_{m} REAL NOT NULL'
+               for m in METRICAS)},
+    PRIMARY KEY (dia, cidade, faixa, distribuidora)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS resumos_distribuicao (
+    dia TEXT NOT NULL,
+    cidade TEXT NOT NULL,
+    faixa TEXT NOT NULL,
+    distribuidora TEXT NOT NULL,
+    classe INTEGER NOT NULL,
+    quantidade INTEGER NOT NULL,
+    PRIMARY KEY (dia, cidade, faixa, distribuidora, classe)
+) WITHOUT ROWID;
+"""
+
+UFS = {
+    'AC', 'AL', 'AP', 'AM', 'BA', 'CE', 'DF', 'ES', 'GO', 'MA', 'MT', 'MS', 'MG', 'PA',
+    'PB', 'PR', 'PE', 'PI', 'RJ', 'RN', 'RS', 'RO', 'RR', 'SC', 'SP', 'SE', 'TO',
+}
+# "... - Campo Grande/MS", "..., Dourados - MS", "..., Corumbá, MS, 79300-000"
+_PADRAO_CIDADE = re.compile(
+    r"([^,\-/]+?)\s*[/,\-]\s*([A-Za-z]{2})\.?\s*(?:[,\-]?\s*(?:CEP:?\s*)?\d{5}-?\d{3})?\s*$"
+)
+_CONECTIVOS = {'de', 'da', 'do', 'das', 'dos', 'e'}
+
+_fila = queue.Queue(maxsize=MAX_FILA)
+_gravador = None
+_lock = threading.Lock()
+_FIM = object()
+
+
+def conectar():
+    """Abre uma conexão com o histórico (WAL, espera por locks de outros processos)"""
+    os.makedirs(os.path.dirname(ARQUIVO_HISTORICO), exist_ok=True)
+    conexao = sqlite3.connect(ARQUIVO_HISTORICO, timeout=30)
+    conexao.row_factory = sqlite3.Row
+    conexao.execute('PRAGMA journal_mode=WAL')
+    conexao.execute('PRAGMA synchronous=NORMAL')
+    return conexao
+
+
+def _criar_esquema(conexao):
+    """Cria as tabelas e os índices (e as colunas adicionadas depois)"""
+    # Transação exclusiva: vários workers podem iniciar ao mesmo tempo
+    conexao.execute('BEGIN IMMEDIATE')
+    try:
+        tabelas = {linha[0] for linha in conexao.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for comando in (ESQUEMA + ESQUEMA_RESUMOS).split(';'):
+            if comando.strip():
+                conexao.execute(comando)
+        existentes = {linha[1] for linha in conexao.execute("PRAGMA table_info(propostas)")}
+        for coluna in COLUNAS_ADICIONADAS:
+            if coluna not in existentes:
+                conexao.execute(f"ALTER TABLE propostas ADD COLUMN {coluna} TEXT")
+        if 'resumos' not in tabelas:
+            # Única varredura do histórico: preenche os resumos de um banco anterior a eles
+            registros = (dict(linha) for linha in conexao.execute(
+                "SELECT * FROM propostas WHERE status = ?", (STATUS_GERADA,)))
+            _acumular_resumos(conexao, registros)
+        conexao.commit()
+    except Exception:
+        conexao.rollback()
+        raise
+
+
+_SQL_INSERCAO = (f"INSERT INTO propostas ({', '.join(COLUNAS)}) "
+                 f"VALUES ({', '.join('?' for _ in COLUNAS)})")
+
+
+def _linha(registro):
+    """Converte um registro (dict) para a tupla de COLUNAS"""
+    linha = []
+    for coluna in COLUNAS:
+        valor = registro.get(coluna)
+        if coluna in ('parametros', 'valores') and valor is not None:
+            valor = json.dumps(valor, ensure_ascii=False, default=str)
+        linha.append(valor)
+    return tuple(linha)
+
+
+def extrair_cidade(endereco):
+    """Cidade/UF do final do endereço (ex.: 'Campo Grande/MS') ou SEM_CIDADE"""
+    correspondencia = _PADRAO_CIDADE.search(endereco or '')
+    if correspondencia is None:
+        return SEM_CIDADE
+    cidade, uf = correspondencia.group(1).strip(' .'), correspondencia.group(2).upper()
+    if uf not in UFS or not cidade or any(caractere.isdigit() for caractere in cidade):
+        return SEM_CIDADE
+    palavras = [
+        palavra.lower() if palavra.lower() in _CONECTIVOS and indice else palavra.capitalize()
+        for indice, palavra in enumerate(cidade.split())
+    ]
+    return f"{' '.join(palavras)}/{uf}"
+
+
+def _faixa(codigo_distribuidora, valor_fatura):
+    """Rótulo da faixa da fatura na tabela atual da distribuidora"""
+    from distribuidoras import obter_distribuidora, rotulo_faixa
+
+    try:
+        distribuidora = obter_distribuidora(codigo_distribuidora)
+    except ValueError:
+        distribuidora = obter_distribuidora()
+    return rotulo_faixa(distribuidora, float(valor_fatura))
+
+
+def _rotulo_unico(rotulos):
+    """O rótulo comum a todas as unidades, ou VARIAS"""
+    rotulos = set(rotulos)
+    return rotulos.pop() if len(rotulos) == 1 else VARIAS
+
+
+def _completar_rotulos(registro):
+    """Preenche a cidade e a faixa da fatura de um registro que não as tem"""
+    if registro.get('cidade') and registro.get('faixa'):
+        return
+    try:
+        parametros = registro.get('parametros')
+        if isinstance(parametros, str):
+            parametros = json.loads(parametros)
+        if registro.get('tipo') == 'unidades' and parametros and parametros.get('unidades'):
+            unidades = parametros['unidades']
+            cidade = _rotulo_unico(extrair_cidade(unidade.get('endereco')) for unidade in unidades)
+            faixa = _rotulo_unico(_faixa(registro.get('distribuidora'), unidade['valor_fatura'])
+                                  for unidade in unidades)
+        else:
+            cidade = extrair_cidade(registro.get('endereco'))
+            faixa = _faixa(registro.get('distribuidora'), registro['valor_fatura'])
+    except (KeyError, TypeError, ValueError):
+        cidade, faixa = SEM_CIDADE, VARIAS
+    registro['cidade'] = registro.get('cidade') or cidade
+    registro['faixa'] = registro.get('faixa') or faixa
+
+
+_SQL_RESUMO = (
+    f"INSERT INTO resumos ({', '.join(DIMENSOES)}, quantidade, soma_valor_fatura, "
+    + ', '.join(f'soma_{m}, quad_{m}, min_{m}, max_{m}' for m in METRICAS)
+    + f") VALUES ({', '.join('?' for _ in range(len(DIMENSOES) + 2 + 4 * len(METRICAS)))}) "
+    f"ON CONFLICT ({', '.join(DIMENSOES)}) DO UPDATE SET "
+    "quantidade = quantidade + excluded.quantidade, "
+    "soma_valor_fatura = soma_valor_fatura + excluded.soma_valor_fatura, "
+    + ', '.join(f'soma_{m} = soma_{m} + excluded.soma_{m}, quad_{m} = quad_{m} + excluded.quad_{m}, '
+                f'min_{m} = MIN(min_{m}, excluded.min_{m}), max_{m} = MAX(max_{m}, excluded.max_{m})'
+                for m in METRICAS)
+)
+
+_SQL_DISTRIBUICAO = (
+    f"INSERT INTO resumos_distribuicao ({', '.join(DIMENSOES)}, classe, quantidade) "
+    f"VALUES ({', '.join('?' for _ in range(len(DIMENSOES) + 2))}) "
+    f"ON CONFLICT ({', '.join(DIMENSOES)}, classe) DO UPDATE SET quantidade = quantidade + excluded.quantidade"
+)
+
+
+def _acumular_resumos(conexao, registros):
+    """
+    Soma os registros gerados aos resumos (dentro da transação do chamador).
+
+    O lote é agregado em memória antes, para que cada combinação de
+    dia/cidade/faixa/distribuidora custe um único UPSERT. Registros sem os
+    valores calculados ficam fora dos resumos.
+    """
+    resumos = {}
+    distribuicao = {}
+    for registro in registros:
+        if registro.get('status') != STATUS_GERADA or any(registro.get(m) is None for m in METRICAS):
+            continue
+        _completar_rotulos(registro)
+        chave = (registro['criado_em'][:10], registro['cidade'], registro['faixa'],
+                 registro.get('distribuidora') or '')
+        resumo = resumos.get(chave)
+        if resumo is None:
+            resumo = resumos[chave] = [0, 0.0] + [
+                valor for m in METRICAS for valor in (0.0, 0.0, math.inf, -math.inf)
+            ]
+        resumo[0] += 1
+        resumo[1] += registro.get('valor_fatura') or 0.0
+        for indice, metrica in enumerate(METRICAS):
+            valor = float(registro[metrica])
+            posicao = 2 + indice * 4
+            resumo[posicao] += valor
+            resumo[posicao + 1] += valor * valor
+            resumo[posicao + 2] = min(resumo[posicao + 2], valor)
+            resumo[posicao + 3] = max(resumo[posicao + 3], valor)
+        classe = chave + (bisect_left(LIMITES_DISTRIBUICAO, float(registro['economia_ano'])),)
+        distribuicao[classe] = distribuicao.get(classe, 0) + 1
+
+    conexao.executemany(_SQL_RESUMO, [chave + tuple(resumo) for chave, resumo in resumos.items()])
+    conexao.executemany(_SQL_DISTRIBUICAO, [classe + (quantidade,) for classe, quantidade in distribuicao.items()])
+
+
+def _gravar_lotes():
+    """Laço da thread gravadora: agrupa os registros da fila em transações"""
+    try:
+        conexao = conectar()
+        _criar_esquema(conexao)
+    except (OSError, sqlite3.Error) as e:
+        # Os registros continuam na fila; a thread é recriada no próximo registro
+        logger.error(f"Erro ao abrir o histórico {ARQUIVO_HISTORICO}: {str(e)}")
+        return
+    while True:
+        item = _fila.get()
+        lote = [item]
+        # Completa o lote com o que chegar logo em seguida
+        while len(lote) < TAMANHO_LOTE and item is not _FIM:
+            try:
+                item = _fila.get(timeout=ESPERA_LOTE)
+            except queue.Empty:
+                break
+            lote.append(item)
+
+        registros = [registro for registro in lote if registro is not _FIM]
+        try:
+            if registros:
+                for registro in registros:
+                    _completar_rotulos(registro)
+                with conexao:
+                    conexao.executemany(_SQL_INSERCAO, [_linha(registro) for registro in registros])
+                    _acumular_resumos(conexao, registros)
+        except sqlite3.Error as e:
+            logger.error(f"Erro ao gravar {len(registros)} registros no histórico: {str(e)}")
+        finally:
+            for _ in lote:
+                _fila.task_done()
+
+        if lote[-1] is _FIM:
+            conexao.close()
+            return
+
+
+def iniciar_gravador():
+    """Inicia a thread gravadora (chamado automaticamente no primeiro registro)"""
+    global _gravador
+    with _lock:
+        if _gravador is None or not _gravador.is_alive():
+            _gravador = threading.Thread(target=_gravar_lotes, name='gravador-historico', daemon=True)
+            _gravador.start()
+
+
+@rastrear('historico.registro')
+def registrar_proposta(registro):
+    """
+    Coloca um registro na fila de gravação (não bloqueia a requisição).
+
+    Args:
+        registro (dict): Campos de COLUNAS; 'criado_em' é preenchido se ausente
+    """
+    registro.setdefault('criado_em', datetime.now().isoformat(timespec='seconds'))
+    iniciar_gravador()
+    try:
+        _fila.put_nowait(registro)
+    except queue.Full:
+        logger.error(f"Fila do histórico cheia; registro de {registro.get('nome')} descartado")
+
+
+def descarregar():
+    """Aguarda a gravação de todos os registros enfileirados"""
+    if _gravador is not None and _gravador.is_alive():
+        _fila.join()
+
+
+def encerrar():
+    """Grava os registros pendentes e encerra a thread gravadora"""
+    global _gravador
+    with _lock:
+        if _gravador is not None and _gravador.is_alive():
+            _fila.put(_FIM)
+            _gravador.join(timeout=30)
+        _gravador = None
+
+
+@rastrear('historico.crc32')
+def descrever_arquivo(caminho, conteudo=None):
+    """Retorna os campos do arquivo gravado (nome, tamanho, CRC-32, mtime)"""
+    info = os.stat(caminho)
+    if conteudo is not None:
+        crc = zlib.crc32(conteudo)
+    else:
+        crc = 0
+        with open(caminho, 'rb') as f:
+            for bloco in iter(lambda: f.read(1024 * 1024), b''):
+                crc = zlib.crc32(bloco, crc)
+    return {
+        'arquivo': os.path.basename(caminho),
+        'tamanho': info.st_size,
+        'crc32': crc,
+        'mtime_ns': info.st_mtime_ns,
+    }
+
+
+def consultar(sql, parametros=()):
+    """Executa uma consulta de leitura e retorna as linhas como dicts"""
+    if not os.path.exists(ARQUIVO_HISTORICO):
+        return []
+    conexao = conectar()
+    try:
+        return [dict(linha) for linha in conexao.execute(sql, parametros)]
+    finally:
+        conexao.close()
+
+
+def buscar_por_nome(nome, limite=50):
+    """Propostas de um cliente, da mais recente para a mais antiga"""
+    return consultar(
+        "SELECT * FROM propostas WHERE nome = ? ORDER BY criado_em DESC, id DESC LIMIT ?",
+        (nome, limite),
+    )
+
+
+def buscar_duplicata(nome, valor_fatura, distribuidora, versao_tarifas):
+    """Última proposta gerada com as mesmas entradas e tarifas (ou None)"""
+    linhas = consultar(
+        "SELECT * FROM propostas WHERE nome = ? AND valor_fatura = ? AND distribuidora = ? "
+        "AND versao_tarifas = ? AND status = ? ORDER BY id DESC LIMIT 1",
+        (nome, valor_fatura, distribuidora, versao_tarifas, STATUS_GERADA),
+    )
+    return linhas[0] if linhas else None
+
+
+def listar_arquivos(inicio=None, fim=None, distribuidora=None, status=None):
+    """
+    Último registro de cada arquivo gravado, filtrado por data de criação
+    (inicio/fim inclusive), distribuidora e status, em ordem de criação.
+    """
+    condicoes = ["id IN (SELECT MAX(id) FROM propostas WHERE arquivo IS NOT NULL GROUP BY arquivo)"]
+    parametros = []
+    if inicio:
+        condicoes.append("criado_em >= ?")
+        parametros.append(inicio.isoformat())
+    if fim:
+        condicoes.append("criado_em < ?")
+        parametros.append((fim + timedelta(days=1)).isoformat())
+    if distribuidora:
+        condicoes.append("distribuidora = ?")
+        parametros.append(distribuidora)
+    if status:
+        condicoes.append("status = ?")
+        parametros.append(status)
+    return consultar(
+        "SELECT arquivo, tamanho, crc32, mtime_ns, criado_em, distribuidora, status FROM propostas "
+        f"WHERE {' AND '.join(condicoes)} ORDER BY criado_em, arquivo",
+        parametros,
+    )
+
+
+def _estatisticas(quantidade, soma, soma_quadrados, minimo, maximo):
+    """Total, média, mínimo, máximo e desvio padrão de uma métrica"""
+    media = soma / quantidade
+    return {
+        'total': round(soma, 2),
+        'media': round(media, 2),
+        'minimo': round(minimo, 2),
+        'maximo': round(maximo, 2),
+        'desvio_padrao': round(math.sqrt(max(0.0, soma_quadrados / quantidade - media * media)), 2),
+    }
+
+
+def consultar_resumos(agrupar=('dia',), inicio=None, fim=None, distribuidora=None, cidade=None, faixa=None):
+    """
+    Totais e distribuição das economias das propostas geradas.
+
+    Args:
+        agrupar (iterable): Dimensões de DIMENSOES pelas quais agrupar (vazio: só o total)
+        inicio, fim (date): Período (inclusive) pela data de criação
+        distribuidora, cidade, faixa (str): Filtros opcionais
+
+    Returns:
+        dict: 'grupos' (um por combinação das dimensões), 'total' e
+              'distribuicao_economia_ano' (quantidade de propostas por classe)
+    """
+    agrupar = list(dict.fromkeys(agrupar))
+    invalidas = [dimensao for dimensao in agrupar if dimensao not in DIMENSOES]
+    if invalidas:
+        raise ValueError(f"Dimensões inválidas: {', '.join(invalidas)} (use {', '.join(DIMENSOES)})")
+
+    condicoes = []
+    parametros = []
+    for coluna, operador, valor in (('dia', '>=', inicio), ('dia', '<=', fim), ('distribuidora', '=', distribuidora),
+                                    ('cidade', '=', cidade), ('faixa', '=', faixa)):
+        if valor:
+            condicoes.append(f"{coluna} {operador} ?")
+            parametros.append(valor.isoformat() if hasattr(valor, 'isoformat') else valor)
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+    selecao = ', '.join(agrupar + [
+        'SUM(quantidade) AS quantidade', 'SUM(soma_valor_fatura) AS soma_valor_fatura',
+    ] + [f'SUM(soma_{m}) AS soma_{m}, SUM(quad_{m}) AS quad_{m}, MIN(min_{m}) AS min_{m}, MAX(max_{m}) AS max_{m}'
+         for m in METRICAS])
+    agrupamento = f"GROUP BY {', '.join(agrupar)} ORDER BY {', '.join(agrupar)}" if agrupar else ''
+    linhas = consultar(f"SELECT {selecao} FROM resumos {where} {agrupamento}", parametros)
+
+    grupos = []
+    total = {'quantidade': 0, 'valor_fatura_total': 0.0}
+    acumulado = {m: [0.0, 0.0, math.inf, -math.inf] for m in METRICAS}
+    for linha in linhas:
+        if not linha['quantidade']:
+            continue
+        grupo = {dimensao: linha[dimensao] for dimensao in agrupar}
+        grupo['quantidade'] = linha['quantidade']
+        grupo['valor_fatura_total'] = round(linha['soma_valor_fatura'], 2)
+        total['quantidade'] += linha['quantidade']
+        total['valor_fatura_total'] += linha['soma_valor_fatura']
+        for m in METRICAS:
+            valores = (linha[f'soma_{m}'], linha[f'quad_{m}'], linha[f'min_{m}'], linha[f'max_{m}'])
+            grupo[m] = _estatisticas(linha['quantidade'], *valores)
+            soma, quadrados, minimo, maximo = acumulado[m]
+            acumulado[m] = [soma + valores[0], quadrados + valores[1], min(minimo, valores[2]), max(maximo, valores[3])]
+        grupos.append(grupo)
+    total['valor_fatura_total'] = round(total['valor_fatura_total'], 2)
+    if total['quantidade']:
+        for m in METRICAS:
+            total[m] = _estatisticas(total['quantidade'], *acumulado[m])
+
+    contagens = {
+        linha['classe']: linha['quantidade']
+        for linha in consultar(f"SELECT classe, SUM(quantidade) AS quantidade FROM resumos_distribuicao "
+                               f"{where} GROUP BY classe", parametros)
+    }
+    limites = (0,) + LIMITES_DISTRIBUICAO + (None,)
+    distribuicao = [
+        {'de': limites[classe], 'ate': limites[classe + 1], 'quantidade': contagens.get(classe, 0)}
+        for classe in range(len(LIMITES_DISTRIBUICAO) + 1)
+    ]
+    return {'grupos': grupos, 'total': total, 'distribuicao_economia_ano': distribuicao}
@@ -0,0 +1,777 @@
+"""
+Motor de layout declarativo das páginas da proposta
+
+A página é descrita em JSON (ver layouts/) como uma lista de elementos:
+textos estáticos ou dinâmicos, linhas, retângulos, gradientes, tabelas de
+parágrafos e imagens (arquivos fixos ou slots preenchidos a cada proposta).
+
+O layout é compilado uma única vez em uma lista de operações de desenho do
+canvas do ReportLab. Durante a compilação as fontes são registradas, as
+imagens fixas são decodificadas e comprimidas, as medidas relativas são
+resolvidas e as trocas de fonte/cor redundantes são removidas. Renderizar uma
+proposta é apenas reproduzir essa lista.
+
+As imagens são preparadas conforme o perfil de saída (PERFIS_SAIDA): reduzidas
+para a resolução do perfil no tamanho em que são desenhadas e comprimidas com
+Flate ou JPEG. Os fluxos dos PDFs de criar_canvas() são gravados em
+binário, sem a codificação ASCII85 que o ReportLab usa por padrão (cerca de
+25% maior). O perfil 'archive' gera PDF/A-2b (ver pdfa.py), com as fontes
+padrão trocadas pelas TTF de 'fontes_pdfa'.
+
+Os fluxos binários, o desenho de imagens já comprimidas e o PDF/A usam
+internos do ReportLab, conferidos na versão fixada em requirements.txt
+(REPORTLAB_VERSOES_SUPORTADAS). Em outra versão o motor usa só a API
+pública: ASCII85 padrão, drawImage() a cada imagem e sem o perfil 'archive'.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import zlib
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+from memoria_compartilhada import CacheCompartilhado
+from rastreamento import rastrear
+
+logger = logging.getLogger(__name__)
+
+METODOS_ALINHAMENTO = {
+    'esquerda': 'drawString',
+    'direita': 'drawRightString',
+    'centro': 'drawCentredString',
+}
+
+# Tipos de operação da lista compilada
+CHAMAR = 'chamar'                      # (CHAMAR, metodo, args)
+TEXTO = 'texto'                        # (TEXTO, metodo, x, y, texto)
+TEXTO_DINAMICO = 'texto_dinamico'      # (TEXTO_DINAMICO, metodo, x, y, modelo)
+ESTILO_CONDICIONAL = 'estilo_condicional'  # (ESTILO_CONDICIONAL, campo, estilo_se_verdadeiro, estilo_padrao)
+IMAGEM = 'imagem'                      # (IMAGEM, imagem_fixa, x, y, largura, altura)
+IMAGEM_SLOT = 'imagem_slot'            # (IMAGEM_SLOT, slot, x, y, largura, altura)
+TABELA = 'tabela'                      # (TABELA, linhas, x, y_topo, largura, estilo_tabela)
+
+# Perfis de saída do PDF: resolução das imagens na página (None mantém a
+# resolução original), compressão da imagem de fundo, nível do zlib e PDF/A
+PERFIS_SAIDA = {
+    'screen': {'dpi': 150, 'fundo': 'jpeg', 'qualidade_jpeg': 80, 'nivel_zlib': 9, 'pdfa': False},
+    'print': {'dpi': 300, 'fundo': 'flate', 'qualidade_jpeg': None, 'nivel_zlib': 6, 'pdfa': False},
+    'archive': {'dpi': None, 'fundo': 'flate', 'qualidade_jpeg': None, 'nivel_zlib': 6, 'pdfa': True},
+}
+PERFIL_PADRAO = os.getenv('PROPOSTA_PERFIL_SAIDA', 'print')
+
+# Fontes padrão do PDF, que não são incorporadas
+FONTES_PADRAO_PDF = {
+    'Courier', 'Courier-Bold', 'Courier-Oblique', 'Courier-BoldOblique',
+    'Helvetica', 'Helvetica-Bold', 'Helvetica-Oblique', 'Helvetica-BoldOblique',
+    'Times-Roman', 'Times-Bold', 'Times-Italic', 'Times-BoldItalic', 'Symbol', 'ZapfDingbats',
+}
+_PADRAO_FONTE = re.compile(rb"/BaseFont\s*/([A-Z]{6}\+)?([^\s/\[\]<>()]+)")
+
+# Versões (maior.menor) do ReportLab em que os internos usados aqui foram conferidos
+REPORTLAB_VERSOES_SUPORTADAS = ('4.4',)
+
+_reportlab_suportado = None
+_documento_binario = None
+
+# Layouts compilados por (nome, versão) e arquivos já lidos por caminho
+_compilados = {}
+_arquivos = {}
+_lock = threading.Lock()
+# Protótipos das imagens fixas compartilhados entre os workers (sem cópia local)
+_prototipos_compartilhados = CacheCompartilhado('imagens_layout', 16, max_local=0)
+
+
+def hex_para_rgb(cor):
+    """Converte '#rrggbb' em uma tupla (r, g, b) com componentes entre 0 e 1"""
+    cor = cor.lstrip('#')
+    return tuple(int(cor[i:i + 2], 16) / 255 for i in (0, 2, 4))
+
+
+@rastrear('layout.registrar_fontes')
+def registrar_fontes(fontes, diretorio_fontes):
+    """Registra no ReportLab as fontes TTF ainda não registradas"""
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    registradas = set(pdfmetrics.getRegisteredFontNames())
+    for nome_fonte, arquivo_fonte in fontes.items():
+        if nome_fonte in registradas:
+            continue
+        caminho_fonte = os.path.join(diretorio_fontes, arquivo_fonte)
+        if os.path.exists(caminho_fonte):
+            pdfmetrics.registerFont(TTFont(nome_fonte, caminho_fonte))
+        else:
+            logger.warning(f"Fonte {arquivo_fonte} não encontrada em {diretorio_fontes}")
+
+
+def obter_perfil(perfil=None):
+    """Retorna (nome, configuração) do perfil de saída (None usa o padrão)"""
+    nome = perfil or PERFIL_PADRAO
+    if nome not in PERFIS_SAIDA:
+        raise ValueError(f"Perfil de saída desconhecido: {nome} (use {', '.join(PERFIS_SAIDA)})")
+    return nome, PERFIS_SAIDA[nome]
+
+
+def _reduzir_imagem(imagem, largura, altura, dpi):
+    """
+    Reduz a imagem para `dpi` no tamanho em que será desenhada (largura x
+    altura em pontos, proporção preservada). Nunca amplia.
+    """
+    if dpi is None or largura is None or altura is None:
+        return imagem
+    escala = min(largura / imagem.width, altura / imagem.height) * dpi / 72
+    if escala >= 1:
+        return imagem
+    from PIL import Image
+    tamanho = (max(1, round(imagem.width * escala)), max(1, round(imagem.height * escala)))
+    return imagem.resize(tamanho, Image.LANCZOS)
+
+
+def _nome_imagem(dados):
+    """Nome do XObject pelo conteúdo (o mesmo resumo MD5 que o ReportLab usa)"""
+    return hashlib.md5(dados, usedforsecurity=False).hexdigest()
+
+
+def _imagem_do_prototipo(prototipo):
+    """Imagem PIL de um protótipo de _objeto_imagem(), com o alfa da máscara"""
+    from PIL import Image
+
+    if prototipo._filters == ('DCTDecode',):
+        imagem = Image.open(BytesIO(prototipo.streamContent))
+    else:
+        modo = 'L' if prototipo.colorSpace == 'DeviceGray' else 'RGB'
+        imagem = Image.frombytes(modo, (prototipo.width, prototipo.height), zlib.decompress(prototipo.streamContent))
+    mascara = getattr(prototipo, '_smask', None)
+    if mascara is not None:
+        imagem = imagem.convert('RGBA')
+        imagem.putalpha(Image.frombytes('L', (mascara.width, mascara.height), zlib.decompress(mascara.streamContent)))
+    return imagem
+
+
+def _objeto_imagem(imagem, formato='flate', qualidade_jpeg=None, nivel_zlib=6):
+    """
+    Monta o XObject de uma imagem PIL com fluxo binário (Flate ou JPEG).
+
+    O canal alfa vira uma máscara suave (SMask) em tons de cinza com Flate,
+    como drawImage(mask='auto') faria.
+    """
+    from reportlab.pdfbase.pdfdoc import PDFImageXObject
+
+    alfa = None
+    if imagem.mode in ('RGBA', 'LA', 'P'):
+        imagem = imagem.convert('RGBA')
+        alfa = imagem.getchannel('A')
+        if alfa.getextrema() == (255, 255):
+            alfa = None
+    if imagem.mode not in ('RGB', 'L'):
+        imagem = imagem.convert('RGB')
+
+    if formato == 'jpeg':
+        buffer = BytesIO()
+        imagem.save(buffer, format='JPEG', quality=qualidade_jpeg, optimize=True)
+        conteudo, filtros = buffer.getvalue(), ('DCTDecode',)
+    else:
+        conteudo, filtros = zlib.compress(imagem.tobytes(), nivel_zlib), ('FlateDecode',)
+
+    objeto = PDFImageXObject(_nome_imagem(conteudo + (alfa.tobytes() if alfa else b'')))
+    objeto.width, objeto.height = imagem.size
+    objeto.bitsPerComponent = 8
+    objeto.colorSpace = 'DeviceGray' if imagem.mode == 'L' else 'DeviceRGB'
+    objeto.streamContent = conteudo
+    objeto._filters = filtros
+    objeto.mask = None
+    if alfa is not None:
+        dados_alfa = zlib.compress(alfa.tobytes(), nivel_zlib)
+        mascara = PDFImageXObject(_nome_imagem(dados_alfa))
+        mascara.width, mascara.height = alfa.size
+        mascara.bitsPerComponent = 8
+        mascara.colorSpace = 'DeviceGray'
+        mascara.streamContent = dados_alfa
+        mascara._filters = ('FlateDecode',)
+        mascara.mask = None
+        mascara._decode = [0, 1]
+        objeto._smask = mascara
+    return objeto
+
+
+def preparar_imagem(origem, largura=None, altura=None, perfil=None, formato=None):
+    """
+    Decodifica, reduz e comprime uma imagem uma única vez.
+
+    Args:
+        origem: Caminho, PNG em bytes ou buffer
+        largura, altura (float): Tamanho (pontos) em que a imagem é desenhada
+        perfil (str): Perfil de saída (PERFIS_SAIDA)
+        formato (str): 'flate' ou 'jpeg' (padrão: Flate; o perfil decide o fundo)
+
+    Returns:
+        PDFImageXObject: Protótipo para desenhar_imagem_preparada(); é
+        serializável com pickle e pode ser gerado em outro processo
+    """
+    from PIL import Image
+
+    _, configuracao = obter_perfil(perfil)
+    if isinstance(origem, str):
+        imagem = abrir_imagem_fixa(origem)
+    else:
+        imagem = Image.open(BytesIO(origem) if isinstance(origem, bytes) else origem)
+        imagem.load()
+    imagem = _reduzir_imagem(imagem, largura, altura, configuracao['dpi'])
+    return _objeto_imagem(imagem, formato or 'flate', configuracao['qualidade_jpeg'], configuracao['nivel_zlib'])
+
+
+def preparar_imagem_dados(origem, largura=None, altura=None, perfil=None):
+    """Prepara uma imagem em memória (PNG em bytes ou buffer) para um slot"""
+    return preparar_imagem(origem, largura, altura, perfil)
+
+
+def abrir_imagem_fixa(caminho):
+    """
+    Imagem fixa do layout decodificada (somente leitura): da memória
+    compartilhada entre os workers, se ativa, ou do arquivo
+    """
+    from PIL import Image
+    from memoria_compartilhada import imagem_compartilhada
+
+    imagem = imagem_compartilhada(caminho)
+    if imagem is None:
+        imagem = Image.open(caminho)
+        imagem.load()
+    return imagem
+
+
+def _imagem_fixa(imagem, perfil):
+    """
+    Protótipo de uma imagem fixa do layout no perfil, preparado na primeira
+    vez; com a memória compartilhada ativa, preparado uma vez por host
+    """
+    import pickle
+
+    nome_perfil, configuracao = obter_perfil(perfil)
+    prototipo = imagem['perfis'].get(nome_perfil)
+    if prototipo is None:
+        info = os.stat(imagem['caminho'])
+        chave = (imagem['caminho'], info.st_size, info.st_mtime_ns, imagem['largura'], imagem['altura'],
+                 nome_perfil, configuracao['dpi'], configuracao['fundo'], configuracao['qualidade_jpeg'],
+                 configuracao['nivel_zlib'])
+        dados = _prototipos_compartilhados.obter('', chave)
+        if dados is not None:
+            prototipo = pickle.loads(dados)
+        else:
+            prototipo = preparar_imagem(imagem['caminho'], imagem['largura'], imagem['altura'],
+                                        nome_perfil, configuracao['fundo'])
+            _prototipos_compartilhados.guardar('', chave, pickle.dumps(prototipo, pickle.HIGHEST_PROTOCOL))
+        with _lock:
+            prototipo = imagem['perfis'].setdefault(nome_perfil, prototipo)
+    return prototipo
+
+
+def tamanho_slot(compilado, slot):
+    """Retorna (largura, altura) em pontos do slot de imagem, ou None"""
+    for operacao in compilado['operacoes']:
+        if operacao[0] == IMAGEM_SLOT and operacao[1] == slot:
+            return operacao[4], operacao[5]
+    return None
+
+
+def reportlab_suportado():
+    """True se a versão instalada do ReportLab está em REPORTLAB_VERSOES_SUPORTADAS"""
+    global _reportlab_suportado
+    if _reportlab_suportado is None:
+        import reportlab
+        versao = '.'.join(reportlab.Version.split('.')[:2])
+        _reportlab_suportado = versao in REPORTLAB_VERSOES_SUPORTADAS
+        if not _reportlab_suportado:
+            logger.warning(f"ReportLab {reportlab.Version} não conferido (suportadas: "
+                           f"{', '.join(REPORTLAB_VERSOES_SUPORTADAS)}); usando só a API pública")
+    return _reportlab_suportado
+
+
+def _classe_documento_binario():
+    """
+    Subclasse do PDFDocument usada pelos canvas de criar_canvas(): os fluxos
+    registrados no documento são gravados em binário (sem ASCII85) e com fim
+    de linha antes de 'endstream'.
+
+    Sem o ASCII85 os fluxos binários terminam colados em 'endstream'; o PDF/A
+    exige um fim de linha ali (não contado em /Length), e os leitores o
+    aceitam em qualquer PDF. Só os documentos criados aqui mudam: os demais
+    usos do ReportLab no processo seguem o padrão da biblioteca.
+    """
+    global _documento_binario
+    if _documento_binario is None:
+        from reportlab.pdfbase.pdfdoc import PDFBase85Encode, PDFDocument, PDFImageXObject, PDFStream
+
+        def com_fim_de_linha(saida):
+            if not saida.endswith(b'\nendstream\n'):
+                saida = saida[:-len(b'endstream\n')] + b'\nendstream\n'
+            return saida
+
+        class FluxoBinario(PDFStream):
+            def format(self, document):
+                if self.filters:
+                    self.filters = [filtro for filtro in self.filters if filtro is not PDFBase85Encode]
+                return com_fim_de_linha(super().format(document))
+
+        class ImagemBinaria(PDFImageXObject):
+            def format(self, document):
+                return com_fim_de_linha(super().format(document))
+
+        classes = {PDFStream: FluxoBinario, PDFImageXObject: ImagemBinaria}
+
+        class DocumentoBinario(PDFDocument):
+            def Reference(self, obj, name=None):
+                # Todo fluxo passa por aqui antes de ser gravado (objeto indireto)
+                classe = classes.get(type(obj))
+                if classe is not None:
+                    obj.__class__ = classe
+                return super().Reference(obj, name)
+
+        _documento_binario = DocumentoBinario
+    return _documento_binario
+
+
+def criar_canvas(destino, compilado, perfil=None, titulo=None):
+    """
+    Cria o canvas da página do layout, com fluxos binários comprimidos.
+
+    No perfil PDF/A o canvas recebe OutputIntent, metadados XMP e título, e
+    a fonte inicial passa a ser a substituta incorporada da Helvetica.
+    """
+    from reportlab.pdfgen import canvas
+
+    nome_perfil, configuracao = obter_perfil(perfil)
+    suportado = reportlab_suportado()
+    if configuracao['pdfa'] and not suportado:
+        raise ValueError(f"O perfil de saída {nome_perfil} requer o ReportLab "
+                         f"{' ou '.join(REPORTLAB_VERSOES_SUPORTADAS)}")
+
+    opcoes = {}
+    if configuracao['pdfa']:
+        opcoes['initialFontName'] = variante_pdfa(compilado)['fontes_pdfa'].get('Helvetica')
+    p = canvas.Canvas(destino, pagesize=compilado['tamanho_pagina'], pageCompression=1, **opcoes)
+    if suportado:
+        with _lock:
+            p._doc.__class__ = _classe_documento_binario()
+    if configuracao['pdfa']:
+        from pdfa import aplicar_pdfa
+        aplicar_pdfa(p, titulo or compilado['nome'])
+    return p
+
+
+def variante_pdfa(compilado):
+    """
+    Operações do layout com as fontes padrão trocadas pelas TTF de
+    'fontes_pdfa' (todas as fontes de um PDF/A são incorporadas).
+
+    Montada uma vez por layout compilado e guardada nele.
+    """
+    variante = compilado.get('variante_pdfa')
+    if variante is not None:
+        return variante
+
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.platypus import TableStyle
+
+    substitutas = compilado['fontes_pdfa']
+
+    def trocar(fonte):
+        if fonte in FONTES_PADRAO_PDF:
+            if fonte not in substitutas:
+                raise ValueError(f"Layout {compilado['nome']}: fonte {fonte} sem substituta em 'fontes_pdfa'")
+            return substitutas[fonte]
+        return fonte
+
+    operacoes = []
+    for operacao in compilado['operacoes']:
+        tipo = operacao[0]
+        if tipo == CHAMAR and operacao[1] == 'setFont':
+            fonte, *demais = operacao[2]
+            operacao = (CHAMAR, 'setFont', (trocar(fonte), *demais))
+        elif tipo == ESTILO_CONDICIONAL:
+            _, campo, verdadeiro, padrao = operacao
+            operacao = (ESTILO_CONDICIONAL, campo, (trocar(verdadeiro[0]), *verdadeiro[1:]),
+                        (trocar(padrao[0]), *padrao[1:]))
+        elif tipo == TABELA:
+            _, linhas, x, y_topo, largura, estilo_tabela = operacao
+            linhas = [(ParagraphStyle(estilo.name, parent=estilo, fontName=trocar(estilo.fontName)), modelo)
+                      for estilo, modelo in linhas]
+            # A célula da tabela seleciona a fonte padrão dela (Helvetica)
+            # mesmo quando só contém parágrafos
+            estilo_tabela = TableStyle(estilo_tabela.getCommands() + [('FONT', (0, 0), (-1, -1), trocar('Helvetica'))])
+            operacao = (TABELA, linhas, x, y_topo, largura, estilo_tabela)
+        operacoes.append(operacao)
+
+    variante = dict(compilado, operacoes=operacoes)
+    variante['variante_pdfa'] = variante
+    with _lock:
+        return compilado.setdefault('variante_pdfa', variante)
+
+
+def verificar_fontes(pdf):
+    """
+    Classifica as fontes de um PDF pelo nome (BaseFont).
+
+    Returns:
+        dict: 'subconjuntos' (incorporadas só com os glifos usados, prefixo
+              'ABCDEF+'), 'padrao' (as 14 fontes padrão, não incorporadas) e
+              'completas' (as demais, incorporadas inteiras ou ausentes)
+    """
+    resultado = {'subconjuntos': set(), 'padrao': set(), 'completas': set()}
+    for prefixo, nome in _PADRAO_FONTE.findall(pdf):
+        nome = nome.decode('latin-1')
+        if prefixo:
+            resultado['subconjuntos'].add(nome)
+        elif nome in FONTES_PADRAO_PDF:
+            resultado['padrao'].add(nome)
+        else:
+            resultado['completas'].add(nome)
+    return {chave: sorted(nomes) for chave, nomes in resultado.items()}
+
+
+def desenhar_imagem_preparada(p, prototipo, x, y, largura, altura):
+    """
+    Desenha uma imagem preparada, equivalente a drawImage(mask='auto',
+    preserveAspectRatio=True).
+
+    O documento recebe cópias rasas do protótipo (e de sua máscara alfa), que
+    compartilham os dados já comprimidos; o protótipo nunca é registrado para
+    poder ser usado por vários documentos, inclusive em threads diferentes.
+    Fora das versões suportadas do ReportLab a imagem é descomprimida e
+    desenhada com drawImage().
+    """
+    if not reportlab_suportado():
+        from reportlab.lib.utils import ImageReader
+        p.drawImage(ImageReader(_imagem_do_prototipo(prototipo)), x, y, largura, altura,
+                    mask='auto', preserveAspectRatio=True)
+        return
+
+    from reportlab.lib.boxstuff import aspectRatioFix
+    from reportlab.pdfbase.pdfdoc import PDFObjectReference
+
+    doc = p._doc
+    nome_registro = doc.getXObjectName(prototipo.name)
+    if nome_registro not in doc.idToObject:
+        objeto = copy.copy(prototipo)
+        p._setXObjects(objeto)
+        doc.Reference(objeto, nome_registro)
+        doc.addForm(prototipo.name, objeto)
+        mascara = getattr(prototipo, '_smask', None)
+        if mascara is not None:
+            del objeto._smask
+            nome_mascara = doc.getXObjectName(mascara.name)
+            if nome_mascara not in doc.idToObject:
+                copia_mascara = copy.copy(mascara)
+                p._setXObjects(copia_mascara)
+                objeto.smask = doc.Reference(copia_mascara, nome_mascara)
+            else:
+                objeto.smask = PDFObjectReference(nome_mascara)
+
+    x, y, largura, altura, _ = aspectRatioFix(True, 'c', x, y, largura, altura,
+                                              prototipo.width, prototipo.height, False)
+    p._currentPageHasImages = 1
+    p.saveState()
+    p.translate(x, y)
+    p.scale(largura, altura)
+    p._code.append(f"/{nome_registro} Do")
+    p.restoreState()
+    p._formsinuse.append(prototipo.name)
+
+
+def carregar_layout(caminho):
+    """Lê a definição JSON de um layout"""
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _medida(valor, referencia):
+    """Resolve uma medida absoluta (pontos) ou relativa à página ('55%')"""
+    if isinstance(valor, str) and valor.endswith('%'):
+        return referencia * float(valor[:-1]) / 100
+    return float(valor)
+
+
+def _coordenada_y(elemento, altura_pagina, chave='y'):
+    """Resolve 'y' (a partir da base) ou 'y_topo' (distância do topo da página)"""
+    if f'{chave}_topo' in elemento:
+        return altura_pagina - float(elemento[f'{chave}_topo'])
+    return float(elemento.get(chave, 0))
+
+
+class _Compilador:
+    """Acumula as operações e o estado gráfico conhecido durante a compilação"""
+
+    def __init__(self, estilos_texto):
+        self.operacoes = []
+        self.estilos_texto = estilos_texto
+        # Estado atual do canvas; None significa desconhecido
+        self.fonte = None
+        self.cor_preenchimento = None
+        self.cor_linha = None
+        self.espessura = None
+
+    def chamar(self, metodo, *args):
+        self.operacoes.append((CHAMAR, metodo, args))
+
+    def definir_fonte(self, fonte, tamanho):
+        if self.fonte != (fonte, tamanho):
+            self.chamar('setFont', fonte, tamanho)
+            self.fonte = (fonte, tamanho)
+
+    def definir_cor_preenchimento(self, rgb):
+        if self.cor_preenchimento != rgb:
+            self.chamar('setFillColorRGB', *rgb)
+            self.cor_preenchimento = rgb
+
+    def definir_linha(self, rgb, espessura):
+        if self.cor_linha != rgb:
+            self.chamar('setStrokeColorRGB', *rgb)
+            self.cor_linha = rgb
+        if self.espessura != espessura:
+            self.chamar('setLineWidth', espessura)
+            self.espessura = espessura
+
+    def aplicar_estilo(self, elemento):
+        estilo_se = elemento.get('estilo_se')
+        if estilo_se:
+            # O estilo depende do contexto: a escolha acontece na renderização
+            # e o estado fica conhecido apenas como "um dos dois estilos"
+            (campo, alternativo), = estilo_se.items()
+            chave = (campo, alternativo, elemento['estilo'])
+            if self.fonte != chave:
+                self.operacoes.append((
+                    ESTILO_CONDICIONAL, campo,
+                    self.estilos_texto[alternativo], self.estilos_texto[elemento['estilo']]
+                ))
+                self.fonte = chave
+                self.cor_preenchimento = chave
+            return
+        fonte, tamanho, rgb = self.estilos_texto[elemento['estilo']]
+        self.definir_fonte(fonte, tamanho)
+        self.definir_cor_preenchimento(rgb)
+
+
+def compilar_layout(definicao, diretorio_imagens, diretorio_fontes):
+    """
+    Compila a definição de um layout em uma lista de operações de desenho.
+
+    Args:
+        definicao (dict): Layout carregado de JSON
+        diretorio_imagens (str): Diretório das imagens fixas ('arquivo')
+        diretorio_fontes (str): Diretório das fontes TTF declaradas em 'fontes'
+
+    Returns:
+        dict: Nome, versão, tamanho da página e operações compiladas
+    """
+    from reportlab.lib import colors, pagesizes
+    from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.platypus import TableStyle
+
+    registrar_fontes(definicao.get('fontes', {}), diretorio_fontes)
+    fontes_pdfa = definicao.get('fontes_pdfa', {})
+
+    largura, altura = getattr(pagesizes, definicao.get('pagina', 'A4'))
+    alinhamentos_paragrafo = {'centro': TA_CENTER, 'esquerda': TA_LEFT, 'direita': TA_RIGHT}
+
+    estilos_texto = {
+        nome: (estilo['fonte'], estilo['tamanho'], hex_para_rgb(estilo['cor']))
+        for nome, estilo in definicao.get('estilos_texto', {}).items()
+    }
+    estilos_paragrafo = {
+        nome: ParagraphStyle(
+            nome,
+            fontName=estilo['fonte'],
+            fontSize=estilo['tamanho'],
+            textColor=colors.HexColor(estilo['cor']),
+            leading=estilo['entrelinha'],
+            spaceBefore=0,
+            spaceAfter=0,
+            alignment=alinhamentos_paragrafo[estilo.get('alinhamento', 'esquerda')],
+            wordWrap='LongWords'
+        )
+        for nome, estilo in definicao.get('estilos_paragrafo', {}).items()
+    }
+
+    compilador = _Compilador(estilos_texto)
+
+    for elemento in definicao['elementos']:
+        tipo = elemento['tipo']
+
+        if tipo == 'texto':
+            texto = elemento['texto']
+            if not texto.strip():
+                continue
+            compilador.aplicar_estilo(elemento)
+            metodo = METODOS_ALINHAMENTO[elemento.get('alinhamento', 'esquerda')]
+            x = float(elemento['x'])
+            y = _coordenada_y(elemento, altura)
+            if '{' in texto:
+                compilador.operacoes.append((TEXTO_DINAMICO, metodo, x, y, texto))
+            else:
+                compilador.operacoes.append((TEXTO, metodo, x, y, texto))
+
+        elif tipo == 'linha':
+            compilador.definir_linha(hex_para_rgb(elemento['cor_linha']), elemento['espessura'])
+            compilador.chamar('line',
+                              float(elemento['x1']), _coordenada_y(elemento, altura, 'y1'),
+                              float(elemento['x2']), _coordenada_y(elemento, altura, 'y2'))
+
+        elif tipo == 'retangulo_arredondado':
+            compilador.definir_linha(hex_para_rgb(elemento['cor_linha']), elemento['espessura'])
+            compilador.chamar('roundRect',
+                              float(elemento['x']), _coordenada_y(elemento, altura),
+                              float(elemento['largura']), float(elemento['altura']),
+                              float(elemento['raio']))
+
+        elif tipo == 'gradiente':
+            # Gradiente horizontal aproximado por faixas verticais
+            x = _medida(elemento['x'], largura)
+            y = _coordenada_y(elemento, altura)
+            w = _medida(elemento['largura'], largura)
+            h = _medida(elemento['altura'], altura)
+            rgb1 = hex_para_rgb(elemento['cor_inicio'])
+            rgb2 = hex_para_rgb(elemento['cor_fim'])
+            passos = elemento['passos']
+            for i in range(passos):
+                t = i / passos
+                cor = tuple(c1 * (1 - t) + c2 * t for c1, c2 in zip(rgb1, rgb2))
+                compilador.definir_cor_preenchimento(cor)
+                compilador.chamar('rect', x - 2 + w * (1 - t), y - 2, w / passos + 4, h + 4, 0, 1)
+
+        elif tipo == 'imagem':
+            x = _medida(elemento['x'], largura)
+            y = _coordenada_y(elemento, altura)
+            w = _medida(elemento['largura'], largura)
+            h = _medida(elemento['altura'], altura)
+            if 'slot' in elemento:
+                compilador.operacoes.append((IMAGEM_SLOT, elemento['slot'], x, y, w, h))
+            else:
+                caminho = os.path.join(diretorio_imagens, elemento['arquivo'])
+                if not os.path.exists(caminho):
+                    logger.warning(f"Imagem {elemento['arquivo']} não encontrada em {diretorio_imagens}")
+                    continue
+                # Preparada por perfil na primeira proposta; o perfil padrão já na compilação
+                imagem = {'caminho': caminho, 'largura': w, 'altura': h, 'perfis': {}}
+                _imagem_fixa(imagem, None)
+                compilador.operacoes.append((IMAGEM, imagem, x, y, w, h))
+
+        elif tipo == 'tabela':
+            espacamento = elemento.get('espacamento_lateral', 0)
+            estilo_tabela = TableStyle([
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+                ('LEFTPADDING', (0, 0), (-1, -1), espacamento),
+                ('RIGHTPADDING', (0, 0), (-1, -1), espacamento),
+            ])
+            linhas = [(estilos_paragrafo[linha['estilo']], linha['texto']) for linha in elemento['linhas']]
+            compilador.operacoes.append((
+                TABELA, linhas,
+                _medida(elemento['x'], largura), _coordenada_y(elemento, altura),
+                _medida(elemento['largura'], largura), estilo_tabela
+            ))
+
+        else:
+            raise ValueError(f"Tipo de elemento de layout desconhecido: {tipo}")
+
+    return {
+        'nome': definicao['nome'],
+        'versao': str(definicao['versao']),
+        'tamanho_pagina': (largura, altura),
+        'operacoes': compilador.operacoes,
+        'fontes_pdfa': fontes_pdfa,
+    }
+
+
+def obter_layout(caminho, diretorio_imagens, diretorio_fontes):
+    """
+    Retorna o layout compilado, reaproveitando a compilação por (nome, versão).
+
+    O arquivo só é relido quando sua data de modificação muda; um arquivo
+    alterado com a mesma versão continua usando a compilação em cache.
+    """
+    mtime = os.path.getmtime(caminho)
+    with _lock:
+        lido = _arquivos.get(caminho)
+        if lido and lido[0] == mtime:
+            return _compilados[lido[1]]
+
+    definicao = carregar_layout(caminho)
+    chave = (definicao['nome'], str(definicao['versao']))
+    with _lock:
+        compilado = _compilados.get(chave)
+    if compilado is None:
+        compilado = compilar_layout(definicao, diretorio_imagens, diretorio_fontes)
+        logger.info(f"Layout {chave[0]} v{chave[1]} compilado ({len(compilado['operacoes'])} operações)")
+
+    with _lock:
+        compilado = _compilados.setdefault(chave, compilado)
+        _arquivos[caminho] = (mtime, chave)
+    return compilado
+
+
+def renderizar_layout(p, compilado, contexto, imagens=None, perfil=None):
+    """
+    Reproduz as operações compiladas no canvas.
+
+    Args:
+        p: Canvas do ReportLab
+        compilado (dict): Resultado de compilar_layout()/obter_layout()
+        contexto (dict): Valores dos campos dinâmicos ('{campo}') e condições
+        imagens (dict): Imagens dos slots (caminho, PNG em bytes, buffer ou
+            imagem de preparar_imagem_dados())
+        perfil (str): Perfil de saída das imagens (PERFIS_SAIDA)
+    """
+    from reportlab.pdfbase.pdfdoc import PDFImageXObject
+    from reportlab.platypus import Paragraph, Table
+
+    imagens = imagens or {}
+    largura, altura = compilado['tamanho_pagina']
+    if obter_perfil(perfil)[1]['pdfa']:
+        compilado = variante_pdfa(compilado)
+
+    for operacao in compilado['operacoes']:
+        tipo = operacao[0]
+
+        if tipo == CHAMAR:
+            getattr(p, operacao[1])(*operacao[2])
+
+        elif tipo == TEXTO:
+            _, metodo, x, y, texto = operacao
+            getattr(p, metodo)(x, y, texto)
+
+        elif tipo == TEXTO_DINAMICO:
+            _, metodo, x, y, modelo = operacao
+            getattr(p, metodo)(x, y, modelo.format_map(contexto))
+
+        elif tipo == ESTILO_CONDICIONAL:
+            _, campo, estilo_verdadeiro, estilo_padrao = operacao
+            fonte, tamanho, rgb = estilo_verdadeiro if contexto.get(campo) else estilo_padrao
+            p.setFont(fonte, tamanho)
+            p.setFillColorRGB(*rgb)
+
+        elif tipo == IMAGEM:
+            _, imagem, x, y, w, h = operacao
+            desenhar_imagem_preparada(p, _imagem_fixa(imagem, perfil), x, y, w, h)
+
+        elif tipo == IMAGEM_SLOT:
+            _, slot, x, y, w, h = operacao
+            imagem = imagens.get(slot)
+            if imagem is None:
+                continue
+            if not isinstance(imagem, PDFImageXObject):
+                imagem = preparar_imagem(imagem, w, h, perfil)
+            desenhar_imagem_preparada(p, imagem, x, y, w, h)
+
+        elif tipo == TABELA:
+            _, linhas, x, y_topo, largura_tabela, estilo_tabela = operacao
+            dados = [[Paragraph(escape(modelo.format_map(contexto)), estilo)] for estilo, modelo in linhas]
+            tabela = Table(dados, colWidths=[largura_tabela], rowHeights=None)
+            tabela.setStyle(estilo_tabela)
+            _, h = tabela.wrapOn(p, largura, altura)
+            tabela.drawOn(p, x, y_topo - h)
@@ -0,0 +1,548 @@
+"""
+Memória compartilhada entre os processos do mesmo host (workers do uvicorn,
+nós de renderização e seus processos)
+
+Com N workers cada processo decodificava a imagem de fundo do modelo,
+preparava os seus protótipos e mantinha os seus caches de gráficos: a memória
+crescia com o número de workers e um gráfico gerado por um worker nunca era
+aproveitado por outro. Aqui:
+
+- um armazém LRU em um único segmento de memória compartilhada guarda valores
+  em bytes (PNGs dos gráficos, PDFs e prévias renderizados, protótipos das
+  imagens fixas do layout) para todos os processos. CacheCompartilhado tem a
+  mesma interface do cache.CacheLRU e é criado por
+  cache.criar_cache_por_tarifas(..., compartilhado=True);
+- os pixels decodificados da imagem de fundo ficam em um segmento próprio,
+  gravado uma vez por host; imagem_compartilhada() devolve uma imagem PIL que
+  lê direto desse segmento, sem cópia nem nova decodificação do PNG.
+
+O armazém é dividido em blocos de TAMANHO_BLOCO bytes: cada valor ocupa uma
+cadeia de blocos, os blocos livres formam uma lista e, sem espaço, saem as
+entradas usadas há mais tempo (relógio lógico compartilhado). Índice, cadeias
+e dados ficam no próprio segmento, protegidos por um lock de arquivo (flock)
+entre processos e um threading.Lock entre as threads de cada processo. Uma
+operação interrompida (processo morto com o lock) deixa o armazém marcado
+como sujo, e o próximo processo o reinicia vazio.
+
+As fontes TTF não são compartilhadas: o ReportLab e o PIL copiam o arquivo
+para os seus próprios objetos, então uma cópia em memória compartilhada não
+reduziria a memória de cada processo.
+
+Ativado com MEMORIA_COMPARTILHADA=1 (POSIX; no Docker o /dev/shm precisa de
+espaço, veja shm_size no docker-compose.yml). Sem ela, ou se o segmento não
+puder ser criado, os caches voltam a ser locais de cada processo.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+ATIVO = os.getenv('MEMORIA_COMPARTILHADA', '0') == '1'
+TAMANHO_MB = int(os.getenv('MEMORIA_COMPARTILHADA_MB', '128'))
+# Prefixo dos segmentos: um armazém por instalação (diretório do projeto)
+NOME = os.getenv('MEMORIA_COMPARTILHADA_NOME', 'prop_' + hashlib.blake2b(
+    os.path.dirname(os.path.abspath(__file__)).encode('utf-8'), digest_size=4).hexdigest())
+TAMANHO_BLOCO = 64 * 1024
+MAX_ENTRADAS = 4096
+# Valores maiores que esta fração do armazém não são guardados
+FRACAO_MAXIMA_VALOR = 0.25
+
+DIRETORIO_TRAVAS = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+_MAGICO = b'PROPSHM1'
+# mágico, entradas, blocos, tamanho do bloco, primeiro bloco livre, blocos
+# livres, sujo, relógio, acertos, falhas, despejos
+_CABECALHO = struct.Struct('<8sIIIiIIQQQQ')
+_INICIO_TABELAS = 64
+_VAZIA = bytes(16)
+
+_MAGICO_ATIVO = b'PROPATV1'
+# mágico, pronto, tamanho dos metadados, tamanho dos dados
+_CABECALHO_ATIVO = struct.Struct('<8sIIQ')
+_INICIO_ATIVO = 64
+
+_armazem = None
+_indisponivel = False
+_ativos = {}
+_lock = threading.Lock()
+
+
+_classe_segmento = None
+
+
+def _abrir_segmento(nome, criar=False, tamanho=0):
+    """Abre ou cria um segmento sem o resource_tracker (que o apagaria ao fim do processo)"""
+    global _classe_segmento
+    from multiprocessing import shared_memory
+
+    if _classe_segmento is None:
+        class Segmento(shared_memory.SharedMemory):
+            def __del__(self):
+                try:
+                    self.close()
+                except BufferError:
+                    # Imagens ainda abertas sobre o segmento no fim do processo
+                    pass
+
+        _classe_segmento = Segmento
+    try:
+        return _classe_segmento(nome, create=criar, size=tamanho, track=False)
+    except TypeError:
+        # Python < 3.13: sem track=False, desfaz o registro no resource_tracker
+        from multiprocessing import resource_tracker
+
+        segmento = _classe_segmento(nome, create=criar, size=tamanho)
+        resource_tracker.unregister(segmento._name, 'shared_memory')
+        return segmento
+
+
+def _apagar(segmento):
+    """Fecha e apaga o segmento (os processos que já o abriram continuam com o mapeamento)"""
+    if not hasattr(segmento, '_track'):
+        # Python < 3.13: unlink() desfaz o registro que _abrir_segmento() já desfez
+        from multiprocessing import resource_tracker
+        resource_tracker.register(segmento._name, 'shared_memory')
+    segmento.close()
+    segmento.unlink()
+
+
+class _Trava:
+    """Lock entre processos (flock em um arquivo) e entre as threads do processo"""
+
+    def __init__(self, nome):
+        import fcntl
+
+        self._fcntl = fcntl
+        self._arquivo = open(os.path.join(DIRETORIO_TRAVAS, f'{nome}.lock'), 'a+b')
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            self._fcntl.flock(self._arquivo, self._fcntl.LOCK_EX)
+        except BaseException:
+            self._lock.release()
+            raise
+        return self
+
+    def __exit__(self, *_):
+        self._fcntl.flock(self._arquivo, self._fcntl.LOCK_UN)
+        self._lock.release()
+        return False
+
+
+class ArmazemCompartilhado:
+    """Armazém LRU de bytes em um segmento de memória compartilhada"""
+
+    def __init__(self, nome=NOME, tamanho_mb=TAMANHO_MB, entradas=MAX_ENTRADAS, tamanho_bloco=TAMANHO_BLOCO):
+        self.nome = nome
+        self._trava = _Trava(nome)
+        with self._trava:
+            try:
+                self._segmento = _abrir_segmento(nome)
+                criado = False
+            except FileNotFoundError:
+                tabelas = entradas * (16 + 16 + 8 + 8 + 4)
+                blocos = (tamanho_mb * 1024 * 1024 - _INICIO_TABELAS - tabelas) // (tamanho_bloco + 4)
+                if blocos < 1:
+                    raise ValueError(f"Memória compartilhada de {tamanho_mb} MB insuficiente")
+                tamanho = _INICIO_TABELAS + tabelas + blocos * 4
+                tamanho += -tamanho % 64 + blocos * tamanho_bloco
+                self._segmento = _abrir_segmento(nome, criar=True, tamanho=tamanho)
+                _CABECALHO.pack_into(self._segmento.buf, 0, _MAGICO, entradas, blocos, tamanho_bloco,
+                                     -1, 0, 0, 0, 0, 0, 0)
+                criado = True
+            magico, self.entradas, self.blocos, self.tamanho_bloco = _CABECALHO.unpack_from(self._segmento.buf, 0)[:4]
+            if magico != _MAGICO:
+                self._segmento.close()
+                raise ValueError(f"Segmento {nome} com formato desconhecido (remova-o com --remover)")
+            self._mapear()
+            if criado:
+                self._reiniciar()
+        logger.info(f"Memória compartilhada {nome} {'criada' if criado else 'aberta'}: "
+                    f"{self.blocos * self.tamanho_bloco / 1024 / 1024:.0f} MB em {self.blocos} blocos")
+
+    def _mapear(self):
+        """Visões das colunas do índice, das cadeias e dos dados no segmento"""
+        buf = self._segmento.buf
+        n, b = self.entradas, self.blocos
+        posicao = _INICIO_TABELAS
+
+        def coluna(tamanho, formato=None):
+            nonlocal posicao
+            visao = buf[posicao:posicao + tamanho]
+            posicao += tamanho
+            return visao.cast(formato) if formato else visao
+
+        self._chaves = coluna(n * 16)
+        self._grupos = coluna(n * 16)
+        self._usos = coluna(n * 8, 'Q')
+        self._tamanhos = coluna(n * 8, 'Q')
+        self._primeiros = coluna(n * 4, 'i')
+        self._proximos = coluna(b * 4, 'i')
+        posicao += -posicao % 64
+        self._dados = buf[posicao:posicao + b * self.tamanho_bloco]
+
+    # Campos do cabeçalho: (nome, posição no struct)
+    _CAMPOS = {'livre': 4, 'livres': 5, 'sujo': 6, 'relogio': 7, 'acertos': 8, 'falhas': 9, 'despejos': 10}
+
+    def _ler(self):
+        return dict(zip(self._CAMPOS, _CABECALHO.unpack_from(self._segmento.buf, 0)[4:]))
+
+    def _gravar(self, campos):
+        atual = _CABECALHO.unpack_from(self._segmento.buf, 0)
+        valores = list(atual)
+        for campo, valor in campos.items():
+            valores[self._CAMPOS[campo]] = valor
+        _CABECALHO.pack_into(self._segmento.buf, 0, *valores)
+
+    def _reiniciar(self):
+        """Esvazia o armazém: todas as entradas livres e os blocos em uma única lista"""
+        self._chaves[:] = bytes(len(self._chaves))
+        self._grupos[:] = bytes(len(self._grupos))
+        for indice in range(self.entradas):
+            self._usos[indice] = 0
+            self._tamanhos[indice] = 0
+            self._primeiros[indice] = -1
+        for bloco in range(self.blocos):
+            self._proximos[bloco] = bloco + 1
+        self._proximos[self.blocos - 1] = -1
+        self._gravar({'livre': 0, 'livres': self.blocos, 'sujo': 0})
+
+    def _operacao(self):
+        """Abre uma operação de escrita; um armazém sujo (operação interrompida) é reiniciado"""
+        estado = self._ler()
+        if estado['sujo']:
+            logger.warning(f"Memória compartilhada {self.nome} com operação interrompida; reiniciada vazia")
+            self._reiniciar()
+            estado = self._ler()
+        estado['sujo'] = 1
+        self._gravar({'sujo': 1})
+        return estado
+
+    @staticmethod
+    def _encontrar(coluna, valor):
+        """Índices das entradas cujo valor de 16 bytes na coluna é `valor`"""
+        dados = coluna.tobytes()
+        posicao = dados.find(valor)
+        while posicao >= 0:
+            if posicao % 16 == 0:
+                yield posicao // 16
+                posicao = dados.find(valor, posicao + 16)
+            else:
+                posicao = dados.find(valor, posicao + 1)
+
+    def _remover(self, indice, estado):
+        """Devolve os blocos da entrada para a lista livre e libera a entrada"""
+        bloco = self._primeiros[indice]
+        while bloco >= 0:
+            proximo = self._proximos[bloco]
+            self._proximos[bloco] = estado['livre']
+            estado['livre'] = bloco
+            estado['livres'] += 1
+            bloco = proximo
+        self._chaves[indice * 16:indice * 16 + 16] = _VAZIA
+        self._grupos[indice * 16:indice * 16 + 16] = _VAZIA
+        self._usos[indice] = 0
+        self._tamanhos[indice] = 0
+        self._primeiros[indice] = -1
+
+    def obter(self, chave):
+        """Retorna uma cópia do valor (bytes) ou None"""
+        with self._trava:
+            indice = next(self._encontrar(self._chaves, chave), None)
+            estado = self._ler()
+            if indice is None or estado['sujo']:
+                self._gravar({'falhas': estado['falhas'] + 1})
+                return None
+            partes = []
+            restante = self._tamanhos[indice]
+            bloco = self._primeiros[indice]
+            while restante > 0 and bloco >= 0:
+                inicio = bloco * self.tamanho_bloco
+                quantidade = min(restante, self.tamanho_bloco)
+                partes.append(self._dados[inicio:inicio + quantidade])
+                restante -= quantidade
+                bloco = self._proximos[bloco]
+            valor = b''.join(partes)
+            self._usos[indice] = estado['relogio'] + 1
+            self._gravar({'relogio': estado['relogio'] + 1, 'acertos': estado['acertos'] + 1})
+            return valor
+
+    def guardar(self, chave, grupo, valor):
+        """
+        Grava o valor, despejando as entradas usadas há mais tempo se faltar
+        espaço. Retorna False se o valor for grande demais para o armazém.
+        """
+        necessarios = -(-len(valor) // self.tamanho_bloco)
+        if necessarios > self.blocos * FRACAO_MAXIMA_VALOR:
+            return False
+        with self._trava:
+            estado = self._operacao()
+            existente = next(self._encontrar(self._chaves, chave), None)
+            if existente is not None:
+                self._remover(existente, estado)
+            indice = next(self._encontrar(self._chaves, _VAZIA), None)
+            if indice is None or estado['livres'] < necessarios:
+                # Despejo LRU até haver entrada e blocos livres
+                ocupadas = sorted((self._usos[i], i) for i in range(self.entradas) if self._primeiros[i] >= 0
+                                  or self._chaves[i * 16:i * 16 + 16] != _VAZIA)
+                for _, antiga in ocupadas:
+                    if indice is not None and estado['livres'] >= necessarios:
+                        break
+                    self._remover(antiga, estado)
+                    estado['despejos'] += 1
+                    if indice is None:
+                        indice = antiga
+
+            # Cadeia de blocos: a entrada só é publicada (chave) depois dos dados
+            anterior = -1
+            for parte in range(necessarios):
+                bloco = estado['livre']
+                estado['livre'] = self._proximos[bloco]
+                estado['livres'] -= 1
+                inicio = bloco * self.tamanho_bloco
+                pedaco = valor[parte * self.tamanho_bloco:(parte + 1) * self.tamanho_bloco]
+                self._dados[inicio:inicio + len(pedaco)] = pedaco
+                self._proximos[bloco] = -1
+                if anterior < 0:
+                    self._primeiros[indice] = bloco
+                else:
+                    self._proximos[anterior] = bloco
+                anterior = bloco
+            estado['relogio'] += 1
+            self._usos[indice] = estado['relogio']
+            self._tamanhos[indice] = len(valor)
+            self._grupos[indice * 16:indice * 16 + 16] = grupo
+            self._chaves[indice * 16:indice * 16 + 16] = chave
+            estado['sujo'] = 0
+            self._gravar(estado)
+            return True
+
+    def invalidar_grupo(self, grupo):
+        """Remove as entradas do grupo e retorna quantas eram"""
+        with self._trava:
+            estado = self._operacao()
+            indices = list(self._encontrar(self._grupos, grupo))
+            for indice in indices:
+                self._remover(indice, estado)
+            estado['sujo'] = 0
+            self._gravar(estado)
+        return len(indices)
+
+    def limpar(self):
+        """Remove todas as entradas"""
+        with self._trava:
+            self._reiniciar()
+
+    def metricas(self):
+        """Ocupação e acertos do armazém (somados entre todos os processos)"""
+        with self._trava:
+            estado = self._ler()
+            entradas = sum(1 for _ in range(self.entradas) if self._primeiros[_] >= 0)
+        consultas = estado['acertos'] + estado['falhas']
+        return {
+            'nome': self.nome,
+            'tamanho_mb': self.blocos * self.tamanho_bloco / 1024 / 1024,
+            'entradas': entradas,
+            'blocos_livres': estado['livres'],
+            'blocos': self.blocos,
+            'acertos': estado['acertos'],
+            'falhas': estado['falhas'],
+            'despejos': estado['despejos'],
+            'taxa_acerto': estado['acertos'] / consultas if consultas else 0.0,
+        }
+
+
+def obter_armazem():
+    """Armazém compartilhado do host, aberto na primeira chamada (None se desativado ou indisponível)"""
+    global _armazem, _indisponivel
+    if not ATIVO or _indisponivel:
+        return None
+    if _armazem is None:
+        with _lock:
+            if _armazem is None and not _indisponivel:
+                try:
+                    _armazem = ArmazemCompartilhado()
+                except Exception as e:
+                    _indisponivel = True
+                    logger.warning(f"Memória compartilhada indisponível, usando caches locais: {str(e)}")
+    return _armazem
+
+
+def _hash(*partes):
+    return hashlib.blake2b(repr(partes).encode('utf-8'), digest_size=16).digest()
+
+
+class CacheCompartilhado:
+    """
+    Cache com a interface do cache.CacheLRU guardado no armazém compartilhado
+    (valores em bytes). Sem o armazém, usa um CacheLRU local de `max_local`
+    entradas. No armazém o limite é o tamanho do segmento, não max_entradas.
+    """
+
+    def __init__(self, nome, max_entradas, max_local=None):
+        from cache import CacheLRU
+
+        self.nome = nome
+        self.max_entradas = max_entradas
+        self._local = CacheLRU(nome, max_entradas if max_local is None else max_local)
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, versao, chave):
+        """Retorna o valor em cache ou None"""
+        armazem = obter_armazem()
+        if armazem is None:
+            return self._local.obter(versao, chave)
+        valor = armazem.obter(_hash(self.nome, versao, chave))
+        if valor is None:
+            self.falhas += 1
+        else:
+            self.acertos += 1
+        return valor
+
+    def guardar(self, versao, chave, valor):
+        """Grava o valor (bytes) para todos os processos do host"""
+        if self.max_entradas <= 0:
+            return
+        armazem = obter_armazem()
+        if armazem is None:
+            self._local.guardar(versao, chave, valor)
+            return
+        armazem.guardar(_hash(self.nome, versao, chave), _hash(self.nome, versao), bytes(valor))
+
+    def invalidar_versao(self, versao):
+        """Descarta as entradas de uma versão das tarifas e retorna quantas eram"""
+        armazem = obter_armazem()
+        if armazem is None:
+            return self._local.invalidar_versao(versao)
+        return armazem.invalidar_grupo(_hash(self.nome, versao))
+
+    def limpar(self):
+        """Descarta as entradas locais (o armazém é limpo com limpar() do armazém)"""
+        self._local.limpar()
+
+
+def _segmento_ativo(chave):
+    return f'{NOME}_{hashlib.blake2b(repr(chave).encode("utf-8"), digest_size=8).hexdigest()}'
+
+
+def imagem_compartilhada(caminho):
+    """
+    Imagem decodificada em memória compartilhada, gravada uma vez por host.
+
+    A imagem PIL retornada é somente leitura e, nos modos de 4 bytes por pixel
+    (RGBA, RGBX, CMYK), lê direto do segmento, sem cópia. O segmento é
+    identificado pelo caminho, tamanho e mtime do arquivo.
+
+    Returns:
+        PIL.Image.Image ou None se a memória compartilhada estiver desativada
+    """
+    from PIL import Image
+
+    if not ATIVO or _indisponivel:
+        return None
+    info = os.stat(caminho)
+    nome = _segmento_ativo((os.path.abspath(caminho), info.st_size, info.st_mtime_ns))
+    with _lock:
+        ativo = _ativos.get(nome)
+    if ativo is None:
+        try:
+            ativo = _abrir_imagem(nome, caminho)
+        except Exception as e:
+            logger.warning(f"Imagem {caminho} fora da memória compartilhada: {str(e)}")
+            return None
+        with _lock:
+            ativo = _ativos.setdefault(nome, ativo)
+    segmento, modo, tamanho, inicio, comprimento = ativo
+    return Image.frombuffer(modo, tamanho, segmento.buf[inicio:inicio + comprimento], 'raw', modo, 0, 1)
+
+
+def _abrir_imagem(nome, caminho):
+    """Abre o segmento da imagem; o primeiro processo decodifica o arquivo e o grava"""
+    from PIL import Image
+
+    with _Trava(nome):
+        try:
+            segmento = _abrir_segmento(nome)
+            magico, pronto, tamanho_meta, tamanho_dados = _CABECALHO_ATIVO.unpack_from(segmento.buf, 0)
+            if magico != _MAGICO_ATIVO or not pronto:
+                _apagar(segmento)
+                raise FileNotFoundError(nome)
+        except FileNotFoundError:
+            with Image.open(caminho) as imagem:
+                imagem.load()
+                if imagem.mode not in ('RGBA', 'RGBX', 'CMYK', 'RGB', 'L', 'LA'):
+                    imagem = imagem.convert('RGBA')
+                pixels = imagem.tobytes()
+                meta = json.dumps({'modo': imagem.mode, 'tamanho': imagem.size}).encode('utf-8')
+            tamanho_meta, tamanho_dados = len(meta), len(pixels)
+            segmento = _abrir_segmento(nome, criar=True, tamanho=_INICIO_ATIVO + tamanho_meta + tamanho_dados)
+            inicio = _INICIO_ATIVO + tamanho_meta
+            segmento.buf[_INICIO_ATIVO:inicio] = meta
+            segmento.buf[inicio:inicio + tamanho_dados] = pixels
+            _CABECALHO_ATIVO.pack_into(segmento.buf, 0, _MAGICO_ATIVO, 1, tamanho_meta, tamanho_dados)
+            logger.info(f"Imagem {os.path.basename(caminho)} decodificada na memória compartilhada "
+                        f"({tamanho_dados / 1024 / 1024:.0f} MB)")
+    meta = json.loads(bytes(segmento.buf[_INICIO_ATIVO:_INICIO_ATIVO + tamanho_meta]))
+    return segmento, meta['modo'], tuple(meta['tamanho']), _INICIO_ATIVO + tamanho_meta, tamanho_dados
+
+
+def metricas():
+    """Estado do armazém compartilhado (None se desativado ou indisponível)"""
+    armazem = obter_armazem()
+    return armazem.metricas() if armazem is not None else None
+
+
+def remover():
+    """Apaga os segmentos deste projeto (armazém e imagens); os processos que os usam devem estar parados"""
+    removidos = []
+    nomes = [nome for nome in os.listdir('/dev/shm') if nome.startswith(NOME)] if os.path.isdir('/dev/shm') \
+        else [NOME]
+    for nome in nomes:
+        if nome.endswith('.lock'):
+            try:
+                os.remove(os.path.join(DIRETORIO_TRAVAS, nome))
+            except OSError:
+                pass
+            continue
+        try:
+            segmento = _abrir_segmento(nome)
+        except FileNotFoundError:
+            continue
+        _apagar(segmento)
+        removidos.append(nome)
+    return removidos
+
+
+def main():
+    """Estado e remoção dos segmentos de memória compartilhada"""
+    parser = argparse.ArgumentParser(description="Memória compartilhada entre os processos (MEMORIA_COMPARTILHADA)")
+    parser.add_argument('--remover', action='store_true', help="Apaga os segmentos (com os workers parados)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.remover:
+        removidos = remover()
+        print(f"{len(removidos)} segmento(s) removido(s): {', '.join(removidos) or '-'}")
+        return
+    global ATIVO
+    ATIVO = True
+    estado = metricas()
+    if estado is None:
+        print("Memória compartilhada indisponível")
+        sys.exit(1)
+    print(json.dumps(estado, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+Entrega dos arquivos gerados em media/ (PDFs e prévias)
+
+A rota /media/{arquivo} é montada sempre, mesmo que o diretório ainda não
+exista na importação. Cada arquivo tem um ETag forte calculado do conteúdo
+(SHA-256), guardado em cache por (caminho, mtime, tamanho) para que o arquivo
+só seja lido de novo quando mudar; quem acabou de gravar o arquivo registra o
+ETag com registrar_conteudo() e a primeira requisição já não lê o disco.
+
+As URLs devolvidas pelos webhooks levam a versão do conteúdo (?v=<hash>):
+com a versão atual a resposta é imutável (cache de um ano); sem ela o cliente
+revalida com If-None-Match/If-Modified-Since e recebe 304 sem corpo. O corpo
+é enviado pelo FileResponse do Starlette (intervalos Range/If-Range e envio
+direto do arquivo quando o servidor suporta) ou, com MIDIA_X_ACCEL_REDIRECT,
+pelo nginx (X-Accel-Redirect para uma location interna).
+
+Com chaves em MIDIA_CHAVES_URL as URLs são assinadas (HMAC-SHA256 do nome, da
+versão e da expiração) e a rota recusa URLs sem assinatura válida; a
+verificação é só um HMAC em tempo constante, sem consultar o histórico. A
+primeira chave assina e todas são aceitas, o que permite a rotação: uma chave
+nova entra na frente e a antiga sai depois da validade das URLs. A expiração é
+arredondada para a hora, então as URLs de um arquivo geradas na mesma hora
+são iguais e ocupam uma única entrada no cache do CDN.
+"""
+
+import base64
+import hashlib
+import hmac
+import math
+import mimetypes
+import os
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+from cache import CacheLRU
+from proposta import OUTPUT_DIR
+
+# Prefixo da location interna do nginx que serve media/ (vazio: o próprio app envia)
+X_ACCEL_REDIRECT = os.getenv('MIDIA_X_ACCEL_REDIRECT', '').rstrip('/')
+
+CACHE_IMUTAVEL = 'public, max-age=31536000, immutable'
+CACHE_REVALIDAR = 'public, no-cache'
+# Dígitos do hash usados no ETag e no parâmetro de versão da URL
+TAMANHO_VERSAO = 32
+
+# Validade (segundos) das URLs assinadas e arredondamento da expiração
+VALIDADE_URL = int(os.getenv('MIDIA_VALIDADE_URL', str(7 * 24 * 3600)))
+ARREDONDAMENTO_EXPIRACAO = 3600
+
+mimetypes.add_type('image/webp', '.webp')
+
+# ETags por caminho; a "versão" da entrada é (mtime_ns, tamanho) do arquivo
+_etags = CacheLRU('etags_midia', 4096)
+
+
+def ler_chaves(texto):
+    """Interpreta 'id:segredo,id:segredo' (a primeira chave assina)"""
+    chaves = {}
+    for item in filter(None, (parte.strip() for parte in texto.split(','))):
+        identificador, separador, segredo = item.partition(':')
+        if not separador or not identificador or not segredo:
+            raise ValueError("MIDIA_CHAVES_URL deve ter o formato 'id:segredo,id:segredo'")
+        chaves[identificador] = segredo.encode('utf-8')
+    return chaves
+
+
+# O dicionário publicado nunca é alterado; definir_chaves() troca a referência
+_chaves = ler_chaves(os.getenv('MIDIA_CHAVES_URL', ''))
+_lock_chaves = threading.Lock()
+
+
+def definir_chaves(chaves):
+    """
+    Troca o conjunto de chaves das URLs assinadas (ex.: lido de um cofre de
+    segredos). dict id -> segredo (str ou bytes), na ordem: a primeira assina.
+    """
+    global _chaves
+    novas = {identificador: segredo.encode('utf-8') if isinstance(segredo, str) else segredo
+             for identificador, segredo in chaves.items()}
+    with _lock_chaves:
+        _chaves = novas
+
+
+def assinatura_ativa():
+    """True quando as URLs de media/ exigem assinatura"""
+    return bool(_chaves)
+
+
+def _assinar(segredo, nome, versao, expira):
+    mensagem = f"{nome}\n{versao}\n{expira}".encode('utf-8')
+    digest = hmac.new(segredo, mensagem, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+
+def parametros_assinados(nome, versao, agora=None):
+    """Parâmetros de consulta (exp, kid, sig) da URL assinada com a chave ativa"""
+    chaves = _chaves
+    identificador, segredo = next(iter(chaves.items()))
+    agora = time.time() if agora is None else agora
+    expira = math.ceil((agora + VALIDADE_URL) / ARREDONDAMENTO_EXPIRACAO) * ARREDONDAMENTO_EXPIRACAO
+    return {'exp': expira, 'kid': identificador, 'sig': _assinar(segredo, nome, versao, expira)}
+
+
+def verificar_assinatura(nome, versao, expira, identificador, assinatura, agora=None):
+    """
+    Confere a assinatura de uma URL de media/ em tempo constante.
+
+    Returns:
+        int: Segundos até a expiração
+
+    Raises:
+        ValueError: Assinatura ausente, inválida ou expirada
+    """
+    if expira is None or not identificador or not assinatura:
+        raise ValueError("Link sem assinatura")
+    segredo = _chaves.get(identificador)
+    esperado = _assinar(segredo, nome, versao or '', expira) if segredo else ''
+    # Em bytes: compare_digest recusa str com caracteres fora do ASCII
+    if not hmac.compare_digest(esperado.encode('ascii'), assinatura.encode('utf-8', 'surrogateescape')):
+        raise ValueError("Assinatura inválida")
+    restante = expira - int(time.time() if agora is None else agora)
+    if restante <= 0:
+        raise ValueError("Link expirado")
+    return restante
+
+
+def resolver_arquivo(nome):
+    """
+    Caminho do arquivo de media/ pelo nome, ou None.
+
+    Só aceita arquivos comuns diretamente em media/ (sem subdiretórios,
+    '..' ou arquivos ocultos).
+    """
+    if not nome or nome != os.path.basename(nome) or nome.startswith('.'):
+        return None
+    caminho = os.path.join(OUTPUT_DIR, nome)
+    return caminho if os.path.isfile(caminho) else None
+
+
+def _etag(digest):
+    return f'"{digest[:TAMANHO_VERSAO]}"'
+
+
+def registrar_conteudo(caminho, conteudo):
+    """Registra o ETag de um arquivo recém-gravado a partir do conteúdo em memória"""
+    info = os.stat(caminho)
+    etag = _etag(hashlib.sha256(conteudo).hexdigest())
+    _etags.guardar((info.st_mtime_ns, info.st_size), caminho, etag)
+    return etag
+
+
+def etag_arquivo(caminho, info=None):
+    """ETag forte do conteúdo do arquivo (lido só quando o arquivo muda)"""
+    info = info or os.stat(caminho)
+    versao = (info.st_mtime_ns, info.st_size)
+    etag = _etags.obter(versao, caminho)
+    if etag is None:
+        digest = hashlib.sha256()
+        with open(caminho, 'rb') as f:
+            for bloco in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(bloco)
+        etag = _etag(digest.hexdigest())
+        _etags.guardar(versao, caminho, etag)
+    return etag
+
+
+def versao_url(etag):
+    """Valor do parâmetro ?v= da URL para o ETag"""
+    return etag.strip('"')
+
+
+def url_arquivo(base_url, caminho, etag=None):
+    """URL do arquivo de media/ com a versão do conteúdo (assinada quando há chaves)"""
+    etag = etag or etag_arquivo(caminho)
+    nome = os.path.basename(caminho)
+    versao = versao_url(etag)
+    url = f"{base_url}/media/{nome}?v={versao}"
+    if assinatura_ativa():
+        parametros = parametros_assinados(nome, versao)
+        url += f"&exp={parametros['exp']}&kid={parametros['kid']}&sig={parametros['sig']}"
+    return url
+
+
+def nao_modificado(cabecalhos, etag, mtime):
+    """
+    Avalia If-None-Match (prioritário) e If-Modified-Since.
+
+    Returns:
+        bool: True quando a cópia do cliente ainda vale (HTTP 304)
+    """
+    if_none_match = cabecalhos.get('if-none-match')
+    if if_none_match is not None:
+        etags = [valor.strip().removeprefix('W/') for valor in if_none_match.split(',')]
+        return '*' in etags or etag in etags
+    if_modified_since = cabecalhos.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cabecalhos_arquivo(info, etag, versao=None, validade=None):
+    """
+    Cabeçalhos de cache e validação comuns às respostas 200, 206 e 304.
+
+    `validade` (segundos até a expiração de uma URL assinada) limita o
+    max-age, para que nenhum cache sirva o arquivo depois que o link expira.
+    """
+    if versao != versao_url(etag):
+        cache = CACHE_REVALIDAR
+    elif validade is None:
+        cache = CACHE_IMUTAVEL
+    else:
+        cache = f"public, max-age={min(validade, 31536000)}, immutable"
+    return {
+        'ETag': etag,
+        'Last-Modified': formatdate(info.st_mtime, usegmt=True),
+        'Cache-Control': cache,
+        'Accept-Ranges': 'bytes',
+    }
+
+
+def caminho_x_accel(nome):
+    """
+    Valor do X-Accel-Redirect para o arquivo: o nome vai codificado em
+    porcentagem (UTF-8), que o nginx decodifica antes de procurar no disco
+    """
+    return f"{X_ACCEL_REDIRECT}/{quote(nome)}"
+
+
+def tipo_conteudo(caminho):
+    """Content-Type pelo nome do arquivo"""
+    return mimetypes.guess_type(caminho)[0] or 'application/octet-stream'
@@ -0,0 +1,157 @@
+"""
+Renderização arquivística (PDF/A-2b) das propostas
+
+O perfil de saída 'archive' grava o PDF conforme a ISO 19005-2 nível B:
+intenção de saída (OutputIntent) com o perfil ICC sRGB incorporado, metadados
+XMP equivalentes ao dicionário Info e todas as fontes incorporadas (as fontes
+padrão Helvetica são trocadas pelas TTF declaradas em 'fontes_pdfa' no
+layout). As máscaras suaves das imagens (canal alfa) são permitidas no
+PDF/A-2 quando o documento tem OutputIntent.
+
+As partes estáticas são preparadas uma única vez por processo: o perfil ICC
+já comprimido e o modelo do XMP. Por documento resta apenas montar alguns
+dicionários e preencher o XMP com o título e as datas.
+"""
+
+import threading
+import zlib
+from xml.sax.saxutils import escape
+
+from reportlab.pdfbase.pdfdoc import (
+    PDFArray, PDFCatalog, PDFDictionary, PDFInfo, PDFName, PDFString, PDFStream, PDFDate,
+    format as formatar_pdf,
+)
+
+AUTOR = 'Energia A'
+CRIADOR = 'Gerador de Propostas Energia A'
+ASSUNTO = 'Proposta de Energia Solar por Assinatura'
+CONDICAO_SAIDA = 'sRGB IEC61966-2.1'
+
+MODELO_XMP = """<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about=""
+    xmlns:pdfaid="http://www.aiim.org/pdfa/ns/id/"
+    xmlns:dc="http://purl.org/dc/elements/1.1/"
+    xmlns:xmp="http://ns.adobe.com/xap/1.0/"
+    xmlns:pdf="http://ns.adobe.com/pdf/1.3/">
+   <pdfaid:part>2</pdfaid:part>
+   <pdfaid:conformance>B</pdfaid:conformance>
+   <dc:format>application/pdf</dc:format>
+   <dc:title><rdf:Alt><rdf:li xml:lang="x-default">{titulo}</rdf:li></rdf:Alt></dc:title>
+   <dc:creator><rdf:Seq><rdf:li>{autor}</rdf:li></rdf:Seq></dc:creator>
+   <dc:description><rdf:Alt><rdf:li xml:lang="x-default">{assunto}</rdf:li></rdf:Alt></dc:description>
+   <pdf:Producer>{produtor}</pdf:Producer>
+   <pdf:Keywords>{palavras_chave}</pdf:Keywords>
+   <xmp:CreatorTool>{criador}</xmp:CreatorTool>
+   <xmp:CreateDate>{data}</xmp:CreateDate>
+   <xmp:ModifyDate>{data}</xmp:ModifyDate>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+{preenchimento}
+<?xpacket end="w"?>"""
+
+# Espaço reservado no pacote XMP para edições no local (recomendado pela especificação)
+PREENCHIMENTO_XMP = '\n'.join(' ' * 99 for _ in range(20))
+
+_icc_comprimido = None
+_lock = threading.Lock()
+
+
+def perfil_icc():
+    """Perfil ICC sRGB comprimido com Flate, gerado uma vez por processo"""
+    global _icc_comprimido
+    if _icc_comprimido is None:
+        with _lock:
+            if _icc_comprimido is None:
+                from PIL import ImageCms
+                icc = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+                _icc_comprimido = zlib.compress(icc, 9)
+    return _icc_comprimido
+
+
+def preparar_pdfa():
+    """Prepara as partes estáticas do PDF/A (aquecimento)"""
+    perfil_icc()
+
+
+class _InfoPDFA(PDFInfo):
+    """
+    Dicionário Info sem a chave Trapped, que não tem equivalente no XMP
+    exigido pelo PDF/A; as demais chaves são espelhadas em _MetadadosXMP.
+    """
+
+    def format(self, document):
+        D = {
+            'Title': PDFString(self.title),
+            'Author': PDFString(self.author),
+            'Subject': PDFString(self.subject),
+            'Keywords': PDFString(self.keywords),
+            'Creator': PDFString(self.creator),
+            'Producer': PDFString(self.producer),
+        }
+        D['ModDate'] = D['CreationDate'] = PDFDate(ts=document._timeStamp, dateFormatter=self._dateFormatter)
+        return PDFDictionary(D).format(document)
+
+
+class _MetadadosXMP(PDFStream):
+    """Fluxo de metadados XMP (sem filtros, como o PDF/A exige)"""
+
+    def __init__(self, info):
+        super().__init__()
+        self.info = info
+
+    def format(self, document):
+        ts = document._timeStamp
+        ano, mes, dia, hora, minuto, segundo = ts.YMDhms
+        data = (f"{ano:04d}-{mes:02d}-{dia:02d}T{hora:02d}:{minuto:02d}:{segundo:02d}"
+                f"{ts.dhh:+03d}:{ts.dmm:02d}")
+        conteudo = MODELO_XMP.format(
+            titulo=escape(self.info.title),
+            autor=escape(self.info.author),
+            assunto=escape(self.info.subject),
+            produtor=escape(self.info.producer),
+            palavras_chave=escape(self.info.keywords),
+            criador=escape(self.info.creator),
+            data=data,
+            preenchimento=PREENCHIMENTO_XMP,
+        ).encode('utf-8')
+        dicionario = PDFDictionary({
+            'Type': PDFName('Metadata'),
+            'Subtype': PDFName('XML'),
+            'Length': len(conteudo),
+        })
+        return formatar_pdf(dicionario, document) + b'\nstream\n' + conteudo + b'\nendstream\n'
+
+
+def aplicar_pdfa(p, titulo):
+    """
+    Acrescenta ao canvas o que o PDF/A-2b exige no catálogo e no Info.
+
+    Args:
+        p: Canvas do ReportLab, antes de save()
+        titulo (str): Título do documento (Info e dc:title)
+    """
+    doc = p._doc
+    info = _InfoPDFA()
+    info.title = titulo
+    info.author = AUTOR
+    info.subject = ASSUNTO
+    info.keywords = 'proposta, energia solar'
+    info.creator = CRIADOR
+    doc.info = info
+
+    perfil = PDFStream(PDFDictionary({'N': 3, 'Filter': PDFName('FlateDecode')}), perfil_icc(), filters=[])
+    intencao = PDFDictionary({
+        'Type': PDFName('OutputIntent'),
+        'S': PDFName('GTS_PDFA1'),
+        'OutputConditionIdentifier': PDFString(CONDICAO_SAIDA),
+        'Info': PDFString(CONDICAO_SAIDA),
+        'DestOutputProfile': doc.Reference(perfil),
+    })
+    catalogo = doc.Catalog
+    # O catálogo do ReportLab só grava as chaves listadas em __NoDefault__
+    catalogo.__NoDefault__ = PDFCatalog.__NoDefault__ + ['OutputIntents']
+    catalogo.OutputIntents = PDFArray([intencao])
+    catalogo.Metadata = _MetadadosXMP(info)
@@ -0,0 +1,325 @@
+"""
+Pré-renderização especulativa das propostas a partir das cotações
+
+O funil é cotação primeiro (POST /cotacao, só os números) e o PDF alguns
+segundos depois (POST /webhook_proposta). Com PRE_RENDER=1 a cotação agenda,
+na classe pre_render do escalonador (ou da fila compartilhada), a
+renderização da proposta com os mesmos dados; o PDF e a prévia ficam no
+cache em disco (PRE_RENDER_DIR, compartilhado entre os nós como propostas/).
+Quando o webhook chega com a mesma entrada, processar_proposta_webhook()
+apenas grava o arquivo já pronto em media/ e registra o histórico.
+
+A chave do cache é o hash da entrada normalizada, do perfil, da prévia, das
+opções de simulação e das versões das tarifas e do layout; uma troca de
+tabela ou de modelo invalida as especulações antigas. A renderização
+especulativa não grava em media/ nem no histórico: só a requisição real o faz.
+
+Orçamento (a especulação nunca concorre com requisições reais):
+- no escalonador, a classe pre_render tem uma vaga e só é despachada quando
+  sobra uma vaga livre para as demais classes;
+- a cotação não agenda se houver propostas interativas ou lotes na fila, se
+  já houver PRE_RENDER_MAX_PENDENTES especulações em andamento (com a fila
+  compartilhada, as pendentes no broker) ou se o balde de
+  PRE_RENDER_POR_MINUTO renderizações por minuto estiver vazio;
+- na fila compartilhada a especulação não envelhece e cada nó de
+  renderização a executa com o limite e a reserva de vagas do escalonador;
+- as especulações não usadas expiram em PRE_RENDER_VALIDADE segundos e o
+  cache guarda no máximo PRE_RENDER_MAX_ARQUIVOS propostas.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+
+from proposta import EXPORTADOR_DIR
+from rastreamento import contexto_atual, rastrear, span
+
+logger = logging.getLogger(__name__)
+
+# Especulação desativada por padrão (opt-in)
+ATIVO = os.getenv('PRE_RENDER', '0') == '1'
+DIRETORIO = os.getenv('PRE_RENDER_DIR', os.path.join(EXPORTADOR_DIR, 'propostas', 'pre_render'))
+VALIDADE = float(os.getenv('PRE_RENDER_VALIDADE', '600'))
+MAX_ARQUIVOS = int(os.getenv('PRE_RENDER_MAX_ARQUIVOS', '500'))
+POR_MINUTO = float(os.getenv('PRE_RENDER_POR_MINUTO', '30'))
+MAX_PENDENTES = int(os.getenv('PRE_RENDER_MAX_PENDENTES', '4'))
+
+AGENDADA = 'agendada'
+EM_CACHE = 'em_cache'
+IGNORADA = 'ignorada'
+DESATIVADA = 'desativada'
+
+_lock = threading.Lock()
+_contadores = dict.fromkeys(
+    ('agendadas', 'renderizadas', 'acertos', 'falhas', 'expiradas', 'sem_orcamento', 'ocupado', 'erros'), 0)
+_pendentes = set()
+# Referências fortes às tarefas de agendamento (o event loop só guarda referências fracas)
+_tarefas = set()
+_balde = {'fichas': POR_MINUTO, 'atualizado': time.monotonic()}
+
+
+def _contar(contador, quantidade=1):
+    with _lock:
+        _contadores[contador] += quantidade
+
+
+def chave_especulacao(entrada, perfil, previa, simulacao, distribuidora):
+    """Chave do cache: entrada normalizada, opções de saída e versões de tarifas e layout"""
+    from distribuidoras import obter_layout_distribuidora
+    from layout import obter_perfil
+
+    layout = obter_layout_distribuidora(distribuidora)
+    dados = json.dumps([
+        list(entrada), obter_perfil(perfil)[0], previa, simulacao,
+        distribuidora['codigo'], distribuidora['versao'], layout['nome'], layout['versao'],
+    ], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(dados.encode('utf-8')).hexdigest()
+
+
+def _caminhos(chave):
+    base = os.path.join(DIRETORIO, chave)
+    return base + '.json', base + '.pdf', base + '.previa'
+
+
+def existe(chave):
+    """Há uma especulação válida para a chave"""
+    try:
+        return time.time() - os.path.getmtime(_caminhos(chave)[0]) <= VALIDADE
+    except OSError:
+        return False
+
+
+def _remover(*caminhos):
+    for caminho in caminhos:
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+
+
+def _limpar():
+    """Remove as especulações expiradas e as mais antigas além de MAX_ARQUIVOS"""
+    try:
+        nomes = [nome for nome in os.listdir(DIRETORIO) if nome.endswith('.json')]
+    except OSError:
+        return
+    agora = time.time()
+    validas = []
+    for nome in nomes:
+        chave = nome[:-len('.json')]
+        try:
+            idade = agora - os.path.getmtime(os.path.join(DIRETORIO, nome))
+        except OSError:
+            continue
+        if idade > VALIDADE:
+            _remover(*_caminhos(chave))
+            _contar('expiradas')
+        else:
+            validas.append((idade, chave))
+    for _, chave in sorted(validas)[MAX_ARQUIVOS:]:
+        _remover(*_caminhos(chave))
+        _contar('expiradas')
+
+
+@rastrear('pre_render.renderizacao', raiz=True)
+def pre_renderizar(entrada, perfil=None, previa=None, simulacao=None):
+    """
+    Renderiza a proposta e a guarda no cache de especulação (sem media/ nem
+    histórico). Executado na classe pre_render do escalonador ou da fila.
+    """
+    from distribuidoras import obter_distribuidora
+    from entrada import EntradaProposta
+    from proposta import (
+        calcular_parametros_automaticos, calcular_valores_financeiros, desenhar_proposta_pdf, montar_proposta,
+        renderizar_proposta_previa,
+    )
+
+    entrada = EntradaProposta(**entrada)
+    distribuidora = obter_distribuidora(entrada.distribuidora)
+    chave = chave_especulacao(entrada, perfil, previa, simulacao, distribuidora)
+    try:
+        if existe(chave):
+            return {'sucesso': True, 'chave': chave, 'situacao': EM_CACHE}
+
+        parametros = calcular_parametros_automaticos(
+            nome_completo=entrada.nome,
+            endereco_completo=entrada.endereco,
+            valor_fatura_cliente=entrada.valor_fatura,
+            distribuidora=distribuidora,
+        )
+        resultado_simulacao = None
+        if simulacao is not None:
+            from simulacao import simular_economia
+            resultado_simulacao = simular_economia(calcular_valores_financeiros(parametros, distribuidora),
+                                                   distribuidora, **simulacao)
+        montagem = montar_proposta(parametros, distribuidora, perfil, resultado_simulacao)
+        pdf_bytes = desenhar_proposta_pdf(montagem)
+
+        os.makedirs(DIRETORIO, exist_ok=True)
+        caminho_dados, caminho_pdf, caminho_previa = _caminhos(chave)
+        # Arquivos gravados com nome temporário e renomeados; o JSON por
+        # último marca a especulação como completa
+        sufixo = f".{secrets.token_hex(4)}.tmp"
+        arquivos = [(caminho_pdf, pdf_bytes)]
+        if previa:
+            arquivos.append((caminho_previa, renderizar_proposta_previa(montagem, previa)))
+        dados = {
+            'parametros': parametros,
+            'valores': montagem['valores'],
+            'simulacao': resultado_simulacao,
+            'layout': {'nome': montagem['layout']['nome'], 'versao': montagem['layout']['versao']},
+        }
+        arquivos.append((caminho_dados, json.dumps(dados, ensure_ascii=False, default=str).encode('utf-8')))
+        for caminho, conteudo in arquivos:
+            with open(caminho + sufixo, 'wb') as f:
+                f.write(conteudo)
+            os.replace(caminho + sufixo, caminho)
+        _contar('renderizadas')
+        _limpar()
+        logger.info(f"Proposta pré-renderizada para {entrada.nome} ({chave[:12]})")
+        return {'sucesso': True, 'chave': chave, 'situacao': AGENDADA}
+    except Exception as e:
+        _contar('erros')
+        logger.error(f"Erro na pré-renderização de {entrada.nome}: {str(e)}", exc_info=True)
+        return {'sucesso': False, 'erro': str(e), 'chave': chave}
+
+
+def consumir(entrada, perfil, previa, simulacao, distribuidora):
+    """
+    Retira do cache a proposta especulada para esta requisição.
+
+    Returns:
+        dict: 'pdf', 'previa' (bytes ou None), 'parametros', 'valores',
+        'simulacao' e 'layout'; None se não houver especulação válida
+    """
+    if not ATIVO:
+        return None
+    try:
+        chave = chave_especulacao(entrada, perfil, previa, simulacao, distribuidora)
+    except Exception:
+        return None
+    caminho_dados, caminho_pdf, caminho_previa = _caminhos(chave)
+    # Renomear o JSON reserva a especulação para esta requisição (atômico)
+    reservado = f"{caminho_dados}.{secrets.token_hex(4)}"
+    try:
+        os.rename(caminho_dados, reservado)
+    except OSError:
+        _contar('falhas')
+        return None
+    try:
+        if time.time() - os.path.getmtime(reservado) > VALIDADE:
+            _contar('expiradas')
+            return None
+        with open(reservado, 'rb') as f:
+            dados = json.loads(f.read())
+        with open(caminho_pdf, 'rb') as f:
+            dados['pdf'] = f.read()
+        dados['previa'] = None
+        if previa:
+            with open(caminho_previa, 'rb') as f:
+                dados['previa'] = f.read()
+    except (OSError, ValueError):
+        _contar('falhas')
+        return None
+    finally:
+        _remover(reservado, caminho_pdf, caminho_previa)
+    _contar('acertos')
+    logger.info(f"Proposta servida da pré-renderização ({chave[:12]})")
+    return dados
+
+
+def _consumir_ficha():
+    """Retira uma ficha do balde de PRE_RENDER_POR_MINUTO renderizações por minuto"""
+    with _lock:
+        agora = time.monotonic()
+        _balde['fichas'] = min(POR_MINUTO, _balde['fichas'] + (agora - _balde['atualizado']) * POR_MINUTO / 60)
+        _balde['atualizado'] = agora
+        if _balde['fichas'] < 1:
+            return False
+        _balde['fichas'] -= 1
+        return True
+
+
+async def agendar(argumentos, inquilino, chave):
+    """
+    Agenda a pré-renderização de uma cotação, se o orçamento permitir
+    (chamado no event loop da API).
+
+    Args:
+        argumentos (dict): Argumentos de pre_renderizar() ('entrada' como dict)
+        inquilino (str): Inquilino da cotação (justiça da classe pre_render)
+        chave (str): chave_especulacao() da cotação
+
+    Returns:
+        str: AGENDADA, EM_CACHE, IGNORADA ou DESATIVADA
+    """
+    import asyncio
+    import fila_renderizacao
+    from escalonador import escalonador
+
+    if not ATIVO:
+        return DESATIVADA
+    if existe(chave):
+        return EM_CACHE
+    if chave in _pendentes:
+        return AGENDADA
+    broker = fila_renderizacao.obter_broker()
+    if broker is None:
+        na_fila = {classe: escalonador.na_fila(classe) for classe in ('interativa', 'lote')}
+        especulando = len(_pendentes)
+    else:
+        # Fila compartilhada: requisições reais e especulações pendentes de todos os nós
+        try:
+            na_fila = (await asyncio.to_thread(broker.metricas))['pendentes']
+        except Exception as e:
+            logger.warning(f"Pré-renderização ignorada, fila indisponível: {str(e)}")
+            _contar('erros')
+            return IGNORADA
+        especulando = max(len(_pendentes), na_fila['pre_render'])
+        if chave in _pendentes:
+            return AGENDADA
+    if na_fila['interativa'] or na_fila['lote']:
+        _contar('ocupado')
+        return IGNORADA
+    if especulando >= MAX_PENDENTES or not _consumir_ficha():
+        _contar('sem_orcamento')
+        return IGNORADA
+
+    # Rastro próprio, continuando o da cotação (que termina antes da renderização)
+    contexto = contexto_atual()
+
+    async def executar():
+        try:
+            # Com a fila compartilhada apenas enfileira: o nó de renderização grava o cache
+            with span('pre_render.especulacao', contexto=contexto):
+                await fila_renderizacao.executar('pre_render', argumentos, classe='pre_render',
+                                                 inquilino=inquilino, aguardar=False)
+        except Exception as e:
+            # Sobrecarga, prazo esgotado ou erro: a proposta será renderizada no webhook
+            logger.info(f"Pré-renderização descartada ({chave[:12]}): {str(e)}")
+        finally:
+            _pendentes.discard(chave)
+
+    _pendentes.add(chave)
+    _contar('agendadas')
+    tarefa = asyncio.create_task(executar())
+    _tarefas.add(tarefa)
+    tarefa.add_done_callback(_tarefas.discard)
+    return AGENDADA
+
+
+def metricas():
+    """Contadores da especulação neste processo"""
+    with _lock:
+        contadores = dict(_contadores)
+    consultas = contadores['acertos'] + contadores['falhas']
+    return {
+        'ativo': ATIVO,
+        'pendentes': len(_pendentes),
+        **contadores,
+        'taxa_acerto': contadores['acertos'] / consultas if consultas else 0.0,
+    }
@@ -0,0 +1,312 @@
+"""
+Prévia da proposta em imagem (PNG ou WebP)
+
+As integrações (WhatsApp, CRM) recebem uma miniatura da página em vez do PDF.
+A prévia não passa pelo PDF: as operações do layout compilado são
+reproduzidas com o PIL em uma imagem do tamanho da miniatura.
+
+Tudo o que não depende da proposta (gradiente, imagem de fundo já
+decodificada, linhas e textos fixos) é desenhado uma única vez por layout e
+largura, em resolução dobrada e reduzido, e guardado como base. Por proposta
+resta copiar a base, colar o gráfico (o mesmo PNG usado no PDF) e escrever os
+textos dinâmicos, que são desenhados por cima dos elementos fixos.
+"""
+
+import logging
+import os
+import threading
+from io import BytesIO
+
+from layout import (
+    CHAMAR, ESTILO_CONDICIONAL, FONTES_PADRAO_PDF, IMAGEM, IMAGEM_SLOT, TABELA, TEXTO,
+    TEXTO_DINAMICO, abrir_imagem_fixa,
+)
+
+logger = logging.getLogger(__name__)
+
+FORMATOS_PREVIA = {'png': 'PNG', 'webp': 'WEBP'}
+
+# Largura da prévia em pixels (a altura segue a proporção da página)
+LARGURA_PREVIA = int(os.getenv('PROPOSTA_LARGURA_PREVIA', '600'))
+QUALIDADE_WEBP = 80
+# Esforço do codificador WebP (0 a 6) e nível do zlib no PNG: acima destes
+# o ganho de tamanho é pequeno e o tempo de codificação cresce várias vezes
+METODO_WEBP = 1
+NIVEL_PNG = 1
+# A base é desenhada nesta escala e reduzida, para suavizar linhas e bordas
+SUPERAMOSTRAGEM = 2
+
+# Âncoras do PIL (linha de base) equivalentes aos métodos de texto do canvas
+ANCORAS = {
+    'drawString': 'ls',
+    'drawRightString': 'rs',
+    'drawCentredString': 'ms',
+}
+ALINHAMENTOS_PARAGRAFO = {0: 'esquerda', 1: 'centro', 2: 'direita'}
+
+# Bases por (nome do layout, versão, largura) e fontes por (caminho, tamanho)
+_bases = {}
+_fontes = {}
+_lock = threading.Lock()
+
+
+def caminho_previa(caminho_pdf, formato):
+    """Caminho da prévia gravada ao lado do PDF (mesmo nome, outra extensão)"""
+    return f"{os.path.splitext(caminho_pdf)[0]}.{formato}"
+
+
+def _arquivo_fonte(compilado, nome):
+    """Arquivo TTF de uma fonte do layout (as fontes padrão usam as de 'fontes_pdfa')"""
+    from reportlab.pdfbase import pdfmetrics
+
+    if nome in FONTES_PADRAO_PDF:
+        substituta = compilado['fontes_pdfa'].get(nome)
+        if substituta is None:
+            raise ValueError(f"Layout {compilado['nome']}: fonte {nome} sem substituta em 'fontes_pdfa'")
+        nome = substituta
+    return pdfmetrics.getFont(nome).face.filename
+
+
+def _fonte(caminho, tamanho):
+    """Fonte do PIL no tamanho em pixels, carregada uma vez"""
+    from PIL import ImageFont
+
+    chave = (caminho, round(tamanho, 2))
+    fonte = _fontes.get(chave)
+    if fonte is None:
+        fonte = ImageFont.truetype(caminho, chave[1])
+        with _lock:
+            fonte = _fontes.setdefault(chave, fonte)
+    return fonte
+
+
+def _cor(rgb):
+    """Tupla (r, g, b) entre 0 e 1 em inteiros de 0 a 255"""
+    return tuple(round(componente * 255) for componente in rgb)
+
+
+def _colar_imagem(pagina, imagem, caixa):
+    """Cola a imagem centralizada na caixa (x0, y0, x1, y1), preservando a proporção"""
+    from PIL import Image
+
+    x0, y0, x1, y1 = caixa
+    escala = min((x1 - x0) / imagem.width, (y1 - y0) / imagem.height)
+    tamanho = (max(1, round(imagem.width * escala)), max(1, round(imagem.height * escala)))
+    # reducing_gap reduz por um fator inteiro antes do LANCZOS (o gráfico
+    # chega na resolução do PDF, várias vezes maior que a prévia)
+    if imagem.mode != 'RGBA':
+        imagem = imagem.convert('RGBA')
+    imagem = imagem.resize(tamanho, Image.LANCZOS, reducing_gap=2.0)
+    deslocamento = (round(x0 + (x1 - x0 - tamanho[0]) / 2), round(y0 + (y1 - y0 - tamanho[1]) / 2))
+    pagina.paste(imagem, deslocamento, imagem)
+
+
+def _montar_base(compilado, largura):
+    """
+    Desenha as operações fixas do layout e separa as que dependem da proposta.
+
+    Returns:
+        dict: Imagem base e operações dinâmicas já em pixels
+    """
+    from PIL import Image, ImageDraw
+
+    largura_pagina, altura_pagina = compilado['tamanho_pagina']
+    escala_final = largura / largura_pagina
+    altura = round(altura_pagina * escala_final)
+    escala = escala_final * SUPERAMOSTRAGEM
+
+    def ponto(x, y, e=escala):
+        return x * e, (altura_pagina - y) * e
+
+    pagina = Image.new('RGB', (largura * SUPERAMOSTRAGEM, altura * SUPERAMOSTRAGEM), (255, 255, 255))
+    desenho = ImageDraw.Draw(pagina)
+    fonte = tamanho = None
+    preenchimento = linha = (0, 0, 0)
+    espessura = 1
+    condicional = None
+    dinamicas = []
+
+    def estilo_texto():
+        """Estilo atual já em pixels da prévia: fixo ou escolhido pelo contexto"""
+        if condicional is not None:
+            campo, verdadeiro, padrao = condicional
+            return ('condicional', campo,
+                    *((_fonte(_arquivo_fonte(compilado, f), t * escala_final), _cor(rgb))
+                      for f, t, rgb in (verdadeiro, padrao)))
+        return ('fixo', _fonte(_arquivo_fonte(compilado, fonte), tamanho * escala_final), preenchimento)
+
+    for operacao in compilado['operacoes']:
+        tipo = operacao[0]
+
+        if tipo == CHAMAR:
+            _, metodo, args = operacao
+            if metodo == 'setFont':
+                fonte, tamanho = args[0], args[1]
+                condicional = None
+            elif metodo == 'setFillColorRGB':
+                preenchimento = _cor(args)
+                condicional = None
+            elif metodo == 'setStrokeColorRGB':
+                linha = _cor(args)
+            elif metodo == 'setLineWidth':
+                espessura = args[0]
+            elif metodo == 'line':
+                x1, y1, x2, y2 = args
+                desenho.line((*ponto(x1, y1), *ponto(x2, y2)), fill=linha,
+                             width=max(1, round(espessura * escala)))
+            elif metodo == 'rect':
+                x, y, w, h = args[:4]
+                x0, y1 = ponto(x, y)
+                x1, y0 = ponto(x + w, y + h)
+                desenho.rectangle((x0, y0, x1, y1), fill=preenchimento)
+            elif metodo == 'roundRect':
+                x, y, w, h, raio = args
+                x0, y1 = ponto(x, y)
+                x1, y0 = ponto(x + w, y + h)
+                desenho.rounded_rectangle((x0, y0, x1, y1), radius=raio * escala, outline=linha,
+                                          width=max(1, round(espessura * escala)))
+            else:
+                logger.warning(f"Prévia: operação {metodo} ignorada")
+
+        elif tipo == ESTILO_CONDICIONAL:
+            _, campo, verdadeiro, padrao = operacao
+            condicional = (campo, verdadeiro, padrao)
+
+        elif tipo == TEXTO:
+            _, metodo, x, y, texto = operacao
+            if condicional is None:
+                desenho.text(ponto(x, y), texto, font=_fonte(_arquivo_fonte(compilado, fonte), tamanho * escala),
+                             fill=preenchimento, anchor=ANCORAS[metodo])
+            else:
+                dinamicas.append((TEXTO, ANCORAS[metodo], ponto(x, y, escala_final), texto, estilo_texto()))
+
+        elif tipo == TEXTO_DINAMICO:
+            _, metodo, x, y, modelo = operacao
+            dinamicas.append((TEXTO_DINAMICO, ANCORAS[metodo], ponto(x, y, escala_final), modelo, estilo_texto()))
+
+        elif tipo == IMAGEM:
+            _, imagem, x, y, w, h = operacao
+            _colar_imagem(pagina, abrir_imagem_fixa(imagem['caminho']), (*ponto(x, y + h), *ponto(x + w, y)))
+
+        elif tipo == IMAGEM_SLOT:
+            _, slot, x, y, w, h = operacao
+            dinamicas.append((IMAGEM_SLOT, slot, (*ponto(x, y + h, escala_final), *ponto(x + w, y, escala_final))))
+
+        elif tipo == TABELA:
+            _, linhas, x, y_topo, largura_tabela, estilo_tabela = operacao
+            espacamentos = {'LEFTPADDING': 6, 'RIGHTPADDING': 6, 'TOPPADDING': 3, 'BOTTOMPADDING': 3}
+            for comando in estilo_tabela.getCommands():
+                if comando[0] in espacamentos:
+                    espacamentos[comando[0]] = comando[3]
+            paragrafos = [
+                (_fonte(_arquivo_fonte(compilado, estilo.fontName), estilo.fontSize * escala_final),
+                 estilo.fontSize * escala_final, estilo.leading * escala_final,
+                 _cor(estilo.textColor.rgb()), ALINHAMENTOS_PARAGRAFO.get(estilo.alignment, 'esquerda'), modelo)
+                for estilo, modelo in linhas
+            ]
+            x_px, y_px = ponto(x + espacamentos['LEFTPADDING'], y_topo, escala_final)
+            dinamicas.append((TABELA, paragrafos, x_px, y_px,
+                              (largura_tabela - espacamentos['LEFTPADDING'] - espacamentos['RIGHTPADDING']) * escala_final,
+                              espacamentos['TOPPADDING'] * escala_final,
+                              espacamentos['BOTTOMPADDING'] * escala_final))
+
+    pagina = pagina.resize((largura, altura), Image.LANCZOS)
+    return {'imagem': pagina, 'dinamicas': dinamicas}
+
+
+def obter_base(compilado, largura=LARGURA_PREVIA):
+    """Retorna a base da prévia do layout na largura, montada na primeira vez"""
+    chave = (compilado['nome'], compilado['versao'], largura)
+    base = _bases.get(chave)
+    if base is None:
+        base = _montar_base(compilado, largura)
+        with _lock:
+            base = _bases.setdefault(chave, base)
+        logger.info(f"Base da prévia de {chave[0]} v{chave[1]} montada ({largura}px, "
+                    f"{len(base['dinamicas'])} operações dinâmicas)")
+    return base
+
+
+def _quebrar_linhas(texto, fonte, largura):
+    """Quebra o texto em linhas que cabem na largura (em pixels)"""
+    linhas = []
+    atual = ''
+    for palavra in texto.split():
+        candidata = f"{atual} {palavra}" if atual else palavra
+        if atual and fonte.getlength(candidata) > largura:
+            linhas.append(atual)
+            atual = palavra
+        else:
+            atual = candidata
+    if atual:
+        linhas.append(atual)
+    return linhas
+
+
+def renderizar_previa(compilado, contexto, imagens=None, formato='webp', largura=LARGURA_PREVIA):
+    """
+    Renderiza a prévia da página em imagem.
+
+    Args:
+        compilado (dict): Layout compilado (obter_layout())
+        contexto (dict): Mesmo contexto usado no PDF
+        imagens (dict): Imagens dos slots (PNG em bytes ou buffer)
+        formato (str): 'png' ou 'webp'
+        largura (int): Largura da prévia em pixels
+
+    Returns:
+        bytes: Imagem codificada
+    """
+    from PIL import Image, ImageDraw
+
+    if formato not in FORMATOS_PREVIA:
+        raise ValueError(f"Formato de prévia desconhecido: {formato} (use {', '.join(FORMATOS_PREVIA)})")
+    imagens = imagens or {}
+    base = obter_base(compilado, largura)
+    pagina = base['imagem'].copy()
+    desenho = ImageDraw.Draw(pagina)
+
+    for operacao in base['dinamicas']:
+        tipo = operacao[0]
+
+        if tipo in (TEXTO, TEXTO_DINAMICO):
+            _, ancora, posicao, texto, estilo = operacao
+            if estilo[0] == 'condicional':
+                fonte, cor = estilo[2] if contexto.get(estilo[1]) else estilo[3]
+            else:
+                _, fonte, cor = estilo
+            if tipo == TEXTO_DINAMICO:
+                texto = texto.format_map(contexto)
+            desenho.text(posicao, texto, font=fonte, fill=cor, anchor=ancora)
+
+        elif tipo == IMAGEM_SLOT:
+            _, slot, caixa = operacao
+            origem = imagens.get(slot)
+            if origem is None:
+                continue
+            origem = origem.getvalue() if hasattr(origem, 'getvalue') else origem
+            with Image.open(BytesIO(origem)) as imagem:
+                imagem.load()
+                _colar_imagem(pagina, imagem, caixa)
+
+        elif tipo == TABELA:
+            _, paragrafos, x, y, largura_texto, espaco_topo, espaco_base = operacao
+            for fonte, tamanho, entrelinha, cor, alinhamento, modelo in paragrafos:
+                y += espaco_topo
+                linhas = _quebrar_linhas(modelo.format_map(contexto), fonte, largura_texto)
+                for indice, texto in enumerate(linhas):
+                    if alinhamento == 'centro':
+                        posicao, ancora = (x + largura_texto / 2, y + tamanho + indice * entrelinha), 'ms'
+                    elif alinhamento == 'direita':
+                        posicao, ancora = (x + largura_texto, y + tamanho + indice * entrelinha), 'rs'
+                    else:
+                        posicao, ancora = (x, y + tamanho + indice * entrelinha), 'ls'
+                    desenho.text(posicao, texto, font=fonte, fill=cor, anchor=ancora)
+                y += len(linhas) * entrelinha + espaco_base
+
+    buffer = BytesIO()
+    if formato == 'webp':
+        pagina.save(buffer, format='WEBP', quality=QUALIDADE_WEBP, method=METODO_WEBP)
+    else:
+        pagina.save(buffer, format='PNG', compress_level=NIVEL_PNG)
+    return buffer.getvalue()
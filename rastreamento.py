@@ -0,0 +1,349 @@
+"""
+Rastreamento distribuído do pipeline da proposta (compatível com OpenTelemetry)
+
+Cada requisição vira um rastro com um span por etapa (validação, fila,
+cálculo, gráfico, registro de fontes, desenho e p.save() do PDF, gravação em
+disco, histórico, base64 da resposta...). O contexto segue o padrão W3C Trace
+Context: o cabeçalho `traceparent` da requisição é continuado, a resposta
+devolve o seu (e `X-Trace-Id`), e o contexto atravessa as threads de
+renderização (contextvars), os processos de preparo de páginas e os nós da
+fila compartilhada. Os spans dos outros processos voltam junto com o
+resultado (executar_remoto() / adotar()), então o rastro chega completo ao
+processo que o iniciou.
+
+Amostragem na cauda: os spans ficam em memória até o fim do span raiz do
+processo, e só então se decide se o rastro é exportado. São mantidos os
+rastros com erro, os mais lentos que RASTREAMENTO_LENTO_MS e uma fração
+RASTREAMENTO_AMOSTRAGEM dos demais, escolhida pelo trace id (a mesma decisão
+em todos os processos do rastro).
+
+Exportadores (RASTREAMENTO):
+- 'memoria': os últimos RASTREAMENTO_MAX_RASTROS rastros, em GET /rastros;
+- 'arquivo': um span por linha (JSON Lines) em RASTREAMENTO_ARQUIVO, com os
+  nomes de campos do OTLP/JSON (traceId, spanId, parentSpanId, name, kind,
+  startTimeUnixNano, endTimeUnixNano, attributes, status), para análise
+  offline ou importação em um coletor.
+Vazio (padrão) desativa: span() devolve um span nulo sem custo.
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import re
+import secrets
+import socket
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+EXPORTADOR = os.getenv('RASTREAMENTO', '').strip().lower()
+ATIVO = EXPORTADOR in ('memoria', 'arquivo')
+ARQUIVO = os.getenv('RASTREAMENTO_ARQUIVO', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'propostas', 'rastros.jsonl'))
+SERVICO = os.getenv('RASTREAMENTO_SERVICO', 'proposta')
+# Rastros mais lentos que isso (ms) são sempre mantidos
+LENTO_MS = float(os.getenv('RASTREAMENTO_LENTO_MS', '2000'))
+# Fração dos rastros rápidos e sem erro mantida
+AMOSTRAGEM = float(os.getenv('RASTREAMENTO_AMOSTRAGEM', '0.01'))
+MAX_RASTROS = int(os.getenv('RASTREAMENTO_MAX_RASTROS', '200'))
+# Spans guardados por rastro em um processo (os excedentes são contados e descartados)
+MAX_SPANS = 1000
+
+INTERNO = 'SPAN_KIND_INTERNAL'
+SERVIDOR = 'SPAN_KIND_SERVER'
+PRODUTOR = 'SPAN_KIND_PRODUCER'
+CONSUMIDOR = 'SPAN_KIND_CONSUMER'
+
+_TRACEPARENT = re.compile(r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+_RECURSO = {'service.name': SERVICO, 'host.name': socket.gethostname()}
+
+_span_atual = contextvars.ContextVar('span_atual', default=None)
+_lock = threading.Lock()
+_rastros = deque(maxlen=MAX_RASTROS)
+_contadores = dict.fromkeys(('rastros', 'erro', 'lento', 'amostra', 'descartados', 'spans_descartados'), 0)
+
+
+def interpretar_traceparent(valor):
+    """
+    Interpreta um cabeçalho W3C `traceparent`.
+
+    Returns:
+        tuple: (trace_id, span_id) ou None se ausente ou inválido
+    """
+    correspondencia = _TRACEPARENT.match((valor or '').strip().lower())
+    if not correspondencia:
+        return None
+    versao, trace_id, span_id, _ = correspondencia.groups()
+    if versao == 'ff' or trace_id == '0' * 32 or span_id == '0' * 16:
+        return None
+    return trace_id, span_id
+
+
+class _Segmento:
+    """Spans de um rastro neste processo, aguardando o fim do span raiz local"""
+
+    def __init__(self, coletar=False):
+        self.spans = []
+        self.coletar = coletar
+        self.encerrado = False
+        self.descartados = 0
+        self.lock = threading.Lock()
+
+    def adicionar(self, spans):
+        with self.lock:
+            if self.encerrado:
+                return False
+            livres = MAX_SPANS - len(self.spans)
+            self.spans.extend(spans[:max(0, livres)])
+            self.descartados += max(0, len(spans) - max(0, livres))
+            return True
+
+
+class Span:
+    """Um span em andamento; use como context manager (span())"""
+
+    __slots__ = ('nome', 'tipo', 'trace_id', 'span_id', 'pai', 'atributos', 'erro', 'segmento', 'raiz',
+                 'inicio_ns', '_inicio', 'duracao_ns', '_token')
+
+    def __init__(self, nome, tipo, trace_id, pai, segmento, raiz, atributos):
+        self.nome = nome
+        self.tipo = tipo
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.pai = pai
+        self.segmento = segmento
+        self.raiz = raiz
+        self.atributos = atributos
+        self.erro = None
+        self.duracao_ns = None
+
+    @property
+    def traceparent(self):
+        """Contexto deste span no formato W3C, para propagar adiante"""
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def definir(self, **atributos):
+        """Acrescenta atributos ao span"""
+        self.atributos.update(atributos)
+
+    def falhar(self, mensagem):
+        """Marca o span com erro (quando a falha não sai como exceção)"""
+        self.erro = str(mensagem)
+
+    def __enter__(self):
+        self.inicio_ns = time.time_ns()
+        self._inicio = time.perf_counter_ns()
+        self._token = _span_atual.set(self)
+        return self
+
+    def __exit__(self, tipo_excecao, excecao, _):
+        self.duracao_ns = time.perf_counter_ns() - self._inicio
+        _span_atual.reset(self._token)
+        if excecao is not None and self.erro is None:
+            self.erro = f'{tipo_excecao.__name__}: {excecao}'
+        if not self.segmento.adicionar([self.para_dict()]):
+            # Span terminado depois da raiz (ex.: trabalho em segundo plano)
+            _contar('spans_descartados')
+        if self.raiz:
+            _finalizar(self)
+        return False
+
+    def para_dict(self):
+        """Span no formato OTLP/JSON (atributos como objeto simples)"""
+        status = {'code': 'STATUS_CODE_ERROR', 'message': self.erro} if self.erro else {'code': 'STATUS_CODE_OK'}
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.pai or '',
+            'name': self.nome,
+            'kind': self.tipo,
+            'startTimeUnixNano': self.inicio_ns,
+            'endTimeUnixNano': self.inicio_ns + self.duracao_ns,
+            'attributes': self.atributos,
+            'status': status,
+            'resource': {**_RECURSO, 'process.pid': os.getpid()},
+        }
+
+
+class _SpanNulo:
+    """Span sem efeito, usado com o rastreamento desativado"""
+
+    traceparent = None
+    trace_id = None
+
+    def definir(self, **atributos):
+        pass
+
+    def falhar(self, mensagem):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+
+_NULO = _SpanNulo()
+
+
+def span(nome, contexto=None, tipo=INTERNO, raiz=False, **atributos):
+    """
+    Abre um span filho do span atual.
+
+    Args:
+        nome (str): Nome da etapa (ex.: 'proposta.grafico')
+        contexto (str): `traceparent` de um processo remoto; inicia uma nova
+            raiz local continuando aquele rastro
+        tipo (str): INTERNO, SERVIDOR, PRODUTOR ou CONSUMIDOR
+        raiz (bool): Fora de um rastro, inicia um (pontos de entrada); senão
+            a etapa só é rastreada dentro de um rastro existente
+        **atributos: Atributos do span
+
+    Returns:
+        Span: Context manager (um span nulo com o rastreamento desativado)
+    """
+    atual = _span_atual.get()
+    if contexto is None and atual is not None:
+        return Span(nome, tipo, atual.trace_id, atual.span_id, atual.segmento, False, atributos)
+    if not ATIVO or (contexto is None and not raiz):
+        return _NULO
+    remoto = interpretar_traceparent(contexto)
+    trace_id, pai = remoto if remoto else (secrets.token_hex(16), None)
+    return Span(nome, tipo, trace_id, pai, _Segmento(), True, atributos)
+
+
+def rastrear(nome, raiz=False, **atributos):
+    """
+    Decorador: executa a função dentro de um span (span()). Um resultado
+    {'sucesso': False, 'erro': ...} (convenção dos processar_*) marca o span
+    com erro.
+    """
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envoltorio(*args, **kwargs):
+            if _span_atual.get() is None and not (ATIVO and raiz):
+                return funcao(*args, **kwargs)
+            with span(nome, raiz=raiz, **atributos) as atual:
+                resultado = funcao(*args, **kwargs)
+                if isinstance(resultado, dict) and resultado.get('sucesso') is False:
+                    atual.falhar(resultado.get('erro'))
+                return resultado
+        return envoltorio
+    return decorador
+
+
+def atual():
+    """Span atual (um span nulo fora de um rastro)"""
+    return _span_atual.get() or _NULO
+
+
+def contexto_atual():
+    """`traceparent` do span atual, para propagar a outro processo (None fora de um rastro)"""
+    return atual().traceparent
+
+
+def executar_remoto(contexto, nome, funcao, *args, **kwargs):
+    """
+    Executa `funcao` em outro processo continuando o rastro de `contexto`.
+
+    Os spans não são exportados aqui: voltam com o resultado para o processo
+    que iniciou o rastro, que os junta com adotar() antes da amostragem.
+
+    Returns:
+        tuple: (resultado, spans em OTLP/JSON)
+    """
+    remoto = interpretar_traceparent(contexto)
+    if remoto is None:
+        return funcao(*args, **kwargs), []
+    segmento = _Segmento(coletar=True)
+    with Span(nome, CONSUMIDOR, remoto[0], remoto[1], segmento, True, {}):
+        resultado = funcao(*args, **kwargs)
+    return resultado, segmento.spans
+
+
+def adotar(resultado_remoto):
+    """Junta ao rastro atual os spans de executar_remoto() e retorna o resultado"""
+    resultado, spans = resultado_remoto
+    atual = _span_atual.get()
+    if spans and atual is not None:
+        atual.segmento.adicionar(spans)
+    return resultado
+
+
+def _contar(contador, quantidade=1):
+    with _lock:
+        _contadores[contador] += quantidade
+
+
+def _motivo_amostragem(raiz, spans):
+    """Decisão na cauda: por que manter o rastro (None descarta)"""
+    if any(dados['status']['code'] == 'STATUS_CODE_ERROR' for dados in spans):
+        return 'erro'
+    if raiz.duracao_ns / 1e6 >= LENTO_MS:
+        return 'lento'
+    # Pelo trace id: todos os processos do rastro decidem igual
+    if int(raiz.trace_id[:8], 16) < AMOSTRAGEM * 0x100000000:
+        return 'amostra'
+    return None
+
+
+def _finalizar(raiz):
+    """Encerra o segmento do span raiz local, aplica a amostragem e exporta"""
+    segmento = raiz.segmento
+    with segmento.lock:
+        segmento.encerrado = True
+        spans = list(segmento.spans)
+    if segmento.coletar:
+        return
+    _contar('rastros')
+    if segmento.descartados:
+        _contar('spans_descartados', segmento.descartados)
+    motivo = _motivo_amostragem(raiz, spans)
+    if motivo is None:
+        _contar('descartados')
+        return
+    _contar(motivo)
+    for dados in spans:
+        if dados['spanId'] == raiz.span_id:
+            dados['attributes']['amostragem.motivo'] = motivo
+    try:
+        _exportar(raiz, spans, motivo)
+    except Exception as e:
+        logger.error(f"Erro ao exportar o rastro {raiz.trace_id}: {str(e)}")
+
+
+def _exportar(raiz, spans, motivo):
+    if EXPORTADOR == 'arquivo':
+        linhas = ''.join(json.dumps(dados, ensure_ascii=False, default=str) + '\n' for dados in spans)
+        with _lock:
+            os.makedirs(os.path.dirname(ARQUIVO) or '.', exist_ok=True)
+            with open(ARQUIVO, 'a', encoding='utf-8') as f:
+                f.write(linhas)
+    else:
+        with _lock:
+            _rastros.append({
+                'trace_id': raiz.trace_id,
+                'nome': raiz.nome,
+                'duracao_ms': raiz.duracao_ns / 1e6,
+                'motivo': motivo,
+                'spans': sorted(spans, key=lambda dados: dados['startTimeUnixNano']),
+            })
+
+
+def listar_rastros(limite=50, minimo_ms=0.0):
+    """Rastros mantidos pelo exportador em memória, do mais recente ao mais antigo"""
+    with _lock:
+        rastros = list(_rastros)
+    rastros = [rastro for rastro in reversed(rastros) if rastro['duracao_ms'] >= minimo_ms]
+    return rastros[:limite]
+
+
+def metricas():
+    """Rastros vistos e mantidos por motivo da amostragem neste processo"""
+    with _lock:
+        return {'exportador': EXPORTADOR if ATIVO else None, **_contadores}
@@ -0,0 +1,213 @@
+"""
+Simulação de Monte Carlo da economia com bandeiras tarifárias
+
+Os cenários fixos de calcular_valores_financeiros() supõem o contrato inteiro
+sob uma única bandeira. Aqui cada caminho sorteia a bandeira de cada mês pela
+distribuição da distribuidora (seção 'simulacao' de distribuidoras.json, ou
+informada na requisição) e um reajuste anual das tarifas (normal com média e
+desvio configurados; o primeiro ano usa as tarifas atuais). A economia de um
+mês é a mesma dos cenários fixos: valor do desconto + energia compensada x
+adicional da bandeira (0 na verde), com os adicionais em micro-reais de
+centavos.tarifas_micro().
+
+Como os meses de um ano são independentes, a soma dos adicionais de um ano
+tem uma distribuição exata com poucos valores possíveis (no máximo 1.820 para
+cinco bandeiras em 12 meses). Ela é calculada uma vez por distribuição e
+amostrada pelo método de alias, então cada caminho sorteia um número por ano
+em vez de um por mês; 100 mil caminhos de 5 anos levam dezenas de
+milissegundos. Os percentis são de posição (o valor na ordem floor(q x (n-1))),
+obtidos com np.partition.
+"""
+
+import secrets
+from collections import defaultdict
+
+from cache import CacheLRU
+from centavos import MESES_ANO, MICRO_POR_CENTAVO, tarifas_micro
+
+CAMINHOS_PADRAO = 100_000
+# Com 10 anos cada matriz (anos x caminhos) de float64 tem 16 MB
+MAX_CAMINHOS = 200_000
+ANOS_PADRAO = 5
+MAX_ANOS = 10
+PERCENTIS = (5, 50, 95)
+
+# Distribuição anual e tabela de alias por (adicionais, probabilidades)
+_distribuicoes = CacheLRU('distribuicoes_bandeiras', 64)
+
+
+def configuracao_simulacao(distribuidora, bandeiras=None, reajuste_medio=None, reajuste_desvio=None):
+    """
+    Configuração da simulação: a da distribuidora, com as substituições informadas.
+
+    Args:
+        bandeiras (dict): Probabilidades mensais por bandeira (normalizadas para somar 1)
+        reajuste_medio, reajuste_desvio (float): Reajuste anual das tarifas (0.06 = 6%)
+    """
+    from distribuidoras import normalizar_simulacao
+
+    padrao = distribuidora['simulacao']
+    if bandeiras is None and reajuste_medio is None and reajuste_desvio is None:
+        return padrao
+    reajuste = padrao['reajuste_anual']
+    return normalizar_simulacao({
+        'bandeiras': padrao['bandeiras'] if bandeiras is None else bandeiras,
+        'reajuste_anual': {
+            'media': reajuste['media'] if reajuste_medio is None else reajuste_medio,
+            'desvio': reajuste['desvio'] if reajuste_desvio is None else reajuste_desvio,
+        },
+    })
+
+
+def _tabela_alias(probabilidades):
+    """Tabelas (probabilidade, alias) do método de alias de Walker/Vose"""
+    quantidade = len(probabilidades)
+    escalados = [p * quantidade for p in probabilidades]
+    limiar = [1.0] * quantidade
+    alias = list(range(quantidade))
+    pequenos = [i for i, p in enumerate(escalados) if p < 1.0]
+    grandes = [i for i, p in enumerate(escalados) if p >= 1.0]
+    while pequenos and grandes:
+        pequeno, grande = pequenos.pop(), grandes.pop()
+        limiar[pequeno] = escalados[pequeno]
+        alias[pequeno] = grande
+        escalados[grande] -= 1.0 - escalados[pequeno]
+        (pequenos if escalados[grande] < 1.0 else grandes).append(grande)
+    return limiar, alias
+
+
+def distribuicao_anual(adicionais, probabilidades):
+    """
+    Distribuição exata da soma dos adicionais (micro-reais por kWh) em 12 meses.
+
+    Returns:
+        dict: 'valores' (int64), 'limiar' e 'alias' (tabelas do método de alias)
+    """
+    import numpy as np
+
+    versao, chave = tuple(adicionais), tuple(probabilidades)
+    distribuicao = _distribuicoes.obter(versao, chave)
+    if distribuicao is None:
+        atual = {0: 1.0}
+        for _ in range(MESES_ANO):
+            proxima = defaultdict(float)
+            for soma, probabilidade in atual.items():
+                for adicional, p in zip(adicionais, probabilidades):
+                    if p > 0:
+                        proxima[soma + adicional] += probabilidade * p
+            atual = proxima
+        valores = sorted(atual)
+        total = sum(atual.values())
+        limiar, alias = _tabela_alias([atual[valor] / total for valor in valores])
+        distribuicao = {
+            'valores': np.array(valores, dtype=np.int64),
+            'limiar': np.array(limiar),
+            'alias': np.array(alias, dtype=np.intp),
+        }
+        _distribuicoes.guardar(versao, chave, distribuicao)
+    return distribuicao
+
+
+def _percentis(matriz):
+    """Percentis de posição (PERCENTIS) de cada linha de uma matriz (linhas x caminhos)"""
+    import numpy as np
+
+    caminhos = matriz.shape[1]
+    posicoes = [q * (caminhos - 1) // 100 for q in PERCENTIS]
+    return np.partition(matriz, posicoes, axis=1)[:, posicoes]
+
+
+def _resumo(media, percentis, divisor=1):
+    """Média e percentis em centavos inteiros"""
+    resumo = {'media': round(float(media) / divisor)}
+    resumo.update((f"p{q}", round(float(valor) / divisor)) for q, valor in zip(PERCENTIS, percentis))
+    return resumo
+
+
+def simular_economia(valores, distribuidora, caminhos=CAMINHOS_PADRAO, anos=ANOS_PADRAO, semente=None,
+                     bandeiras=None, reajuste_medio=None, reajuste_desvio=None):
+    """
+    Simula a economia do cliente ao longo do contrato.
+
+    Args:
+        valores (dict): calcular_valores_financeiros() da proposta
+        distribuidora (dict): Snapshot da distribuidora (obter_distribuidora())
+        caminhos (int): Quantidade de caminhos simulados
+        anos (int): Horizonte do contrato
+        semente (int): Semente do gerador (None sorteia uma, devolvida no resultado)
+        bandeiras, reajuste_medio, reajuste_desvio: ver configuracao_simulacao()
+
+    Returns:
+        dict: Economia mensal média, do primeiro ano, do contrato e acumulada por
+        ano (média e percentis, em centavos) e a configuração usada
+    """
+    import numpy as np
+
+    if not 1 <= caminhos <= MAX_CAMINHOS:
+        raise ValueError(f"Quantidade de caminhos deve estar entre 1 e {MAX_CAMINHOS}")
+    if not 1 <= anos <= MAX_ANOS:
+        raise ValueError(f"Horizonte deve estar entre 1 e {MAX_ANOS} anos")
+
+    configuracao = configuracao_simulacao(distribuidora, bandeiras, reajuste_medio, reajuste_desvio)
+    tarifas = tarifas_micro(distribuidora)
+    nomes = list(configuracao['bandeiras'])
+    adicionais = [tarifas['bandeiras'].get(nome, 0) for nome in nomes]
+    distribuicao = distribuicao_anual(adicionais, [configuracao['bandeiras'][nome] for nome in nomes])
+
+    semente = secrets.randbits(63) if semente is None else semente
+    gerador = np.random.default_rng(semente)
+
+    # Adicionais de bandeira de cada ano (anos x caminhos), pelo método de alias
+    sorteio = gerador.random((anos, caminhos)) * len(distribuicao['valores'])
+    indices = sorteio.astype(np.intp)
+    indices = np.where(sorteio - indices < distribuicao['limiar'][indices], indices, distribuicao['alias'][indices])
+    adicionais_ano = distribuicao['valores'][indices]
+
+    # Economia de cada ano em centavos, sem e com o reajuste acumulado das tarifas
+    energia_compensada = int(valores['energia_energia_a'])
+    economia = (valores['centavos']['valor_desconto'] * MESES_ANO
+                + adicionais_ano * (energia_compensada / MICRO_POR_CENTAVO))
+    reajuste = configuracao['reajuste_anual']
+    if anos > 1 and (reajuste['media'] or reajuste['desvio']):
+        # Um sorteio na cauda da normal não leva as tarifas abaixo de zero
+        fatores = np.maximum(1.0 + gerador.normal(reajuste['media'], reajuste['desvio'], (anos - 1, caminhos)), 0.0)
+        economia[1:] *= np.cumprod(fatores, axis=0)
+    acumulada = np.cumsum(economia, axis=0)
+
+    medias = acumulada.mean(axis=1)
+    percentis = _percentis(acumulada)
+    meses = MESES_ANO * anos
+    return {
+        'caminhos': caminhos,
+        'anos': anos,
+        'semente': semente,
+        'bandeiras': configuracao['bandeiras'],
+        'reajuste_anual': reajuste,
+        'economia_mensal': _resumo(medias[-1], percentis[-1], meses),
+        'economia_ano': _resumo(medias[0], percentis[0]),
+        'economia_contrato': _resumo(medias[-1], percentis[-1]),
+        'por_ano': [{'ano': ano, **_resumo(media, linha)}
+                    for ano, (media, linha) in enumerate(zip(medias, percentis), start=1)],
+    }
+
+
+def faixa_mensal(simulacao):
+    """(menor, maior) percentil da economia mensal média, em reais (faixa do gráfico)"""
+    mensal = simulacao['economia_mensal']
+    return mensal[f"p{PERCENTIS[0]}"] / 100, mensal[f"p{PERCENTIS[-1]}"] / 100
+
+
+def formatar_simulacao(simulacao):
+    """Resultado de simular_economia() com os valores em centavos formatados em pt-BR ('1.234,56')"""
+    from formatacao import formatar_centavos
+
+    def formatar(resumo):
+        return {campo: valor if campo == 'ano' else formatar_centavos(valor) for campo, valor in resumo.items()}
+
+    return {
+        **simulacao,
+        'economia_mensal': formatar(simulacao['economia_mensal']),
+        'economia_ano': formatar(simulacao['economia_ano']),
+        'economia_contrato': formatar(simulacao['economia_contrato']),
+        'por_ano': [formatar(ano) for ano in simulacao['por_ano']],
+    }
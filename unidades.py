@@ -0,0 +1,294 @@
+"""
+Propostas para clientes com várias unidades consumidoras (UCs)
+
+O PDF começa com uma página de resumo, com a soma de todas as unidades, e
+segue com uma página de detalhe por unidade, usando o mesmo layout da
+proposta individual. Como calcular_valores_financeiros() é linear no consumo,
+no consumo mínimo e na taxa de iluminação, o resumo é calculado a partir da
+soma dos parâmetros das unidades.
+
+O trabalho pesado de cada página (valores, gráfico e a imagem do gráfico já
+comprimida para o PDF) roda em um pool de processos. As páginas são enviadas
+em uma janela limitada e desenhadas no canvas na ordem, à medida que ficam
+prontas; assim no máximo JANELA_PAGINAS páginas preparadas ficam em memória,
+qualquer que seja o número de unidades.
+"""
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from centavos import para_centavos, para_reais
+from entrada import EntradaUnidade, normalizar_unidades
+from rastreamento import adotar, contexto_atual, executar_remoto, rastrear, span
+from proposta import (
+    OUTPUT_DIR, calcular_parametros_automaticos, calcular_valores_financeiros,
+    criar_diretorio_saida, montar_contexto_proposta, sanitizar_nome_arquivo,
+    validar_nome_completo,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_UNIDADES = 200
+
+# Processos que preparam as páginas (1 ou menos prepara no próprio processo)
+PROCESSOS_UNIDADES = int(os.getenv('PROPOSTA_PROCESSOS_UNIDADES', str(min(4, os.cpu_count() or 1))))
+# Páginas preparadas (ou em preparo) mantidas ao mesmo tempo
+JANELA_PAGINAS = max(2, PROCESSOS_UNIDADES * 2)
+
+_executor = None
+_lock_executor = threading.Lock()
+
+
+def _inicializar_processo():
+    """Aquece o processo de preparo de páginas (matplotlib, figura e ReportLab)"""
+    from proposta import carregar_dependencias
+    carregar_dependencias()
+
+
+def obter_executor():
+    """Retorna o pool de processos compartilhado, criando-o na primeira chamada"""
+    global _executor
+    if _executor is None:
+        with _lock_executor:
+            if _executor is None:
+                # 'spawn' evita herdar locks de threads do servidor no fork
+                _executor = ProcessPoolExecutor(
+                    max_workers=PROCESSOS_UNIDADES,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_inicializar_processo,
+                )
+    return _executor
+
+
+def encerrar_executor():
+    """Encerra o pool de processos"""
+    global _executor
+    with _lock_executor:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
+
+
+def calcular_unidades(nome_completo, unidades, distribuidora):
+    """
+    Calcula os parâmetros de cada unidade consumidora.
+
+    Args:
+        nome_completo (str): Nome do cliente (titular de todas as unidades)
+        unidades (tuple): EntradaUnidade de cada unidade (normalizar_unidades())
+        distribuidora (dict): Snapshot da distribuidora (obter_distribuidora())
+
+    Returns:
+        list: Parâmetros de cada unidade, na ordem recebida
+    """
+    total = len(unidades)
+    return [
+        calcular_parametros_automaticos(
+            nome_completo=nome_completo,
+            endereco_completo=f"UC {indice}/{total} - {unidade.endereco}",
+            valor_fatura_cliente=unidade.valor_fatura,
+            distribuidora=distribuidora,
+        )
+        for indice, unidade in enumerate(unidades, start=1)
+    ]
+
+
+def somar_parametros(nome_completo, parametros_unidades):
+    """Soma os parâmetros das unidades para a página de resumo"""
+    resumo = dict(parametros_unidades[0])
+    resumo['nome'] = nome_completo
+    resumo['endereco'] = f"{len(parametros_unidades)} unidades consumidoras"
+    for campo in ('consumo', 'consumo_minimo'):
+        resumo[campo] = sum(parametros[campo] for parametros in parametros_unidades)
+    # Valores monetários somados em centavos (sem resíduo de ponto flutuante)
+    for campo in ('taxa_iluminacao_publica', 'valor_fatura_original'):
+        resumo[campo] = para_reais(sum(para_centavos(parametros[campo]) for parametros in parametros_unidades))
+    return resumo
+
+
+@rastrear('unidades.pagina')
+def preparar_pagina(parametros, distribuidora, perfil, slot_grafico):
+    """
+    Prepara uma página: valores financeiros, contexto do layout e a imagem
+    do gráfico pronta para o PDF, na resolução do perfil para o tamanho do
+    slot (largura, altura). Executado nos processos do pool.
+    """
+    from grafico import dpi_para_tamanho, renderizar_grafico
+    from layout import obter_perfil, preparar_imagem_dados
+
+    valores = calcular_valores_financeiros(parametros, distribuidora)
+    _, configuracao = obter_perfil(perfil)
+    png = renderizar_grafico(
+        valores['total_sem_desconto'],
+        valores['total_fatura_energia_a'],
+        valores['consumo_minimo_energisa'],
+        valores['tax_ilu_pub'],
+        valores['desconto'],
+        versao_tarifas=distribuidora['versao'],
+        dpi=dpi_para_tamanho(*slot_grafico, configuracao['dpi']),
+        energia_compensada=valores['valor_fatura_sem_imposto'],
+        fatura_geradora=valores['fatura_geradora'],
+    )
+    return {
+        'contexto': montar_contexto_proposta(parametros, valores),
+        'grafico': preparar_imagem_dados(png.getvalue(), *slot_grafico, perfil),
+        'valor_desconto': valores['valor_desconto'],
+        'economia_ano': valores['economia_ano'],
+        'economia_5ano': valores['economia_5ano'],
+    }
+
+
+def _paginas_preparadas(lista_parametros, distribuidora, perfil, slot_grafico):
+    """Gera as páginas preparadas na ordem, com no máximo JANELA_PAGINAS em memória"""
+    if PROCESSOS_UNIDADES <= 1:
+        for parametros in lista_parametros:
+            yield preparar_pagina(parametros, distribuidora, perfil, slot_grafico)
+        return
+
+    executor = obter_executor()
+    # Os spans dos processos do pool voltam com a página (rastreamento.adotar())
+    contexto = contexto_atual()
+    pendentes = deque()
+    try:
+        for parametros in lista_parametros:
+            if len(pendentes) >= JANELA_PAGINAS:
+                yield adotar(pendentes.popleft().result())
+            pendentes.append(executor.submit(executar_remoto, contexto, 'unidades.processo', preparar_pagina,
+                                             parametros, distribuidora, perfil, slot_grafico))
+        while pendentes:
+            yield adotar(pendentes.popleft().result())
+    finally:
+        for futuro in pendentes:
+            futuro.cancel()
+
+
+def renderizar_proposta_unidades_pdf(nome_completo, unidades, destino, distribuidora=None, perfil=None):
+    """
+    Renderiza a proposta de várias unidades em `destino` (caminho ou arquivo).
+
+    Returns:
+        dict: Parâmetros e economias do resumo
+    """
+    from distribuidoras import obter_distribuidora, obter_layout_distribuidora
+    from layout import criar_canvas, obter_perfil, renderizar_layout, tamanho_slot
+
+    nome_validado = validar_nome_completo(nome_completo)
+    unidades = normalizar_unidades(unidades)
+    if not unidades:
+        raise ValueError("Informe ao menos uma unidade consumidora")
+    if len(unidades) > MAX_UNIDADES:
+        raise ValueError(f"Máximo de {MAX_UNIDADES} unidades consumidoras por proposta")
+
+    # Snapshot: todas as páginas usam a mesma versão das tarifas
+    dados_distribuidora = obter_distribuidora(distribuidora)
+    parametros_unidades = calcular_unidades(nome_validado, unidades, dados_distribuidora)
+    resumo = somar_parametros(nome_validado, parametros_unidades)
+    logger.info(f"Gerando proposta de {len(unidades)} unidades para: {nome_validado}")
+
+    layout = obter_layout_distribuidora(dados_distribuidora)
+    nome_perfil, _ = obter_perfil(perfil)
+    p = criar_canvas(destino, layout, nome_perfil, f"Proposta - {nome_validado}")
+    resultado = None
+    paginas = _paginas_preparadas([resumo] + parametros_unidades, dados_distribuidora,
+                                  nome_perfil, tamanho_slot(layout, 'grafico'))
+    for pagina in paginas:
+        renderizar_layout(p, layout, pagina['contexto'], imagens={'grafico': pagina['grafico']},
+                          perfil=nome_perfil)
+        p.showPage()
+        if resultado is None:
+            resultado = pagina
+    with span('unidades.pdf_save', paginas=len(unidades) + 1):
+        p.save()
+
+    return {
+        'dados_processados': resumo,
+        'valor_desconto': resultado['valor_desconto'],
+        'economia_ano': resultado['economia_ano'],
+        'economia_5ano': resultado['economia_5ano'],
+    }
+
+
+def _unidades_historico(unidades):
+    """Unidades como dicts para o histórico (aceita EntradaUnidade ou dicts)"""
+    return [unidade._asdict() if isinstance(unidade, EntradaUnidade) else unidade for unidade in unidades]
+
+
+@rastrear('unidades.processar', raiz=True)
+def processar_proposta_unidades_webhook(nome_completo, unidades, distribuidora=None, perfil=None):
+    """
+    Processa os dados do webhook de várias unidades e gera a proposta PDF
+
+    Args:
+        nome_completo (str): Nome completo do cliente
+        unidades (list): EntradaUnidade ou dicts com 'endereco' e 'valor_fatura'
+        distribuidora (str): Código da distribuidora (None usa a padrão)
+        perfil (str): Perfil de saída do PDF (None usa o padrão)
+
+    Returns:
+        dict: Resultado do processamento com sucesso/erro e caminho do arquivo
+    """
+    from historico import STATUS_ERRO, STATUS_GERADA, descrever_arquivo, registrar_proposta
+
+    inicio = time.perf_counter()
+    registro = {
+        'tipo': 'unidades',
+        'nome': nome_completo,
+        'unidades': len(unidades),
+        'distribuidora': distribuidora,
+    }
+
+    try:
+        # Entradas normalizadas uma única vez (pela API ou aqui)
+        unidades = normalizar_unidades(unidades)
+        criar_diretorio_saida()
+        nome_arquivo = f"simulacao_{sanitizar_nome_arquivo(nome_completo)}_unidades.pdf"
+        arquivo_path = os.path.join(OUTPUT_DIR, nome_arquivo)
+        resultado = renderizar_proposta_unidades_pdf(nome_completo, unidades, arquivo_path, distribuidora, perfil)
+
+        resumo = resultado['dados_processados']
+        registro.update(descrever_arquivo(arquivo_path))
+        registro.update({
+            'status': STATUS_GERADA,
+            'endereco': resumo['endereco'],
+            'valor_fatura': resumo['valor_fatura_original'],
+            'distribuidora': resumo['distribuidora'],
+            'versao_tarifas': resumo['versao_tarifas'],
+            'valor_desconto': resultado['valor_desconto'],
+            'economia_ano': resultado['economia_ano'],
+            'economia_5ano': resultado['economia_5ano'],
+            'parametros': {'resumo': resumo, 'unidades': _unidades_historico(unidades)},
+            'duracao_ms': (time.perf_counter() - inicio) * 1000,
+        })
+        registrar_proposta(registro)
+
+        logger.info(f"Proposta de {len(unidades)} unidades gerada com sucesso: {arquivo_path}")
+        logger.info(f"Data/hora: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
+        return {
+            'sucesso': True,
+            'arquivo_path': arquivo_path,
+            'unidades': len(unidades),
+            **resultado,
+            'message': 'Proposta gerada com sucesso'
+        }
+
+    except Exception as e:
+        error_msg = f"Erro ao processar proposta: {str(e)}"
+        logger.error(error_msg, exc_info=True)
+        registro.update({
+            'status': STATUS_ERRO,
+            'parametros': {'unidades': _unidades_historico(unidades)},
+            'erro': str(e),
+            'duracao_ms': (time.perf_counter() - inicio) * 1000,
+        })
+        registrar_proposta(registro)
+        return {
+            'sucesso': False,
+            'erro': error_msg,
+            'arquivo_path': None
+        }